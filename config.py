@@ -43,8 +43,42 @@ CONFIG = {
     # "EUCLIDEAN": Más preciso, movimiento natural (usa raíz cuadrada).
     # "MANHATTAN": Más rápido, ideal para rejillas tipo ciudad (sin diagonales).
     # "DIAGONAL":  (Chebyshev) Rápido, permite diagonales pero menos preciso que Euclidean.
+    # "JPS":       Jump Point Search. Camino óptimo expandiendo muchos menos nodos en suelos abiertos.
+    # "NAVMESH":   Malla de rectángulos generada del walkmask. Pocos waypoints y trazado en línea recta.
+    # "HPA":       A* jerárquico por clusters. Para escenas muy anchas (panorámicas con parallax).
+    # "WEIGHTED":  A* ponderado. El camino cuesta como mucho PATHFINDING_EPSILON veces el óptimo (1.0 = óptimo).
+    # "ANYTIME":   ARA*. Primer camino rápido con ANYTIME_EPSILON_START y lo mejora mientras dure ANYTIME_BUDGET_MS.
+    # (EUCLIDEAN/MANHATTAN/DIAGONAL escalan la heurística x10 sobre píxeles: casi voraces, sin cota de calidad)
     "PATHFINDING_TYPE": "EUCLIDEAN",
     "PATHFINDING_GRID_SIZE": 10, # 5 para precisión alta, 20 para rendimiento/retro
+    "NAV_BAKE": True, # Usar backgrounds/*.nav horneados (python -m engine.navbake) si su hash coincide con la máscara
+    "PATHFINDING_BUDGET_MS": 2.0, # Tiempo máximo de búsqueda por frame; el resto sigue en los frames siguientes
+    "PATHFINDING_BUDGET_NODES": 0, # Alternativa: nodos expandidos por frame (0 = sin límite)
+    "PATH_WORKERS": 0, # Hilos del PathService. 0 = búsquedas por tramos en el hilo principal
+    "PATH_SMOOTHING": True, # Tensar caminos con línea de visión (cada escena puede cambiarlo con smooth_paths)
+    "PATH_CACHE_SIZE": 64, # Caminos recordados por escena (LRU). 0 = desactivado
+    "FLOW_FIELD_CACHE_SIZE": 8, # Campos de flujo recordados por escena (uno por destino)
+    "HPA_CLUSTER_SIZE": 10, # Celdas por lado de cada cluster en modo "HPA"
+    "NAVMESH_CELL_SIZE": 4, # Resolución (px) del muestreo del walkmask para la malla de navegación
+    "PATHFINDING_EPSILON": 1.5, # Modo "WEIGHTED": cota de calidad (1.5 = como mucho un 50% más largo que el óptimo)
+    "ANYTIME_EPSILON_START": 3.0, # Modo "ANYTIME": epsilon de la primera pasada (más alto = primer camino antes)
+    "ANYTIME_EPSILON_STEP": 0.5, # Cuánto baja epsilon en cada mejora
+    "ANYTIME_BUDGET_MS": 4.0, # Tiempo total por búsqueda "ANYTIME" (la primera pasada siempre se completa)
+    "POI_TABLE": True, # Al cargar cada escena: distancias a pie entre hotspots, salidas y entradas (scene.poi_table)
+    "POI_TABLE_BUDGET_MS": 1.0, # Tiempo por frame para rehacer los campos de la tabla cuando cambian los obstáculos
+
+    # --- ILUMINACIÓN ---
+    "LIGHTMAP_CELL": 8, # px de escena por muestra del lightmap (tinte del personaje). Más alto = menos memoria, luz más suave
+    "TINT_CACHE_SIZE": 64, # Frames del personaje ya tintados que se recuerdan (LRU). 0 = tintar en cada frame
+    "TINT_CACHE_STEP": 8, # El tinte se redondea a múltiplos de este valor por canal (paleta pequeña = más aciertos)
+    "LIGHT_SOFTNESS": 0.35, # Escenas oscuras: parte del radio de cada luz que se difumina (0 = círculo de borde duro)
+
+    # --- DIBUJADO ---
+    "BACKGROUND_CACHE": True, # Escenas con varias capas traseras: se componen en una superficie que se reutiliza mientras la cámara no se mueva
+    "DIRTY_RECTS": False, # Con la cámara quieta, repintar solo lo que cambia (personaje, animaciones, cursor, UI) con display.update
+    "DIRTY_RECTS_MAX": 12, # Más rects sucios que esto en un frame = redibujar todo
+    "DIRTY_RECTS_PASS_COST": 0.15, # Coste de una pasada recortada frente a un frame completo (medido ~0.27 ms / 1.9 ms). Decide entre una pasada por rect o una a la caja que los envuelve
+    "DIRTY_RECTS_MAX_AREA": 0.5, # Fracción de pantalla sucia a partir de la cual sale más barato redibujar todo
 
     # SISTEMA DE NARRACIÓN
     # "LUCAS": Texto flotante sobre la cabeza del personaje.
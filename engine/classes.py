@@ -3,8 +3,13 @@ import pygame
 import math
 import heapq
 import gc
+import time
 import json
+import queue
+import threading
 import yaml 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Imports desde CONFIG (Raíz)
 from config import (
@@ -13,6 +18,7 @@ from config import (
     CREDITS_TEXT, CHAR_DEFS, TEXT_CONFIG, VERBS_LOCALIZED, SCENE_NAMES
 )
 from engine.resources import RES_MANAGER
+from engine.navbake import NavBake
 from scenes.variables import GAME_STATE
 
 # ==========================================
@@ -102,7 +108,9 @@ class Scene:
                 auto_scroll_config=None,
                 transition_type=TRANSITION_FADE,
                 step_sound_key="step",
-                lightmap_file=None):           
+                lightmap_file=None,
+                smooth_paths=None, pathfinding_type=None, path_epsilon=None,
+                ambient_light=(0, 0, 0)):           
         self.id = scene_id 
         self.name = name
         self.step_sound_key = step_sound_key 
@@ -115,6 +123,10 @@ class Scene:
         self.is_dark = is_dark
         self.light_flag = light_flag
         self.light_radius = light_radius
+        # LUCES (escenas is_dark): las pinta LightCompositor. ambient_light = color de la zona sin luz
+        self.ambient_light = ambient_light
+        self.lights = []
+        if light_flag: self.add_light(radius=light_radius, flag=light_flag, follow="mouse") # Linterna clásica: sigue al ratón
         self.transition_type = transition_type
         self.parallax_paths = parallax_paths
         self.parallax_factors = parallax_factors
@@ -123,6 +135,9 @@ class Scene:
         self.parallax_layers_front = [] 
         self.auto_scroll_config = auto_scroll_config 
         self.auto_scroll_offset_x = 0.0      
+        self.background_cache = None # Capas traseras compuestas (ver draw_background_layers)
+        self.background_cache_key = None
+        self.render_queue = RenderQueue() # Personaje, hotspots y animaciones traseras ordenados por Y
         self.hotspot_data = [] 
         self.exits = []        
         self.walkable_area = None 
@@ -133,39 +148,61 @@ class Scene:
         self.ambient_data = []  
         self.ambient_anims = [] 
         self.lightmap_file = lightmap_file   
-        self.lightmap_surface = None         
-
-    def _draw_layer_group(self, screen, layer_group):
-        screen_h = screen.get_height() - UI_HEIGHT
+        self.lightmap = None # Lightmap reducido (rejilla RGB con muestreo bilineal)
+        self.smooth_paths = smooth_paths # None = usar CONFIG["PATH_SMOOTHING"]
+        self.pathfinding_type = pathfinding_type # None = CONFIG["PATHFINDING_TYPE"] (ej: "ANYTIME" en escenas donde prima la calidad)
+        self.path_epsilon = path_epsilon # None = CONFIG["PATHFINDING_EPSILON"] (modos "WEIGHTED" y "ANYTIME")
+        # PUNTOS DE INTERÉS: tabla de distancias a pie que se calcula al cargar (scripts: alcance y tiempos)
+        self.poi_points = {}   # Puntos extra de los scripts (add_poi)
+        self.entry_points = [] # (origen, (x, y)) donde aparece el jugador al entrar; lo rellena SceneManager
+        self.poi_table = None
+
+    def _draw_layer_group(self, screen, layer_group, screen_h=None):
+        if screen_h is None: screen_h = screen.get_height() - UI_HEIGHT
         screen_w = CONFIG["GAME_WIDTH"]
-        auto_layer_index = self.auto_scroll_config[0] if self.auto_scroll_config else -1
-        auto_offset_val = self.auto_scroll_offset_x if self.auto_scroll_config else 0
-        
-        for i, layer_data in enumerate(self.parallax_layers):
-             if layer_data not in layer_group: continue 
+        auto_layer = None
+        if self.auto_scroll_config and self.auto_scroll_config[0] < len(self.parallax_layers):
+            auto_layer = self.parallax_layers[self.auto_scroll_config[0]]
+
+        for layer_data in layer_group:
              img = layer_data["image"]
-             factor = layer_data["factor"]
-             img_w = img.get_width()
-             y_pos = screen_h - img.get_height()
-             
-             if i == auto_layer_index: offset_total = auto_offset_val
-             else: offset_total = self.camera_x * factor
-             
-             rel_x = (-offset_total) % img_w
-             start_x = rel_x - img_w
-             current_draw_x = start_x
-             while current_draw_x < screen_w:
-                 screen.blit(img, (int(current_draw_x), int(y_pos)))
-                 current_draw_x += img_w
+             if layer_data is auto_layer: offset_total = self.auto_scroll_offset_x
+             else: offset_total = self.camera_x * layer_data["factor"]
+             self._blit_wrapped(screen, img, offset_total, screen_h - img.get_height(), screen_w)
+
+    @staticmethod
+    def _blit_wrapped(screen, img, offset, y, screen_w):
+        """Capa que se repite en horizontal. load_assets la escala al menos al ancho de pantalla: como mucho dos blits."""
+        img_w = img.get_width()
+        x = int((-offset) % img_w)
+        if x > 0: screen.blit(img, (x - img_w, int(y)))
+        while x < screen_w:
+            screen.blit(img, (x, int(y)))
+            x += img_w
 
     def draw_background_layers(self, screen):
         if CONFIG.get("SHOW_WALKABLE_MASK", False):
-            if self.walkable_area and self.walkable_area.mask:
-                screen.blit(self.walkable_area.mask, (-int(self.camera_x), 0))
+            mask_surface = self.walkable_area.get_surface() if self.walkable_area else None
+            if mask_surface:
+                screen.blit(mask_surface, (-int(self.camera_x), 0))
             else:
                 screen.fill((255, 0, 0))
             return
-        self._draw_layer_group(screen, self.parallax_layers_back)
+        back = self.parallax_layers_back
+        # Una sola capa ya es una copia; con autoscroll el fondo cambia cada frame
+        if len(back) < 2 or self.auto_scroll_config or not CONFIG.get("BACKGROUND_CACHE", True):
+            self._draw_layer_group(screen, back)
+            return
+        # Capas traseras ya compuestas: se rehacen solo si cambia la cámara o alguna capa
+        key = (self.camera_x, screen.get_height(), tuple((id(l["image"]), l["factor"]) for l in back))
+        if key != self.background_cache_key:
+            size = (CONFIG["GAME_WIDTH"], screen.get_height() - UI_HEIGHT)
+            if self.background_cache is None or self.background_cache.get_size() != size:
+                self.background_cache = pygame.Surface(size, 0, screen)
+            self.background_cache.fill((0, 0, 0))
+            self._draw_layer_group(self.background_cache, back, size[1])
+            self.background_cache_key = key
+        screen.blit(self.background_cache, (0, 0))
 
     def draw_foreground_layers(self, screen):
         if CONFIG.get("SHOW_WALKABLE_MASK", False): return
@@ -180,11 +217,24 @@ class Scene:
     def add_hotspot_data(self, **kwargs): 
         self.hotspot_data.append(kwargs)
     
+    def add_poi(self, name, x, y): self.poi_points[name] = (x, y)
+
+    def collect_pois(self):
+        """Hotspots (su walk_to o el punto por defecto delante), salidas (su rect), entradas y puntos de scripts."""
+        pois = {}
+        for hs in self.hotspots.hotspots:
+            pois[hs.name] = hs.walk_to if hs.walk_to else (hs.rect.centerx, hs.rect.bottom + 10)
+        for ex in self.exits: pois[f"exit:{ex.target_scene}"] = ex.rect
+        for origin, point in self.entry_points: pois[f"spawn:{origin}"] = point
+        pois.update(self.poi_points)
+        return pois
+
     def add_exit(self, x, y, w, h, target_scene, spawn_x, spawn_y):
         rect = pygame.Rect(x, y, w, h)
         self.exits.append(SceneExit(rect, target_scene, spawn_x, spawn_y))
 
     def load_assets(self):
+        self.background_cache = None; self.background_cache_key = None
         self.parallax_layers = []
         self.parallax_layers_back = []
         self.parallax_layers_front = []
@@ -237,16 +287,18 @@ class Scene:
 
         if self.lightmap_file:
             path = os.path.join("backgrounds", self.lightmap_file)
-            try:
-                raw_lm = pygame.image.load(path).convert()
-                self.lightmap_surface = pygame.transform.scale(raw_lm, (self.scene_width, GAME_AREA_HEIGHT))
-            except: self.lightmap_surface = None
-        else: self.lightmap_surface = None
+            try: self.lightmap = Lightmap(pygame.image.load(path), self.scene_width, GAME_AREA_HEIGHT, CONFIG.get("LIGHTMAP_CELL", 8))
+            except (pygame.error, OSError, ValueError): self.lightmap = None
+        else: self.lightmap = None
 
+        grid_size = CONFIG["PATHFINDING_GRID_SIZE"]
         self.walkable_area = WalkableArea(self.mask_file, self.scene_width, GAME_AREA_HEIGHT)
-        self.walkable_area.load()
+        nav_bake = NavBake.open(self.mask_file, self.scene_width, GAME_AREA_HEIGHT, grid_size) if CONFIG.get("NAV_BAKE", True) else None
+        self.walkable_area.load(nav_bake)
         limit_rect = pygame.Rect(0, 0, self.scene_width, GAME_AREA_HEIGHT)
-        self.pathfinder = Pathfinding(self.walkable_area, grid_size=CONFIG["PATHFINDING_GRID_SIZE"], limit_rect=limit_rect)
+        self.pathfinder = Pathfinding(self.walkable_area, grid_size=grid_size, limit_rect=limit_rect, mode=self.pathfinding_type)
+        if self.smooth_paths is not None: self.pathfinder.smooth_paths = self.smooth_paths
+        if self.path_epsilon is not None: self.pathfinder.epsilon = self.path_epsilon
         
         self.hotspots.hotspots.empty()
         for data in self.hotspot_data:
@@ -270,18 +322,32 @@ class Scene:
             anim = AmbientAnimation(**d)
             self.ambient_anims.append(anim)
 
+        self.refresh_obstacles()
+        if CONFIG.get("POI_TABLE", True): self.poi_table = PoiTable(self.pathfinder, self.collect_pois())
+
+    def refresh_obstacles(self):
+        """Vuelca los sólidos al pathfinder. Los actores que se mueven van como obstáculos dinámicos."""
+        if not self.pathfinder: return
         obs_list = []        
         for hs in self.hotspots.hotspots:
             if getattr(hs, "solid", False): obs_list.append(hs.rect.inflate(10, 10))        
+        for key in list(self.pathfinder.dynamic_obstacles):
+            if key not in self.ambient_anims: self.pathfinder.remove_dynamic_obstacle(key)
         for anim in self.ambient_anims:
-            if anim.solid: obs_list.append(anim.rect.inflate(0, -4))
+            if not getattr(anim, "solid", False): continue
+            if anim.is_moving() or anim in self.pathfinder.dynamic_obstacles: self.pathfinder.set_dynamic_obstacle(anim, anim.rect.inflate(0, -4))
+            else: obs_list.append(anim.rect.inflate(0, -4))
         self.pathfinder.obstacles = obs_list
 
     def unload_assets(self):
+        self.background_cache = None; self.background_cache_key = None
+        self.render_queue = RenderQueue()
         self.parallax_layers = [] 
         self.parallax_layers_back = []
         self.parallax_layers_front = []
         if self.walkable_area: self.walkable_area.unload()
+        self.poi_table = None
+        self.lightmap = None
         self.pathfinder = None
         self.hotspots.hotspots.empty()
         self.ambient_anims = []
@@ -305,32 +371,23 @@ class Scene:
                  self.auto_scroll_offset_x %= layer_width
             
     def draw_sorted_elements(self, screen, character):
-        render_list = []        
-        char_tint = self.get_lighting_at(character.rect.centerx, character.rect.bottom)
-        render_list.append({
-            "y": character.rect.bottom, "type": "char",
-            "func": lambda: character.draw(screen, self.camera_x, tint_color=char_tint)
-        })        
-
-        for hs in self.hotspots.hotspots:
-            draw_pos_x = hs.rect.x - int(self.camera_x)
-            if -hs.rect.width < draw_pos_x < CONFIG["GAME_WIDTH"]:
-                render_list.append({
-                    "y": hs.rect.bottom, "type": "hotspot",
-                    "func": lambda img=hs.image, x=draw_pos_x, y=hs.rect.y: screen.blit(img, (x, y))
-                })
-
-        for anim in self.ambient_anims:
-            if anim.layer == "back":
-                draw_pos_x = anim.rect.x - int(self.camera_x)
-                if -anim.rect.width < draw_pos_x < CONFIG["GAME_WIDTH"]:
-                    render_list.append({
-                        "y": anim.rect.bottom, "type": "ambient",
-                        "func": lambda a=anim: a.draw(screen, self.camera_x)
-                    })
-        
-        render_list.sort(key=lambda item: item["y"])        
-        for item in render_list: item["func"]()
+        sources = [character]
+        sources += self.hotspots.hotspots.sprites()
+        sources += [anim for anim in self.ambient_anims if anim.layer == "back"]
+        queue = self.render_queue
+        queue.sync(sources); queue.sort()
+
+        cam = int(self.camera_x); screen_w = CONFIG["GAME_WIDTH"]
+        batch = []
+        for item in queue.items:
+            if item is character:
+                char_tint = self.get_lighting_at(character.rect.centerx, character.rect.bottom)
+                drawn = character.get_draw_surface(char_tint)
+                if drawn: batch.append((drawn[0], (drawn[1] - self.camera_x, drawn[2])))
+                continue
+            rect = item.rect; draw_pos_x = rect.x - cam
+            if -rect.width < draw_pos_x < screen_w: batch.append((item.image, (draw_pos_x, rect.y)))
+        if batch: screen.blits(batch, doreturn=False)
 
     def get_hotspot_at_mouse(self, screen_mx, screen_my):
         world_mx = screen_mx + self.camera_x
@@ -341,16 +398,34 @@ class Scene:
         return None
        
     def add_ambient(self, **kwargs): self.ambient_data.append(kwargs)
+    def add_light(self, **kwargs):
+        light = LightSource(**kwargs); self.lights.append(light)
+        return light
+    def send_crowd_to(self, x, y, anims=None):
+        """Manda a varios actores ambientales al mismo sitio con un único campo de flujo."""
+        if not self.pathfinder: return
+        field = self.pathfinder.flow_field(x, y)
+        for anim in (anims if anims is not None else self.ambient_anims): anim.follow_flow(field, self.pathfinder, (x, y))
+
     def update_ambient(self, dt):
-        for anim in self.ambient_anims: anim.update(dt)
+        pf = self.pathfinder
+        for anim in self.ambient_anims:
+            # Un sólido que echa a andar (scripts, caminos, campos) deja de ser obstáculo fijo antes de moverse
+            if anim.solid and pf and anim not in pf.dynamic_obstacles and anim.is_moving(): anim.register_obstacle(pf)
+            anim.update(dt)
+            # Sólidos en movimiento: solo cambia la rejilla cuando cruzan a otra celda
+            if anim.solid and pf and anim in pf.dynamic_obstacles:
+                pf.set_dynamic_obstacle(anim, anim.rect.inflate(0, -4))
     def draw_ambient(self, screen, layer_filter="back"):
         for anim in self.ambient_anims:
             if anim.layer == layer_filter: anim.draw(screen, self.camera_x)
     def get_lighting_at(self, x, y):
-        if not self.lightmap_surface: return (255, 255, 255) 
-        w, h = self.lightmap_surface.get_size()
-        safe_x = max(0, min(int(x), w - 1)); safe_y = max(0, min(int(y), h - 1))        
-        return self.lightmap_surface.get_at((safe_x, safe_y))[:3]
+        if not self.lightmap: return (255, 255, 255) 
+        return self.lightmap.sample(x, y)
+    def get_lighting_many(self, points):
+        """Tinte de luz para varias posiciones (x, y) de una vez (personajes, actores, objetos iluminados)."""
+        if not self.lightmap: return [(255, 255, 255)] * len(points)
+        return self.lightmap.sample_many(points)
 
 class SceneExit:
     def __init__(self, rect, target_scene, spawn_x, spawn_y):
@@ -522,10 +597,53 @@ class AmbientAnimation:
         self.start_pos = (x, y); self.exact_x = float(self.rect.x); self.exact_y = float(self.rect.y)
         self.target_pos = None; self.move_speed = move_speed; self.loop_move = loop_move; self.direction = (0, 0)
         
+        self.waypoints = []; self.path_ticket = None; self.flow = None; self.nav_pathfinder = None
+        self.flow_pathfinder = None; self.flow_goal = None; self.flow_generation = 0
+        
         if move_to:
             target_rect = self.rect.copy(); target_rect.midbottom = move_to
             self.target_pos = (target_rect.x, target_rect.y)
 
+    def navigate_to(self, x, y, pathfinder, service):
+        """Camina por el suelo de la escena hasta (x, y) pidiendo el camino al PathService."""
+        if self.path_ticket: service.cancel(self.path_ticket)
+        self.loop_move = False; self.nav_pathfinder = pathfinder
+        self.register_obstacle(pathfinder)
+        self.path_ticket = service.request(pathfinder, self.rect.centerx, self.rect.bottom, x, y, callback=self._on_path)
+
+    def follow_flow(self, field, pathfinder=None, goal=None):
+        """
+        Camina siguiendo un FlowField (varios actores pueden compartir el mismo). Con pathfinder y goal
+        el campo se vuelve a pedir cuando los obstáculos dinámicos lo invalidan (flow_generation).
+        """
+        self.flow = field; self.target_pos = None; self.waypoints = []; self.loop_move = False
+        self.flow_pathfinder = pathfinder if goal is not None else None; self.flow_goal = goal
+        self.flow_generation = pathfinder.flow_generation if pathfinder else 0
+        self.register_obstacle(pathfinder)
+
+    def _on_path(self, path):
+        self.path_ticket = None
+        self.waypoints = list(path) if path else []
+        if self.waypoints: self.register_obstacle(self.nav_pathfinder)
+        self._next_waypoint()
+
+    def is_moving(self):
+        return bool(self.flow or self.waypoints or self.target_pos or self.path_ticket)
+
+    def register_obstacle(self, pathfinder):
+        """Sólido que se mueve: quita su estampa fija de pathfinder.obstacles y pasa a obstáculo dinámico."""
+        if not self.solid or pathfinder is None: return
+        rect = self.rect.inflate(0, -4)
+        if self not in pathfinder.dynamic_obstacles and rect in pathfinder.obstacles:
+            obstacles = list(pathfinder.obstacles); obstacles.remove(rect)
+            pathfinder.obstacles = obstacles # Rehornea sin él (una vez, al echar a andar)
+        pathfinder.set_dynamic_obstacle(self, rect)
+
+    def _next_waypoint(self):
+        if not self.waypoints: self.target_pos = None; return
+        target_rect = self.rect.copy(); target_rect.midbottom = self.waypoints.pop(0)
+        self.target_pos = (target_rect.x, target_rect.y)
+
     def update(self, dt):
         self.anim_timer += dt * 1000
         if self.anim_timer >= self.anim_speed:
@@ -533,18 +651,33 @@ class AmbientAnimation:
             self.current_frame_index = (self.current_frame_index + 1) % len(self.frames)
             self.image = self.frames[self.current_frame_index]
 
-        if self.target_pos:
+        pf = self.flow_pathfinder
+        if self.flow and pf and pf.flow_generation != self.flow_generation:
+            # Algún obstáculo dinámico cambió campos: se pide el vigente (el mismo si no le afectó)
+            self.flow = pf.flow_field(*self.flow_goal); self.flow_generation = pf.flow_generation
+        if self.flow:
+            feet_x = self.exact_x + self.rect.width / 2; feet_y = self.exact_y + self.rect.height
+            dir_x, dir_y = self.flow.direction(feet_x, feet_y)
+            if dir_x == 0 and dir_y == 0: self.flow = None # Llegó (o no hay camino)
+            else:
+                point = self.flow.next_point(feet_x, feet_y)
+                step = min(self.move_speed * dt, math.hypot(point[0] - feet_x, point[1] - feet_y))
+                self.exact_x += dir_x * step; self.exact_y += dir_y * step
+                self.rect.x = int(self.exact_x); self.rect.y = int(self.exact_y)
+        elif self.target_pos:
             target_x, target_y = self.target_pos
             dx = target_x - self.exact_x; dy = target_y - self.exact_y
             distance = math.sqrt(dx**2 + dy**2)
             if distance > 1.0:
                 dir_x = dx / distance; dir_y = dy / distance
-                self.exact_x += dir_x * self.move_speed * dt; self.exact_y += dir_y * self.move_speed * dt
+                step = min(self.move_speed * dt, distance) # Sin pasarse del objetivo (waypoints cortos)
+                self.exact_x += dir_x * step; self.exact_y += dir_y * step
                 self.rect.x = int(self.exact_x); self.rect.y = int(self.exact_y)
             else:
                 if self.loop_move:
                     self.rect.midbottom = self.start_pos
                     self.exact_x = float(self.rect.x); self.exact_y = float(self.rect.y)
+                elif self.waypoints: self._next_waypoint()
                 else: self.target_pos = None
 
     def draw(self, screen, camera_x):
@@ -552,42 +685,496 @@ class AmbientAnimation:
         if -self.image.get_width() < draw_x < CONFIG["GAME_WIDTH"]:
             screen.blit(self.image, (draw_x, self.rect.y))
 
+class Lightmap:
+    """
+    Mapa de luz de la escena reducido a una rejilla RGB pequeña (una muestra cada `cell` px).
+    La imagen se promedia al cargar (smoothscale) y se consulta con interpolación bilineal, así
+    el tinte cambia suave al andar y ocupa ~cell² veces menos que la superficie a tamaño de escena.
+    """
+    def __init__(self, surface, width, height, cell=8):
+        self.width = width; self.height = height
+        self.cols = max(1, -(-width // cell)); self.rows = max(1, -(-height // cell))
+        if surface.get_bitsize() not in (24, 32): # smoothscale solo acepta 24/32 bits
+            full = pygame.Surface(surface.get_size(), 0, 32); full.blit(surface, (0, 0)); surface = full
+        small = pygame.transform.smoothscale(surface, (self.cols, self.rows))
+        self.data = pygame.image.tostring(small, "RGB") # cols * rows * 3 bytes
+        self.sx = self.cols / width; self.sy = self.rows / height # px de escena -> muestras
+
+    def sample(self, x, y):
+        """Color de luz (r, g, b) en un punto de la escena, interpolado. Fuera del mapa se usa el borde."""
+        return self.sample_many(((x, y),))[0]
+
+    def sample_many(self, points):
+        """sample() para una lista de puntos en una sola llamada (constantes fuera del bucle)."""
+        cols = self.cols; rows = self.rows; sx = self.sx; sy = self.sy; d = self.data
+        max_u = cols - 1.0; max_v = rows - 1.0; stride = cols * 3
+        out = []; append = out.append
+        for x, y in points:
+            u = x * sx - 0.5; v = y * sy - 0.5 # Cada muestra representa el centro de su celda
+            u = 0.0 if u < 0 else (max_u if u > max_u else u)
+            v = 0.0 if v < 0 else (max_v if v > max_v else v)
+            x0 = int(u); y0 = int(v); fx = u - x0; fy = v - y0
+            i00 = (y0 * cols + x0) * 3
+            dx = 3 if x0 + 1 < cols else 0; dy = stride if y0 + 1 < rows else 0
+            i01 = i00 + dx; i10 = i00 + dy; i11 = i10 + dx
+            w11 = fx * fy; w01 = fx - w11; w10 = fy - w11; w00 = 1 - fx - w10
+            append((int(d[i00] * w00 + d[i01] * w01 + d[i10] * w10 + d[i11] * w11 + 0.5),
+                    int(d[i00 + 1] * w00 + d[i01 + 1] * w01 + d[i10 + 1] * w10 + d[i11 + 1] * w11 + 0.5),
+                    int(d[i00 + 2] * w00 + d[i01 + 2] * w01 + d[i10 + 2] * w10 + d[i11 + 2] * w11 + 0.5)))
+        return out
+
+class LightSource:
+    """
+    Luz de una escena oscura. follow: None = punto fijo (x, y) de la escena, "mouse", "player" o el
+    nombre de un AmbientAnimation (ej: una hoguera). Solo luce si flag es None o está activo en GAME_STATE.
+    softness: parte del radio que se difumina (0 = borde duro, 1 = degradado desde el centro).
+    """
+    def __init__(self, x=0, y=0, radius=150, color=(255, 255, 255), softness=None, flag=None, follow=None, offset=(0, 0)):
+        self.x = x; self.y = y
+        self.radius = int(radius)
+        self.color = tuple(color)
+        self.softness = CONFIG.get("LIGHT_SOFTNESS", 0.35) if softness is None else softness
+        self.flag = flag
+        self.follow = follow
+        self.offset = offset
+        self.enabled = True
+
+class LightCompositor:
+    """
+    Oscuridad de las escenas is_dark sin crear superficies en cada frame.
+    Un buffer persistente se rellena con la luz ambiente, se le suma (BLEND_RGB_ADD) la textura de degradado
+    radial de cada luz, horneada una sola vez por (radio, color, suavidad), y se multiplica sobre la pantalla.
+    """
+    def __init__(self, width, height):
+        self.buffer = pygame.Surface((width, height))
+        self.textures = {}
+
+    @staticmethod
+    def bake_light(radius, color, softness):
+        """Círculo de luz: color pleno hasta radius * (1 - softness) y caída suave (smoothstep) hasta el borde."""
+        size = max(1, radius * 2)
+        texture = pygame.Surface((size, size)); texture.fill((0, 0, 0))
+        inner = radius * (1.0 - max(0.0, min(1.0, softness)))
+        for r in range(radius, 0, -1):
+            if r <= inner:
+                pygame.draw.circle(texture, color, (radius, radius), r); break
+            t = (radius - r) / (radius - inner); k = t * t * (3 - 2 * t)
+            pygame.draw.circle(texture, (int(color[0] * k), int(color[1] * k), int(color[2] * k)), (radius, radius), r)
+        return texture
+
+    def texture(self, light):
+        key = (light.radius, light.color, light.softness)
+        texture = self.textures.get(key)
+        if texture is None: texture = self.textures[key] = self.bake_light(*key)
+        return texture
+
+    def light_position(self, light, scene, player=None, mouse_pos=(0, 0)):
+        """Centro de la luz en pantalla, o None si lo que sigue no está en la escena."""
+        follow = light.follow
+        if follow == "mouse": x, y = mouse_pos; return x + light.offset[0], y + light.offset[1]
+        if follow == "player":
+            if player is None: return None
+            x, y = player.rect.centerx - scene.camera_x, player.rect.centery
+        elif follow:
+            anim = next((a for a in scene.ambient_anims if a.name == follow), None)
+            if anim is None: return None
+            x, y = anim.rect.centerx - scene.camera_x, anim.rect.centery
+        else: x, y = light.x - scene.camera_x, light.y
+        return x + light.offset[0], y + light.offset[1]
+
+    def draw(self, screen, scene, player=None, mouse_pos=(0, 0)):
+        buffer = self.buffer
+        buffer.fill(scene.ambient_light)
+        for light in scene.lights:
+            if not light.enabled or light.radius <= 0 or (light.flag and not GAME_STATE.get(light.flag, False)): continue
+            pos = self.light_position(light, scene, player, mouse_pos)
+            if pos is None: continue
+            buffer.blit(self.texture(light), (int(pos[0]) - light.radius, int(pos[1]) - light.radius), special_flags=pygame.BLEND_RGB_ADD)
+        screen.blit(buffer, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+
+class RenderQueue:
+    """
+    Cola de dibujado por profundidad (rect.bottom) que se conserva entre frames.
+    Solo se rehace cuando cambian los elementos (objeto recogido, animación nueva). Como el orden en Y
+    apenas varía de un frame a otro, reordenar la lista del frame anterior es casi lineal.
+    """
+    def __init__(self):
+        self.items = []   # Orden de dibujado del último frame
+        self.sources = [] # Elementos tal y como llegaron (para detectar cambios)
+        self.rebuilds = 0
+
+    def sync(self, sources):
+        if sources == self.sources: return
+        previous = {id(item): i for i, item in enumerate(self.items)}
+        # Los que ya estaban conservan su orden; los nuevos van al final hasta el sort
+        self.items = sorted(sources, key=lambda item: previous.get(id(item), len(previous)))
+        self.sources = sources; self.rebuilds += 1
+
+    def sort(self):
+        # Timsort detecta los tramos ya ordenados: sobre el orden del frame anterior es ~O(n)
+        self.items.sort(key=_depth_key)
+
+def _depth_key(item): return item.rect.bottom
+
+class DirtyRectTracker:
+    """
+    Modo de dibujado por rectángulos sucios (cámara quieta).
+    Cada frame recibe los elementos que pueden cambiar como {clave: (rect en pantalla, firma)} y los compara
+    con el frame anterior: lo que aparece, desaparece, se mueve o cambia de firma (frame, tinte, texto...)
+    aporta su rect viejo y el nuevo. update() devuelve esos rects fusionados, [] si no cambió nada, o
+    None si hay que redibujar todo (primer frame, invalidate(), otra clave de frame o demasiada área sucia).
+    """
+    def __init__(self, screen_rect, max_rects=None, max_area=None, pass_cost=None):
+        self.screen_rect = pygame.Rect(screen_rect)
+        self.max_rects = max_rects if max_rects is not None else CONFIG.get("DIRTY_RECTS_MAX", 12)
+        self.max_area = max_area if max_area is not None else CONFIG.get("DIRTY_RECTS_MAX_AREA", 0.5) # Fracción de pantalla
+        self.pass_cost = pass_cost if pass_cost is not None else CONFIG.get("DIRTY_RECTS_PASS_COST", 0.15) # Fracción de un frame completo
+        self.items = {}
+        self.frame_key = None
+        self.full = True
+        self.full_frames = 0; self.partial_frames = 0; self.idle_frames = 0
+
+    def invalidate(self): self.full = True
+
+    def update(self, frame_key, items):
+        """frame_key None = este frame no admite redibujado parcial (transición, menú, cámara moviéndose...)."""
+        full = self.full or frame_key is None or frame_key != self.frame_key
+        old_items = self.items
+        self.items = items; self.frame_key = frame_key; self.full = False
+        if full:
+            self.full_frames += 1
+            return None
+        rects = []
+        for key, (rect, signature) in items.items():
+            old = old_items.get(key)
+            if old is None: rects.append(rect)
+            elif old[0] != rect or old[1] != signature: rects.append(old[0]); rects.append(rect)
+        for key, (rect, _) in old_items.items():
+            if key not in items: rects.append(rect)
+        rects = self.merge([r.clip(self.screen_rect) for r in rects])
+        if not rects:
+            self.idle_frames += 1
+            return []
+        if len(rects) > self.max_rects or sum(r.w * r.h for r in rects) > self.max_area * self.screen_rect.w * self.screen_rect.h:
+            self.full_frames += 1
+            return None
+        self.partial_frames += 1
+        return rects
+
+    def draw_passes(self, rects):
+        """
+        Zonas (set_clip) en las que repintar unos rects sucios. Cada pasada recorre la escena entera, así que
+        cuesta pass_cost más su área: una pasada por rect o una sola a la caja que los envuelve, la más barata.
+        """
+        if len(rects) < 2: return list(rects)
+        screen_area = self.screen_rect.w * self.screen_rect.h; c = self.pass_cost
+        bounds = rects[0].unionall(rects[1:])
+        separate = len(rects) * c + (1 - c) * sum(r.w * r.h for r in rects) / screen_area
+        single = c + (1 - c) * bounds.w * bounds.h / screen_area
+        return list(rects) if separate <= single else [bounds]
+
+    @staticmethod
+    def merge(rects):
+        """Une los rects que se solapan o se tocan hasta que no quede ninguno solapado."""
+        merged = []
+        for rect in rects:
+            if not rect.w or not rect.h: continue
+            rect = rect.copy(); i = 0
+            while i < len(merged):
+                if rect.inflate(2, 2).colliderect(merged[i]): rect.union_ip(merged.pop(i)); i = 0
+                else: i += 1
+            merged.append(rect)
+        return merged
+
 class WalkableArea:
+    """
+    Suelo pisable de la escena como máscara de 1 bit (pygame.mask.Mask): canal rojo > 50 = pisable.
+    La imagen se umbraliza una vez al cargar y no se guarda; is_walkable comprueba límites sin excepciones.
+    """
     def __init__(self, mask_file, width, height):
         self.mask_file = mask_file
         self.width = width
         self.height = height
-        self.mask = None 
-        self.default_mask = pygame.Surface((width, height))
-        self.default_mask.fill((255, 255, 255))
+        self.mask = None # pygame.mask.Mask (ancho x alto)
+        self.nav_bake = None # Horneado .nav (engine/navbake.py): máscara de 1 bit sin decodificar la imagen
+        self._debug_surface = None; self._outlines = None # Render de la máscara para F4 / overlay (bajo demanda)
+
+    def load(self, nav_bake=None):
+        self.nav_bake = nav_bake
+        if nav_bake: return # OPTIMIZACIÓN: con horneado válido no se decodifica ni se escala la imagen
+        self._decode()
 
-    def load(self):
+    def _decode(self):
+        surface = None
         if self.mask_file:
-            path = os.path.join("backgrounds", self.mask_file)
-            try:
-                surface = pygame.image.load(path).convert()
-                self.mask = pygame.transform.scale(surface, (self.width, self.height))
-            except: self.mask = self.default_mask
-        else: self.mask = self.default_mask
+            try: surface = pygame.image.load(os.path.join("backgrounds", self.mask_file)).convert()
+            except (pygame.error, OSError, FileNotFoundError): surface = None
+        if surface is None: self.mask = pygame.mask.Mask((self.width, self.height), fill=True) # Sin máscara: todo pisable
+        else: self.set_mask_surface(pygame.transform.scale(surface, (self.width, self.height)))
+
+    def set_mask_surface(self, surface):
+        """Umbraliza una imagen de suelo (blanco = pisable) a la máscara de 1 bit."""
+        # |rojo - 153| < 103  <=>  rojo > 50; verde y azul valen cualquier cosa
+        self.mask = pygame.mask.from_threshold(surface, (153, 128, 128, 255), (103, 129, 129, 255))
+        self._debug_surface = None; self._outlines = None
+
+    def unload(self): self.mask = None; self.nav_bake = None; self._debug_surface = None; self._outlines = None
+
+    def get_mask(self):
+        """Máscara de 1 bit. Con horneado se desempaqueta de sus bits solo al pedirla (F4 / overlay)."""
+        if self.mask is None and self.nav_bake:
+            bake = self.nav_bake; w, h = bake.width, bake.height
+            unpack = [bytes((v >> k) & 1 for k in range(8)) for v in range(256)]
+            surface = pygame.image.frombytes(b"".join([unpack[v] for v in bake.bits])[:w * h], (w, h), "P")
+            surface.set_palette([(0, 0, 0), (255, 255, 255)] + [(0, 0, 0)] * 254); surface.set_colorkey(0)
+            self.mask = pygame.mask.from_surface(surface)
+        return self.mask
+
+    def get_surface(self):
+        """Máscara como imagen en blanco y negro (F4). Se genera una vez desde la máscara de 1 bit."""
+        if self._debug_surface is None:
+            mask = self.get_mask()
+            if mask is None: return None
+            surface = mask.to_surface(setcolor=(255, 255, 255, 255), unsetcolor=(0, 0, 0, 255))
+            self._debug_surface = surface.convert() if pygame.display.get_surface() else surface
+        return self._debug_surface
+
+    def get_outlines(self, min_size=50, every=4):
+        """Contornos de cada zona de suelo (para el overlay de debug). Se calculan una vez."""
+        if self._outlines is None:
+            mask = self.get_mask()
+            self._outlines = [c.outline(every) for c in mask.connected_components(min_size)] if mask else []
+        return self._outlines
 
-    def unload(self): self.mask = None 
-            
     def is_walkable(self, x, y):
-        target_mask = self.mask if self.mask else self.default_mask
-        try:
-            if x < 0 or x >= target_mask.get_width() or y < 0 or y >= target_mask.get_height(): return False
-            return target_mask.get_at((int(x), int(y)))[0] > 50 
-        except: return False
+        if self.nav_bake: return self.nav_bake.is_walkable(x, y)
+        if x < 0 or y < 0 or x >= self.width or y >= self.height: return False
+        mask = self.mask
+        return mask is None or mask.get_at((int(x), int(y))) == 1 # Sin cargar: todo pisable (como antes)
 
 class Pathfinding:
-    def __init__(self, walkable_area, grid_size=15, limit_rect=None): 
+    def __init__(self, walkable_area, grid_size=15, limit_rect=None, mode=None): 
         self.walkable_area = walkable_area
         self.grid_size = grid_size
         self.limit_rect = limit_rect if limit_rect else pygame.Rect(0,0,800,600)
-        self.obstacles = []
         
         # OPTIMIZACIÓN: Guardar el modo en una variable local al iniciar
-        self.mode = CONFIG.get("PATHFINDING_TYPE", "EUCLIDEAN") 
+        self.mode = mode or CONFIG.get("PATHFINDING_TYPE", "EUCLIDEAN") 
+        self.smooth_paths = CONFIG.get("PATH_SMOOTHING", True) # Quitar waypoints intermedios en línea recta
+        # A* PONDERADO ("WEIGHTED") y ANYTIME: coste del camino <= epsilon x óptimo
+        self.epsilon = CONFIG.get("PATHFINDING_EPSILON", 1.5)
+        self.anytime_start = CONFIG.get("ANYTIME_EPSILON_START", 3.0)
+        self.anytime_step = CONFIG.get("ANYTIME_EPSILON_STEP", 0.5)
+        self.anytime_budget_ms = CONFIG.get("ANYTIME_BUDGET_MS", 4.0)
+        self.last_bound = None # Cota garantizada del último camino ANYTIME (1.0 = óptimo)
+
+        # REJILLA DE OCUPACIÓN: 1 byte por celda (1 = pisable, 0 = bloqueada)
+        # base_grid solo tiene la máscara; grid añade los obstáculos encima.
+        self.grid_cols = max(0, (self.limit_rect.right - 1) // grid_size + 1)
+        self.grid_rows = max(0, (self.limit_rect.bottom - 1) // grid_size + 1)
+        self.base_grid = None
+        self.grid = None
+        self._obstacles = []
+        self.last_expanded = 0 # Nodos expandidos en la última búsqueda (debug / benchmarks)
+        self._padded_grid = None; self._padded_source = None # Copia con borde para JPS
+        # MALLA DE NAVEGACIÓN (solo en modo "NAVMESH")
+        self.navmesh_cell = CONFIG.get("NAVMESH_CELL_SIZE", 4)
+        self._navmesh_base = None
+        self.navmesh = None
+        # CACHÉ LRU DE CAMINOS: (celda origen, celda destino) -> camino (o None si es inalcanzable)
+        self.path_cache = OrderedDict()
+        self.path_cache_size = CONFIG.get("PATH_CACHE_SIZE", 64)
+        self.cache_hits = 0; self.cache_misses = 0
+        self.cache_lock = threading.Lock() # Con PATH_WORKERS las búsquedas arrancan en los hilos del PathService
+        # ISLAS DE SUELO: etiqueta de componente conexa por celda (0 = bloqueada)
+        self.labels = []; self.component_sizes = [0]
+        # MAPA DE SUELO MÁS CERCANO: celda -> celda pisable más próxima (para find_nearest_walkable)
+        self.nearest_map = []
+        # OBSTÁCULOS DINÁMICOS (actores sólidos que se mueven): se estampan sobre static_grid sin rehornear.
+        # Islas y mapa de suelo más cercano se quedan con la parte estática.
+        self.static_grid = None
+        self.dynamic_obstacles = {} # clave -> (c0, c1, r0, r1) celdas que ocupa
+        self.dirty_cells = set()    # Celdas cambiadas que el replanificador aún no ha visto
+        self.replanner = None       # D* Lite del camino en curso (repair_path)
+        # MODO "HPA": grafo de clusters precalculado sobre la rejilla estática
+        self.hpa_cluster = CONFIG.get("HPA_CLUSTER_SIZE", 10)
+        self.hpa = None
+        # CAMPOS DE FLUJO por celda destino (multitudes hacia un mismo sitio)
+        self.flow_fields = OrderedDict()
+        self.flow_cache_size = CONFIG.get("FLOW_FIELD_CACHE_SIZE", 8)
+        self.flow_generation = 0 # Sube cada vez que se descartan campos: los agentes que siguen uno lo vuelven a pedir
+        self.build_grid()
+
+    @property
+    def obstacles(self): return self._obstacles
+
+    @obstacles.setter
+    def obstacles(self, rect_list):
+        # Al reasignar la lista se vuelve a hornear la rejilla (ej: al recoger un objeto sólido)
+        self._obstacles = list(rect_list)
+        self.bake_obstacles()
+
+    def build_grid(self):
+        """Muestrea la máscara de suelo una sola vez por celda (en la esquina de la celda, igual que find_path)."""
+        bake = self._nav_bake()
+        self.base_grid = bake.grid if bake else self._sample_walkmask(self.grid_size)
+        # Modo NAVMESH: muestreo más fino (independiente de la rejilla) para no perder pasillos estrechos
+        if self.mode == "NAVMESH":
+            self._navmesh_base = self._sample_walkmask(self.navmesh_cell)
+        self.bake_obstacles()
+
+    def _nav_bake(self):
+        """Horneado de la máscara si sirve para esta rejilla (mismo tamaño de celda y límites = toda la escena)."""
+        bake = getattr(self.walkable_area, "nav_bake", None)
+        if bake and bake.grid_size == self.grid_size and tuple(self.limit_rect) == (0, 0, bake.width, bake.height): return bake
+        return None
+
+    def _sample_walkmask(self, cell_size):
+        cols = max(0, (self.limit_rect.right - 1) // cell_size + 1)
+        rows = max(0, (self.limit_rect.bottom - 1) // cell_size + 1)
+        base = bytearray(cols * rows)
+        if self.walkable_area:
+            # Máscara de 1 bit (o su horneado): consulta directa con límites comprobados
+            is_walkable = self.walkable_area.is_walkable; limit = self.limit_rect
+            for cy in range(rows):
+                py = cy * cell_size
+                if py < limit.top: continue
+                row_start = cy * cols
+                for cx in range(cols):
+                    px = cx * cell_size
+                    if px >= limit.left and is_walkable(px, py): base[row_start + cx] = 1
+        return base
+
+    def _stamp_obstacles(self, grid, cell_size):
+        cols = max(0, (self.limit_rect.right - 1) // cell_size + 1)
+        rows = max(0, (self.limit_rect.bottom - 1) // cell_size + 1)
+        for rect in self._obstacles:
+            # Celdas cuya esquina cae dentro del rect (mismo criterio que Rect.collidepoint)
+            c0 = max(0, -(-rect.left // cell_size)); c1 = min(cols, -(-rect.right // cell_size))
+            r0 = max(0, -(-rect.top // cell_size)); r1 = min(rows, -(-rect.bottom // cell_size))
+            if c0 >= c1: continue
+            blocked = bytes(c1 - c0)
+            for cy in range(r0, r1):
+                start = cy * cols + c0
+                grid[start:start + (c1 - c0)] = blocked
+        return grid
+
+    def bake_obstacles(self):
+        # Cambian los obstáculos -> los caminos y campos guardados ya no son fiables
+        self.path_cache.clear()
+        self.flow_fields.clear(); self.flow_generation += 1
+        self.reset_replanner()
+        if self.base_grid is None: return
+        self.grid = self.static_grid = self._stamp_obstacles(bytearray(self.base_grid), self.grid_size)
+        bake = self._nav_bake()
+        if bake and not self._obstacles:
+            # Islas y mapa horneados (sin obstáculos): vistas del mmap, sin recalcular
+            self.labels = bake.labels; self.component_sizes = bake.component_sizes; self.nearest_map = bake.nearest
+        else:
+            self.label_components()
+            self.build_nearest_map()
+        if self.mode == "HPA": self.hpa = HPAGraph(self.static_grid, self.grid_cols, self.grid_rows, self.hpa_cluster)
+        if self.dynamic_obstacles:
+            grid = bytearray(self.static_grid)
+            for c in self._dynamic_cells(self.dynamic_obstacles.values()): grid[c] = 0
+            self.grid = grid
+        if self._navmesh_base is not None:
+            cs = self.navmesh_cell
+            cells = self._stamp_obstacles(bytearray(self._navmesh_base), cs)
+            cols = max(0, (self.limit_rect.right - 1) // cs + 1)
+            rows = max(0, (self.limit_rect.bottom - 1) // cs + 1)
+            self.navmesh = NavMesh(cells, cols, rows, cs)
+
+    def _dynamic_cells(self, spans):
+        cols = self.grid_cols; cells = set()
+        for c0, c1, r0, r1 in spans:
+            for cy in range(r0, r1): cells.update(range(cy * cols + c0, cy * cols + c1))
+        return cells
+
+    def set_dynamic_obstacle(self, key, rect):
+        """Coloca (o mueve) un obstáculo dinámico. Solo toca la rejilla si cambia de celdas."""
+        gs = self.grid_size
+        span = (max(0, -(-rect.left // gs)), min(self.grid_cols, -(-rect.right // gs)),
+                max(0, -(-rect.top // gs)), min(self.grid_rows, -(-rect.bottom // gs)))
+        old = self.dynamic_obstacles.get(key)
+        if old == span: return
+        self.dynamic_obstacles[key] = span
+        self._restamp_dynamic([old, span] if old else [span])
+
+    def remove_dynamic_obstacle(self, key):
+        old = self.dynamic_obstacles.pop(key, None)
+        if old: self._restamp_dynamic([old])
+
+    def _restamp_dynamic(self, spans):
+        if self.static_grid is None: return
+        occupied = self._dynamic_cells(self.dynamic_obstacles.values())
+        grid = bytearray(self.grid) # Copia nueva: las búsquedas en curso conservan su foto
+        changed = []
+        for c in self._dynamic_cells(spans):
+            value = 0 if c in occupied else self.static_grid[c]
+            if grid[c] != value: grid[c] = value; self.dirty_cells.add(c); changed.append(c)
+        if changed:
+            self.grid = grid
+            self.path_cache.clear()
+            # Solo se descartan los campos que alcanzaban alguna celda cambiada (los de otras islas siguen valiendo)
+            stale = [cell for cell, field in self.flow_fields.items() if field.touches(changed)]
+            for cell in stale: del self.flow_fields[cell]
+            if stale: self.flow_generation += 1
+
+    def flow_field(self, goal_x, goal_y):
+        """Campo de flujo hacia (goal_x, goal_y), compartido por todos los agentes con ese destino."""
+        if self.grid is None: return None
+        gs = self.grid_size; cols = self.grid_cols
+        cell = min(max(int(goal_y // gs), 0), self.grid_rows - 1) * cols + min(max(int(goal_x // gs), 0), cols - 1)
+        if not self.grid[cell] and self.nearest_map and self.nearest_map[cell] >= 0: cell = self.nearest_map[cell]
+        field = self.flow_fields.get(cell)
+        if field is None:
+            field = FlowField(self.grid, cols, self.grid_rows, gs, cell)
+            self.flow_fields[cell] = field
+            if len(self.flow_fields) > self.flow_cache_size: self.flow_fields.popitem(last=False)
+        else: self.flow_fields.move_to_end(cell)
+        return field
+
+    def reset_replanner(self):
+        self.replanner = None; self.dirty_cells = set()
+
+    def path_blocked(self, points):
+        """True si algún tramo del camino ya no tiene línea de visión en la rejilla actual."""
+        gs = self.grid_size; cols = self.grid_cols; rows = self.grid_rows
+        cells = [(min(max(int(x // gs), 0), cols - 1), min(max(int(y // gs), 0), rows - 1)) for x, y in points]
+        for (x0, y0), (x1, y1) in zip(cells, cells[1:]):
+            # Pasos de una celda: mismo criterio que el A* (solo cuenta la celda de llegada)
+            if abs(x1 - x0) <= 1 and abs(y1 - y0) <= 1:
+                if not self.grid[y1 * cols + x1]: return True
+            elif not self.line_of_sight(x0, y0, x1, y1): return True
+        return False
+
+    def repair_path(self, start_x, start_y, goal_x, goal_y):
+        """
+        Rehace el camino tras mover obstáculos dinámicos con D* Lite: si el destino no cambia
+        se reutiliza la búsqueda anterior y solo se reparan las celdas de dirty_cells.
+        """
+        if self.grid is None: return None
+        gs = self.grid_size; cols = self.grid_cols; rows = self.grid_rows
+        start_cell = min(max(int(start_y // gs), 0), rows - 1) * cols + min(max(int(start_x // gs), 0), cols - 1)
+        goal_cell = min(max(int(goal_y // gs), 0), rows - 1) * cols + min(max(int(goal_x // gs), 0), cols - 1)
+        planner = self.replanner
+        if planner is None or planner.goal != goal_cell:
+            planner = self.replanner = DStarLite(self, start_cell, goal_cell)
+        else:
+            planner.move_start(start_cell)
+            planner.update_cells(self.dirty_cells)
+        self.dirty_cells = set()
+        cells = planner.plan()
+        if cells is None: return None
+        path = [((c % cols) * gs, (c // cols) * gs) for c in cells]
+        path[-1] = (goal_x, goal_y)
+        if self.smooth_paths: path = self.smooth_path(path)
+        return path
+
+    def is_cell_walkable(self, cx, cy):
+        if cx < 0 or cy < 0 or cx >= self.grid_cols or cy >= self.grid_rows: return False
+        return self.grid[cy * self.grid_cols + cx] == 1
     
     def heuristic(self, x1, y1, x2, y2):
         # Usar self.mode es más rápido que consultar el diccionario CONFIG cada vez
@@ -598,6 +1185,10 @@ class Pathfinding:
         else: return math.hypot(dx, dy) * 10 # EUCLIDEAN
     
     def is_position_valid(self, x, y):
+        # Los puntos alineados a la rejilla se resuelven con una sola lectura
+        gs = self.grid_size
+        if self.grid is not None and x % gs == 0 and y % gs == 0:
+            return self.is_cell_walkable(int(x // gs), int(y // gs))
         if not self.limit_rect.collidepoint(x, y): return False
         for rect in self.obstacles: 
             if rect.collidepoint(x, y): return False 
@@ -605,20 +1196,57 @@ class Pathfinding:
 
     def get_neighbors(self, node):
         neighbors = []
+        gs = self.grid_size; cols = self.grid_cols; rows = self.grid_rows; grid = self.grid
+        cx = node.x // gs; cy = node.y // gs
         directions = [(0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (-1, 1), (1, -1), (1, 1)]
         for dx, dy in directions:
-            new_x = node.x + dx * self.grid_size
-            new_y = node.y + dy * self.grid_size
-            if self.is_position_valid(new_x, new_y):
+            nx = cx + dx; ny = cy + dy
+            if 0 <= nx < cols and 0 <= ny < rows and grid[ny * cols + nx]:
                 cost = 14 if dx != 0 and dy != 0 else 10
-                neighbors.append((new_x, new_y, cost))
+                neighbors.append((nx * gs, ny * gs, cost))
         return neighbors
     
+    def build_nearest_map(self):
+        """
+        Transformada de distancia en dos pasadas: para cada celda guarda la celda pisable
+        más cercana (-1 si no hay ninguna). Cada celda hereda el "sitio" de sus vecinas ya
+        visitadas si queda más cerca, primero de arriba-izquierda y luego de abajo-derecha.
+        """
+        cols = self.grid_cols; rows = self.grid_rows; grid = self.grid
+        near = [i if grid[i] else -1 for i in range(cols * rows)]
+        passes = ((range(rows), range(cols), ((-1, 0), (-1, -1), (0, -1), (1, -1))),
+                  (range(rows - 1, -1, -1), range(cols - 1, -1, -1), ((1, 0), (1, 1), (0, 1), (-1, 1))))
+        for ys, xs, offsets in passes:
+            for cy in ys:
+                for cx in xs:
+                    i = cy * cols + cx
+                    if grid[i]: continue
+                    best = near[i]
+                    best_d = (best % cols - cx) ** 2 + (best // cols - cy) ** 2 if best >= 0 else -1
+                    for dx, dy in offsets:
+                        nx = cx + dx; ny = cy + dy
+                        if nx < 0 or ny < 0 or nx >= cols or ny >= rows: continue
+                        site = near[ny * cols + nx]
+                        if site < 0: continue
+                        d = (site % cols - cx) ** 2 + (site // cols - cy) ** 2
+                        if best_d < 0 or d < best_d: best = site; best_d = d
+                    near[i] = best
+        self.nearest_map = near
+
     def find_nearest_walkable(self, x, y, max_radius=200, step=None):
-        if step is None: step = self.grid_size 
         x = max(self.limit_rect.left, min(x, self.limit_rect.right))
         y = max(self.limit_rect.top, min(y, self.limit_rect.bottom))
         if self.is_position_valid(x, y): return (x, y)
+        # Una sola lectura en el mapa precalculado (celda pisable más cercana)
+        if self.nearest_map:
+            gs = self.grid_size
+            cx = min(int(x // gs), self.grid_cols - 1); cy = min(int(y // gs), self.grid_rows - 1)
+            site = self.nearest_map[cy * self.grid_cols + cx]
+            if site < 0: return None
+            px = (site % self.grid_cols) * gs; py = (site // self.grid_cols) * gs
+            if (px - x) ** 2 + (py - y) ** 2 > max_radius ** 2: return None
+            return (px, py)
+        if step is None: step = self.grid_size 
         for r in range(step, max_radius, step):
             points = 8 
             for i in range(points):
@@ -628,13 +1256,345 @@ class Pathfinding:
                 if self.is_position_valid(check_x, check_y): return (check_x, check_y)
         return None
 
-    def find_path(self, start_x, start_y, goal_x, goal_y):
+    def find_path(self, start_x, start_y, goal_x, goal_y, snap_to_reachable=False):
+        """
+        Camino desde (start_x, start_y) hasta el destino o None.
+        Si el destino cae en otra isla de suelo se responde None al instante; con
+        snap_to_reachable=True se camina a la celda más cercana de la isla del origen.
+        """
+        search = self.start_search(start_x, start_y, goal_x, goal_y, snap_to_reachable)
+        search.step()
+        while search.refining(): search.refine() # ANYTIME: mejoras hasta agotar su presupuesto
+        return search.path
+
+    def start_search(self, start_x, start_y, goal_x, goal_y, snap_to_reachable=False):
+        """Prepara una búsqueda reanudable (PathSearch). Caché, islas y modos rápidos la dejan ya resuelta."""
         gx, gy = self.find_nearest_walkable(goal_x, goal_y) or (goal_x, goal_y)
-        start_node_pos = (int(start_x // self.grid_size) * self.grid_size, int(start_y // self.grid_size) * self.grid_size)
-        goal_node_pos = (int(gx // self.grid_size) * self.grid_size, int(gy // self.grid_size) * self.grid_size)
+        # Clave cuantizada: en NAVMESH a la resolución de la malla (sus caminos dependen del punto exacto)
+        q = self.navmesh_cell if self.navmesh is not None else self.grid_size
+        key = (int(start_x // q), int(start_y // q), int(gx // q), int(gy // q), snap_to_reachable)
+        with self.cache_lock: # Los workers de PathService buscan a la vez: LRU y contadores bajo el cerrojo
+            hit = self.path_cache.get(key)
+            if hit is not None: self.path_cache.move_to_end(key); self.cache_hits += 1
+            else: self.cache_misses += 1
+        if hit is not None:
+            path, exact = hit
+            # Copia: Movement consume la lista. El último punto es el destino exacto de esta petición
+            if path:
+                path = list(path)
+                if exact: path[-1] = (gx, gy)
+            search = PathSearch(self); search.done = True; search.path = search.raw_path = path
+            return search
+        search = PathSearch(self, key, (gx, gy))
+        if self.navmesh is not None:
+            self.navmesh.last_expanded = 0
+            search.finish(self.navmesh.find_path(start_x, start_y, gx, gy), fix_goal=False)
+            self.last_expanded = self.navmesh.last_expanded
+            return search
+        gs = self.grid_size
+        start_node_pos = (int(start_x // gs) * gs, int(start_y // gs) * gs)
+        goal_node_pos = (int(gx // gs) * gs, int(gy // gs) * gs)
+        if start_node_pos == goal_node_pos:
+            search.finish([(gx, gy)])
+            return search
+        
+        # Núcleo rápido sobre la rejilla; el de objetos Node queda para arranques fuera de ella
+        scx = start_node_pos[0] // gs; scy = start_node_pos[1] // gs
+        if self.grid is not None and 0 <= scx < self.grid_cols and 0 <= scy < self.grid_rows:
+            cols = self.grid_cols
+            start_cell = scy * cols + scx
+            gcx = goal_node_pos[0] // gs; gcy = goal_node_pos[1] // gs
+            goal_cell = gcy * cols + gcx if (0 <= gcx < cols and 0 <= gcy < self.grid_rows) else -1
+            # Componentes conexas: si el destino está en otra isla no hace falta buscar
+            comps = self.start_components(start_cell)
+            if goal_cell < 0 or self.labels[goal_cell] not in comps:
+                if not snap_to_reachable or not comps:
+                    search.finish(None)
+                    return search
+                goal_cell = self.nearest_cell_in(gcx, gcy, comps)
+                search.goal = ((goal_cell % cols) * gs, (goal_cell // cols) * gs)
+                if goal_cell == start_cell:
+                    search.finish([search.goal])
+                    return search
+            if goal_cell >= 0 and not self.grid[goal_cell] and self.static_grid[goal_cell]:
+                # Destino tapado por un obstáculo dinámico (islas y mapa de suelo no lo ven):
+                # se camina a la celda libre más cercana en vez de agotar la isla buscando
+                goal_cell = self.nearest_cell_in(gcx, gcy, comps, free_only=True)
+                if goal_cell < 0:
+                    search.finish(None)
+                    return search
+                search.goal = ((goal_cell % cols) * gs, (goal_cell // cols) * gs)
+                if goal_cell == start_cell:
+                    search.finish([search.goal])
+                    return search
+            # JPS y HPA ya son rápidos: se resuelven enteros. El A* normal queda pendiente para step()
+            cells = None
+            if self.mode == "HPA" and self.hpa:
+                cells = self.hpa.find_cells(start_cell, goal_cell); self.last_expanded = self.hpa.last_expanded
+            if self.mode == "JPS": search.finish_cells(self._search_jps(start_cell, goal_cell))
+            elif self.mode == "ANYTIME": search.begin_anytime(start_cell, goal_cell) # Reanudable: primer camino y mejoras por tramos
+            elif cells: search.finish_cells(cells)
+            else: search.begin(start_cell, goal_cell) # (HPA sin conexión entre clusters: A* normal)
+        else:
+            search.finish(self._find_path_nodes(start_node_pos, goal_node_pos))
+        return search
+
+    def goal_cells_for(self, targets):
+        """
+        Celdas destino de una consulta multidestino: {celda pisable: punto al que caminar}.
+        Un Rect (ej: una salida) se rasteriza a las celdas cuya esquina cae dentro; una lista
+        de puntos (walk_to alternativos) da una celda por punto. Lo bloqueado pasa a su suelo más cercano.
+        """
+        gs = self.grid_size; cols = self.grid_cols; rows = self.grid_rows
+        if self.grid is None or not cols or not rows: return {}
+        if isinstance(targets, pygame.Rect):
+            c0 = max(0, -(-targets.left // gs)); c1 = min(cols, -(-targets.right // gs))
+            r0 = max(0, -(-targets.top // gs)); r1 = min(rows, -(-targets.bottom // gs))
+            points = [(cx * gs, cy * gs) for cy in range(r0, r1) for cx in range(c0, c1)] or [targets.center]
+        else: points = list(targets)
+        goals = {}
+        for x, y in points:
+            cell = min(max(int(y // gs), 0), rows - 1) * cols + min(max(int(x // gs), 0), cols - 1)
+            if self.grid[cell]: goals.setdefault(cell, (x, y)); continue
+            site = self.nearest_map[cell] if self.nearest_map else -1
+            if site >= 0: goals.setdefault(site, ((site % cols) * gs, (site // cols) * gs))
+        return goals
+
+    def start_search_any(self, start_x, start_y, targets):
+        """Como start_search pero hacia el destino más barato de varios (una sola búsqueda, sin caché)."""
+        search = PathSearch(self)
+        goals = self.goal_cells_for(targets)
+        gs = self.grid_size; cols = self.grid_cols
+        scx = int(start_x // gs); scy = int(start_y // gs)
+        if not goals or not (0 <= scx < cols and 0 <= scy < self.grid_rows):
+            search.finish(None); return search
+        start_cell = scy * cols + scx
+        comps = self.start_components(start_cell)
+        goals = {c: p for c, p in goals.items() if self.labels[c] in comps} # Solo los de la isla del origen
+        if not goals: search.finish(None); return search
+        if start_cell in goals:
+            search.goal = goals[start_cell]; search.finish([search.goal]); return search
+        search.goal = next(iter(goals.values()))
+        search.begin(start_cell, -1, goal_points=goals)
+        return search
+
+    def find_path_any(self, start_x, start_y, targets):
+        """Camino al destino alcanzable más barato (Rect o lista de puntos) o None. El último punto es el elegido."""
+        search = self.start_search_any(start_x, start_y, targets)
+        search.step()
+        return search.path
+
+    def cache_path(self, key, path, requested):
+        if self.path_cache_size <= 0: return
+        # Solo un camino que acaba en el punto pedido admite cambiar su último punto al acertar en caché
+        exact = bool(path) and path[-1] == requested
+        with self.cache_lock:
+            self.path_cache[key] = (None if path is None else list(path), exact)
+            if len(self.path_cache) > self.path_cache_size: self.path_cache.popitem(last=False)
+
+    def line_of_sight(self, x0, y0, x1, y1):
+        """
+        Recorre en supercover todas las celdas que toca el segmento (celdas como cuadrados
+        centrados en su esquina de muestreo). Si pasa justo por un vértice exige las dos
+        celdas laterales libres, así nunca corta una esquina bloqueada.
+        """
+        cols = self.grid_cols; grid = self.grid
+        dx = x1 - x0; dy = y1 - y0
+        nx = abs(dx); ny = abs(dy)
+        sx = 1 if dx > 0 else -1; sy = 1 if dy > 0 else -1
+        x = x0; y = y0; ix = 0; iy = 0
+        while ix < nx or iy < ny:
+            decision = (1 + 2 * ix) * ny - (1 + 2 * iy) * nx
+            if decision == 0:
+                if not grid[y * cols + x + sx] or not grid[(y + sy) * cols + x]: return False
+                x += sx; y += sy; ix += 1; iy += 1
+            elif decision < 0: x += sx; ix += 1
+            else: y += sy; iy += 1
+            if not grid[y * cols + x]: return False
+        return True
+
+    def smooth_path(self, path):
+        """Tensa el camino: solo quedan los waypoints de las esquinas (el resto tiene línea de visión)."""
+        if self.grid is None or not path or len(path) < 3: return path
+        gs = self.grid_size; cols = self.grid_cols; rows = self.grid_rows
+        cells = [(min(max(int(x // gs), 0), cols - 1), min(max(int(y // gs), 0), rows - 1)) for x, y in path]
+        smoothed = [path[0]]; ax, ay = cells[0]
+        for i in range(2, len(path)):
+            if not self.line_of_sight(ax, ay, cells[i][0], cells[i][1]):
+                smoothed.append(path[i - 1]); ax, ay = cells[i - 1]
+        smoothed.append(path[-1])
+        return smoothed
+
+    def label_components(self):
+        """Etiqueta las islas de suelo de la rejilla (8-vecindad, igual que get_neighbors). 0 = bloqueada."""
+        cols = self.grid_cols; rows = self.grid_rows; grid = self.grid
+        n = cols * rows
+        labels = [0] * n; sizes = [0]
+        for i in range(n):
+            if not grid[i] or labels[i]: continue
+            label = len(sizes); labels[i] = label
+            stack = [i]; count = 0
+            while stack:
+                c = stack.pop(); count += 1
+                cx = c % cols
+                x0 = -1 if cx > 0 else 0; x1 = 2 if cx < cols - 1 else 1
+                for row in (c - cols, c, c + cols):
+                    if row < 0 or row >= n: continue
+                    for nc in range(row + x0, row + x1):
+                        if grid[nc] and not labels[nc]: labels[nc] = label; stack.append(nc)
+            sizes.append(count)
+        self.labels = labels
+        self.component_sizes = sizes
+
+    def start_components(self, cell):
+        """Islas alcanzables desde una celda (si está bloqueada, las de sus vecinas pisables)."""
+        labels = self.labels
+        if labels[cell]: return {labels[cell]}
+        cols = self.grid_cols; cx = cell % cols; comps = set()
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                nx = cx + dx; nc = cell + dy * cols + dx
+                if 0 <= nx < cols and 0 <= nc < len(labels) and labels[nc]: comps.add(labels[nc])
+        return comps
+
+    def nearest_cell_in(self, cx, cy, comps, free_only=False):
+        """
+        Celda más cercana a (cx, cy) que pertenece a alguna de las islas dadas (búsqueda en anillos).
+        free_only=True descarta además las ocupadas ahora por obstáculos dinámicos.
+        """
+        cols = self.grid_cols; rows = self.grid_rows; labels = self.labels; grid = self.grid
+        cx = min(max(cx, 0), cols - 1); cy = min(max(cy, 0), rows - 1)
+        best = -1; best_d = None
+        for r in range(max(cols, rows)):
+            if best_d is not None and r * r > best_d: break
+            if r == 0: ring = [(cx, cy)]
+            else:
+                ring = [(x, y) for x in range(cx - r, cx + r + 1) for y in (cy - r, cy + r)]
+                ring += [(x, y) for y in range(cy - r + 1, cy + r) for x in (cx - r, cx + r)]
+            for x, y in ring:
+                if 0 <= x < cols and 0 <= y < rows and labels[y * cols + x] in comps:
+                    if free_only and not grid[y * cols + x]: continue
+                    d = (x - cx) ** 2 + (y - cy) ** 2
+                    if best_d is None or d < best_d: best = y * cols + x; best_d = d
+        return best
+
+    def _search_grid(self, start_cell, goal_cell, max_iterations=10000):
+        """A* completo sobre la rejilla (ver PathSearch). Devuelve la lista de celdas o None."""
+        search = PathSearch(self)
+        search.begin(start_cell, goal_cell, max_iterations)
+        search.run()
+        return search.cells
+
+    def _search_jps(self, start_cell, goal_cell, max_iterations=10000):
+        """
+        Jump Point Search sobre la misma rejilla de 8 vecinos (con corte de esquinas, como get_neighbors).
+        Solo se meten en la cola los puntos de salto; los tramos rectos o diagonales entre ellos
+        se recorren escaneando la rejilla. Coste 10/14 y heurística octil: camino óptimo.
+        Devuelve la lista de celdas (rellenando los tramos entre saltos) o None.
+        """
+        cols = self.grid_cols
+        if goal_cell < 0 or not self.grid[goal_cell]: self.last_expanded = 0; return None
+        # Trabajamos sobre una copia con borde de 1 celda bloqueada: sin comprobar límites al escanear
+        W = cols + 2
+        P = self._get_padded_grid()
+        gx = goal_cell % cols; gy = goal_cell // cols
+        goal_p = (gy + 1) * W + gx + 1
+        start_p = (start_cell // cols + 1) * W + start_cell % cols + 1
+
+        def jump_straight(i, step, side):
+            # side = desplazamiento perpendicular (W en horizontal, 1 en vertical)
+            while True:
+                i += step
+                if not P[i]: return -1
+                if i == goal_p: return i
+                if (P[i + step + side] and not P[i + side]) or (P[i + step - side] and not P[i - side]): return i
+
+        def jump(i, dx, dy):
+            if dy == 0: return jump_straight(i, dx, W)
+            if dx == 0: return jump_straight(i, dy * W, 1)
+            step = dx + dy * W; vstep = dy * W
+            while True:
+                i += step
+                if not P[i]: return -1
+                if i == goal_p: return i
+                if (P[i - dx + vstep] and not P[i - dx]) or (P[i + dx - vstep] and not P[i - vstep]): return i
+                if jump_straight(i, dx, W) >= 0 or jump_straight(i, vstep, 1) >= 0: return i
+
+        def directions(i, p):
+            # Vecinos naturales + forzados según la dirección de llegada (poda de simetrías)
+            if p < 0: return [(dx, dy) for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (-1, 1), (1, -1), (1, 1)) if P[i + dx + dy * W]]
+            x = i % W; y = i // W; px = p % W; py = p // W
+            dx = (x > px) - (x < px); dy = (y > py) - (y < py)
+            if dx != 0 and dy != 0:
+                dirs = [(dx, 0), (0, dy), (dx, dy)]
+                if not P[i - dx]: dirs.append((-dx, dy))
+                if not P[i - dy * W]: dirs.append((dx, -dy))
+            elif dx != 0:
+                dirs = [(dx, 0)]
+                if not P[i + W]: dirs.append((dx, 1))
+                if not P[i - W]: dirs.append((dx, -1))
+            else:
+                dirs = [(0, dy)]
+                if not P[i + 1]: dirs.append((1, dy))
+                if not P[i - 1]: dirs.append((-1, dy))
+            return dirs
+
+        def octile(i):
+            ddx = abs(i % W - 1 - gx); ddy = abs(i // W - 1 - gy)
+            return 10 * (ddx + ddy) - 6 * min(ddx, ddy)
+
+        g_score = {start_p: 0}; parent = {start_p: -1}; closed = set()
+        open_heap = [(octile(start_p), start_p)]
+        iterations = 0; expanded = 0
+        while open_heap and iterations < max_iterations:
+            iterations += 1
+            _, current = heapq.heappop(open_heap)
+            if current in closed: continue
+            if current == goal_p:
+                self.last_expanded = expanded
+                jumps = []
+                while current != -1: jumps.append(current); current = parent[current]
+                jumps.reverse()
+                # Rellenamos las celdas intermedias de cada salto (siempre recto o diagonal puro)
+                cells = []
+                for a, b in zip(jumps, jumps[1:] + [None]):
+                    ax = a % W - 1; ay = a // W - 1
+                    cells.append(ay * cols + ax)
+                    if b is None: break
+                    bx = b % W - 1; by = b // W - 1
+                    sx = (bx > ax) - (bx < ax); sy = (by > ay) - (by < ay)
+                    for _ in range(max(abs(bx - ax), abs(by - ay)) - 1):
+                        ax += sx; ay += sy
+                        cells.append(ay * cols + ax)
+                return cells
+            closed.add(current); expanded += 1
+            current_g = g_score[current]
+            for dx, dy in directions(current, parent[current]):
+                jp = jump(current, dx, dy)
+                if jp < 0 or jp in closed: continue
+                steps = max(abs(jp % W - current % W), abs(jp // W - current // W))
+                new_g = current_g + steps * (14 if dx != 0 and dy != 0 else 10)
+                if new_g < g_score.get(jp, new_g + 1):
+                    g_score[jp] = new_g; parent[jp] = current
+                    heapq.heappush(open_heap, (new_g + octile(jp), jp))
+        self.last_expanded = expanded
+        return None
+
+    def _get_padded_grid(self):
+        """Rejilla con un borde de celdas bloqueadas (se regenera si cambian los obstáculos)."""
+        if self._padded_grid is None or self._padded_source is not self.grid:
+            cols = self.grid_cols; W = cols + 2
+            padded = bytearray(W * (self.grid_rows + 2))
+            for cy in range(self.grid_rows):
+                start = (cy + 1) * W + 1
+                padded[start:start + cols] = self.grid[cy * cols:(cy + 1) * cols]
+            self._padded_grid = padded; self._padded_source = self.grid
+        return self._padded_grid
+
+    def _find_path_nodes(self, start_node_pos, goal_node_pos):
+        """Búsqueda clásica con objetos Node. Devuelve las posiciones del camino o None."""
         start_node = Node(start_node_pos[0], start_node_pos[1])
         goal_node = Node(goal_node_pos[0], goal_node_pos[1])
-        if start_node == goal_node: return [(gx, gy)]
         open_list = []; heapq.heappush(open_list, start_node)
         open_dict = {(start_node.x, start_node.y): start_node}
         closed_set = set()
@@ -646,9 +1606,7 @@ class Pathfinding:
             if abs(current.x - goal_node.x) < self.grid_size and abs(current.y - goal_node.y) < self.grid_size:
                 path = []
                 while current: path.append((current.x, current.y)); current = current.parent
-                path = path[::-1]; 
-                if path: path[-1] = (gx, gy) 
-                return path
+                return path[::-1]
             closed_set.add((current.x, current.y))
             for nx, ny, cost in self.get_neighbors(current):
                 if (nx, ny) in closed_set: continue
@@ -660,6 +1618,1007 @@ class Pathfinding:
                 open_dict[(nx, ny)] = neighbor
         return None
 
+class PathSearch:
+    """
+    A* sobre arrays planos indexados por id de celda (cy * cols + cx) que se puede pausar.
+    g, padre y estado (0 nuevo, 1 abierto, 2 cerrado) viven en listas/bytearray y el
+    montículo son dos listas paralelas (f, celda). El montículo replica el algoritmo de
+    heapq comparando solo f (como Node.__lt__), así los empates se resuelven igual que
+    en _find_path_nodes y los caminos salen idénticos.
+    step() avanza como mucho max_ms milisegundos o max_expansions nodos; mientras no
+    termina, partial_path() da el camino hasta el nodo más cercano al destino.
+    """
+    def __init__(self, pathfinder, key=None, goal=None):
+        self.pathfinder = pathfinder
+        self.key = key; self.goal = goal
+        self.requested = goal # Destino pedido: goal puede moverse a otra celda (isla u obstáculo dinámico)
+        self.done = False; self.cancelled = False
+        self.path = None; self.raw_path = None; self.cells = None
+        self.heap_c = None # Sin A* pendiente hasta begin()
+        self.goal_points = None
+        self.anytime = None # ARA* (modo "ANYTIME"), ver begin_anytime
+        self.improvements = 0
+
+    def begin(self, start_cell, goal_cell, max_iterations=10000, goal_points=None):
+        """goal_points ({celda: punto}) convierte la búsqueda en multidestino: vale la primera que se alcance."""
+        pf = self.pathfinder
+        n = pf.grid_cols * pf.grid_rows
+        self.start_cell = start_cell; self.goal_cell = goal_cell
+        self.goal_points = goal_points
+        self.max_iterations = max_iterations; self.iterations = 0; self.expanded = 0
+        self.g_score = [0] * n; self.parent = [-1] * n; self.state = bytearray(n)
+        self.grid = pf.grid # Foto de la rejilla: bake_obstacles la sustituye, nunca la modifica
+        self.heap_f = [0]; self.heap_c = [start_cell]
+        self.state[start_cell] = 1
+        self.best_cell = start_cell; self.best_h = None
+
+    def begin_anytime(self, start_cell, goal_cell):
+        """
+        ARA* por tramos: step() entrega el primer camino en cuanto sale la primera pasada y
+        refine() sigue bajando epsilon en frames posteriores, hasta anytime_budget_ms de trabajo.
+        """
+        pf = self.pathfinder
+        self.start_cell = start_cell; self.goal_cell = goal_cell
+        self.anytime = AnytimeSearch(pf.grid, pf.grid_cols, pf.grid_rows, start_cell, goal_cell,
+                                     max(pf.anytime_start, 1.0), pf.anytime_step)
+        self.anytime_ms = 0.0 # Tiempo gastado en mejoras (la primera pasada no cuenta)
+
+    def refining(self):
+        """True mientras una búsqueda ANYTIME ya entregada puede mejorar su camino."""
+        a = self.anytime
+        return (self.done and not self.cancelled and a is not None and self.path is not None and not a.finished
+                and self.anytime_ms < self.pathfinder.anytime_budget_ms)
+
+    def refine(self, max_ms=None):
+        """Una mejora ANYTIME dentro de max_ms (y de lo que quede de anytime_budget_ms). True si el camino mejoró."""
+        if not self.refining(): return False
+        pf = self.pathfinder
+        budget = pf.anytime_budget_ms - self.anytime_ms
+        if max_ms is not None: budget = min(budget, max_ms)
+        t0 = time.perf_counter()
+        improved = self.anytime.advance(t0 + budget / 1000.0)
+        self.anytime_ms += (time.perf_counter() - t0) * 1000.0
+        if not improved or self.anytime.cells is None: return False
+        pf.last_expanded = self.anytime.expanded; pf.last_bound = self.anytime.bound
+        self.finish_cells(self.anytime.cells); self.improvements += 1
+        return True
+
+    def step(self, max_ms=None, max_expansions=None):
+        """Avanza la búsqueda dentro del presupuesto. Devuelve True cuando hay resultado."""
+        if self.done or self.cancelled: return self.done
+        deadline = time.perf_counter() + max_ms / 1000.0 if max_ms else None
+        if self.run(max_expansions, deadline): self.finish_cells(self.cells)
+        return self.done
+
+    def cancel(self):
+        """Aborta la búsqueda. Si corre en un hilo, run() lo ve en su siguiente comprobación y se para."""
+        self.cancelled = True
+        if self.anytime is not None: self.anytime.cancelled = True
+        self.heap_f = self.heap_c = self.g_score = self.parent = self.state = self.grid = None
+        self.anytime = None
+
+    def finish_cells(self, cells):
+        if cells is None: self.finish(None); return
+        if self.goal_points: self.goal = self.goal_points.get(cells[-1], self.goal) # Destino elegido
+        gs = self.pathfinder.grid_size; cols = self.pathfinder.grid_cols
+        self.finish([((c % cols) * gs, (c // cols) * gs) for c in cells])
+
+    def finish(self, path, fix_goal=True):
+        if path and fix_goal: path[-1] = self.goal
+        pf = self.pathfinder
+        self.raw_path = path # Sin suavizar: comparte prefijo con partial_path()
+        if path and pf.smooth_paths and pf.navmesh is None: path = pf.smooth_path(path)
+        self.path = path; self.done = True
+        if self.key is not None: self.pathfinder.cache_path(self.key, path, self.requested)
+
+    def partial_path(self):
+        """Camino hasta el mejor nodo encontrado hasta ahora ([] si aún no hay ninguno)."""
+        if self.done: return self.path or []
+        if self.heap_c is None or self.best_cell == self.start_cell: return []
+        gs = self.pathfinder.grid_size; cols = self.pathfinder.grid_cols
+        cells = []; current = self.best_cell
+        while current != -1: cells.append(current); current = self.parent[current]
+        return [((c % cols) * gs, (c // cols) * gs) for c in reversed(cells)]
+
+    def run(self, max_expansions=None, deadline=None):
+        """Bucle A*. Devuelve True al terminar (self.cells = celdas o None) y False si se agota el presupuesto."""
+        pf = self.pathfinder
+        anytime = self.anytime
+        if anytime is not None:
+            # ARA*: termina con la primera pasada (las mejoras van por refine()); el presupuesto es de tiempo
+            if not anytime.advance(deadline) and not anytime.finished: return False
+            self.cells = anytime.cells
+            pf.last_expanded = anytime.expanded; pf.last_bound = anytime.bound
+            return True
+        cols = pf.grid_cols; rows = pf.grid_rows; grid = self.grid; gs = pf.grid_size
+        goal_cell = self.goal_cell
+        g_score = self.g_score; parent = self.parent; state = self.state
+        heap_f = self.heap_f; heap_c = self.heap_c
+        goal_px = (goal_cell % cols) * gs if goal_cell >= 0 else 0
+        goal_py = (goal_cell // cols) * gs if goal_cell >= 0 else 0
+        mode = pf.mode; hypot = math.hypot; perf_counter = time.perf_counter
+        h_scale = max(pf.epsilon, 1.0) / gs # WEIGHTED: octil en celdas (x10, admisible) por epsilon
+        # MULTIDESTINO: h = distancia octil a la caja de las celdas destino (admisible y consistente),
+        # así la primera celda destino que sale del montículo es la más barata
+        goal_set = self.goal_points
+        if goal_set:
+            bx0 = min(c % cols for c in goal_set) * gs; bx1 = max(c % cols for c in goal_set) * gs
+            by0 = min(c // cols for c in goal_set) * gs; by1 = max(c // cols for c in goal_set) * gs
+        neighbor_steps = [(0, -1, 10), (0, 1, 10), (-1, 0, 10), (1, 0, 10), (-1, -1, 14), (-1, 1, 14), (1, -1, 14), (1, 1, 14)]
+        best_cell = self.best_cell; best_h = self.best_h
+        iterations = self.iterations; expanded = self.expanded; max_iterations = self.max_iterations
+        budget_end = expanded + max_expansions if max_expansions else None
+        paused = False
+        
+        while heap_c and iterations < max_iterations:
+            # Presupuesto por frame (el reloj se consulta cada 32 expansiones para no pagarlo siempre)
+            if budget_end is not None and expanded >= budget_end: paused = True; break
+            if not (iterations & 31) and (self.cancelled or (deadline is not None and perf_counter() >= deadline)): paused = True; break
+            iterations += 1
+            # --- heappop (mismo algoritmo que heapq._siftup / _siftdown) ---
+            last_f = heap_f.pop(); last_c = heap_c.pop()
+            if heap_c:
+                current = heap_c[0]
+                pos = 0; end = len(heap_c); child = 1
+                while child < end:
+                    right = child + 1
+                    if right < end and not heap_f[child] < heap_f[right]: child = right
+                    heap_f[pos] = heap_f[child]; heap_c[pos] = heap_c[child]
+                    pos = child; child = 2 * pos + 1
+                while pos > 0:
+                    up = (pos - 1) >> 1
+                    if last_f < heap_f[up]:
+                        heap_f[pos] = heap_f[up]; heap_c[pos] = heap_c[up]; pos = up
+                    else: break
+                heap_f[pos] = last_f; heap_c[pos] = last_c
+            else: current = last_c
+
+            if current == goal_cell or (goal_set and current in goal_set):
+                pf.last_expanded = expanded
+                cells = []
+                while current != -1: cells.append(current); current = parent[current]
+                self.cells = cells[::-1]
+                return True
+            if state[current] == 2: continue # Entrada obsoleta: ya se expandió con mejor g
+            state[current] = 2; expanded += 1
+            
+            cx = current % cols; cy = current // cols; current_g = g_score[current]
+            for dx, dy, cost in neighbor_steps:
+                nx = cx + dx; ny = cy + dy
+                if nx < 0 or ny < 0 or nx >= cols or ny >= rows: continue
+                nb = current + dy * cols + dx
+                if not grid[nb] or state[nb] == 2: continue
+                new_g = current_g + cost
+                if state[nb] == 1 and g_score[nb] <= new_g: continue
+                
+                if goal_set:
+                    px = nx * gs; py = ny * gs
+                    ddx = bx0 - px if px < bx0 else (px - bx1 if px > bx1 else 0)
+                    ddy = by0 - py if py < by0 else (py - by1 if py > by1 else 0)
+                    h = (10 * (ddx + ddy) - 6 * min(ddx, ddy)) / gs
+                else:
+                    ddx = abs(nx * gs - goal_px); ddy = abs(ny * gs - goal_py)
+                    if mode == "MANHATTAN": h = (ddx + ddy) * 10 * 10
+                    elif mode == "DIAGONAL": h = (10 * (ddx + ddy) + (14 - 2 * 10) * min(ddx, ddy)) * 10
+                    elif mode == "WEIGHTED": h = (10 * (ddx + ddy) - 6 * min(ddx, ddy)) * h_scale
+                    else: h = hypot(ddx, ddy) * 10 * 10
+                f = new_g + h
+                g_score[nb] = new_g; parent[nb] = current; state[nb] = 1
+                if best_h is None or h < best_h: best_h = h; best_cell = nb
+                
+                # --- heappush ---
+                pos = len(heap_c); heap_f.append(f); heap_c.append(nb)
+                while pos > 0:
+                    up = (pos - 1) >> 1
+                    if f < heap_f[up]:
+                        heap_f[pos] = heap_f[up]; heap_c[pos] = heap_c[up]; pos = up
+                    else: break
+                heap_f[pos] = f; heap_c[pos] = nb
+        self.iterations = iterations; self.expanded = expanded
+        self.best_cell = best_cell; self.best_h = best_h
+        if paused: return False
+        pf.last_expanded = expanded
+        self.cells = None
+        return True
+
+class AnytimeSearch:
+    """
+    ARA* (A* anytime) sobre la rejilla de 8 vecinos con costes 10/14.
+    Cada pasada es un A* ponderado con f = g + epsilon * h (h octil: admisible y consistente),
+    así que su camino cuesta como mucho epsilon veces el óptimo. Entre pasadas epsilon baja
+    y se reaprovechan los g ya calculados: solo se vuelven a abrir los nodos que mejoraron.
+    bound es la cota demostrada del último camino: min(epsilon, g(destino) / min(g + h) abiertos).
+    """
+    STEPS = ((0, -1, 10), (0, 1, 10), (-1, 0, 10), (1, 0, 10), (-1, -1, 14), (-1, 1, 14), (1, -1, 14), (1, 1, 14))
+
+    def __init__(self, grid, cols, rows, start_cell, goal_cell, epsilon=3.0, step=0.5, max_iterations=20000):
+        self.grid = grid; self.cols = cols; self.rows = rows
+        self.start = start_cell; self.goal = goal_cell
+        self.epsilon = epsilon; self.step = step; self.max_iterations = max_iterations
+        self.g = {start_cell: 0}; self.parent = {start_cell: -1}
+        self.closed = set(); self.incons = set()
+        self.open = [(self.epsilon * self.h(start_cell), start_cell)]
+        self.cells = None; self.bound = None
+        self.expanded = 0; self.iterations = 0
+        self.solutions = 0; self.finished = False # finished: óptimo (cota 1.0), inalcanzable o sin iteraciones
+        self.cancelled = False
+
+    def h(self, cell):
+        cols = self.cols
+        dx = abs(cell % cols - self.goal % cols); dy = abs(cell // cols - self.goal // cols)
+        return 10 * (dx + dy) - 6 * min(dx, dy)
+
+    def improve(self, deadline=None):
+        """Primera pasada completa; las siguientes solo mientras quede tiempo. Devuelve las celdas o None."""
+        self.advance(None)
+        while not self.finished and (deadline is None or time.perf_counter() < deadline): self.advance(deadline)
+        return self.cells
+
+    def advance(self, deadline=None):
+        """
+        Sigue la pasada en curso hasta deadline (None = sin límite; se puede retomar en otra llamada).
+        Devuelve True al terminar una pasada: hay camino nuevo en cells (o None si es inalcanzable).
+        """
+        if self.finished: return False
+        if not self._improve_path(deadline): return False # Sin tiempo (o sin iteraciones: finished)
+        self.solutions += 1
+        goal_g = self.g.get(self.goal)
+        if goal_g is None: self.cells = None; self.bound = None; self.finished = True; return True # Inalcanzable
+        cells = []; current = self.goal
+        while current != -1: cells.append(current); current = self.parent[current]
+        self.cells = cells[::-1]
+        lows = [self.g[c] + self.h(c) for _, c in self.open if c not in self.closed]
+        lows += [self.g[c] + self.h(c) for c in self.incons]
+        lower = min(lows) if lows else goal_g
+        self.bound = max(1.0, min(self.epsilon, goal_g / lower if lower > 0 else 1.0))
+        if self.bound <= 1.0: self.finished = True; return True
+        # Siguiente pasada: epsilon más bajo, OPEN + INCONS con las claves nuevas y CLOSED vacío
+        self.epsilon = max(1.0, self.epsilon - self.step)
+        nodes = {c for _, c in self.open if c not in self.closed} | self.incons
+        self.open = [(self.g[c] + self.epsilon * self.h(c), c) for c in nodes]
+        heapq.heapify(self.open)
+        self.closed = set(); self.incons = set()
+        return True
+
+    def _improve_path(self, deadline):
+        """Pasada de A* ponderado. True al terminar; False si se acaba el tiempo o las iteraciones."""
+        grid = self.grid; cols = self.cols; rows = self.rows; goal = self.goal
+        g = self.g; parent = self.parent; closed = self.closed; incons = self.incons; open_heap = self.open
+        eps = self.epsilon; h = self.h; perf_counter = time.perf_counter
+        while open_heap:
+            f, c = open_heap[0]
+            if goal in g and g[goal] <= f: return True
+            heapq.heappop(open_heap)
+            if c in closed or f > g[c] + eps * h(c) + 1e-9: continue # Entrada obsoleta
+            closed.add(c); self.expanded += 1; self.iterations += 1
+            if self.iterations >= self.max_iterations: self.finished = True; return False
+            if not (self.iterations & 31) and (self.cancelled or (deadline is not None and perf_counter() >= deadline)): return False
+            cx = c % cols; cy = c // cols; gc = g[c]
+            for dx, dy, cost in self.STEPS:
+                nx = cx + dx; ny = cy + dy
+                if nx < 0 or ny < 0 or nx >= cols or ny >= rows: continue
+                nb = ny * cols + nx
+                if not grid[nb]: continue
+                ng = gc + cost
+                if ng < g.get(nb, ng + 1):
+                    g[nb] = ng; parent[nb] = c
+                    if nb in closed: incons.add(nb)
+                    else: heapq.heappush(open_heap, (ng + eps * h(nb), nb))
+        return True
+
+class PathTicket:
+    """Resguardo de una petición al PathService. Varias peticiones iguales comparten trabajo."""
+    def __init__(self, job, callback=None):
+        self.job = job; self.callback = callback
+        self.done = False; self.cancelled = False; self.path = None
+        self.improved = 0 # ANYTIME: cuántas veces se ha cambiado path por uno mejor tras entregarlo
+
+    def partial_path(self):
+        search = self.job["search"]
+        return [] if self.cancelled or search is None else search.partial_path()
+
+class PathService:
+    """
+    Servicio central de caminos para el jugador, las cutscenes y los NPCs.
+    Las peticiones idénticas de un mismo frame se agrupan en un solo trabajo. Con workers > 0
+    la búsqueda entera (caché, islas, JPS/HPA/NAVMESH/ANYTIME y A*) corre en un pool de hilos
+    sobre la foto de la rejilla de la escena; con workers = 0
+    se reparte por tramos dentro del presupuesto de update(). En ambos casos los resultados
+    se entregan en update(), desde el hilo principal, al vaciar la cola de terminados.
+    """
+    def __init__(self, workers=0):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="path") if workers > 0 else None
+        self.completed = queue.SimpleQueue()
+        self.frame_jobs = {} # Petición exacta -> trabajo (deduplicación dentro del frame)
+        self.sliced = []     # Trabajos por tramos pendientes (sin pool)
+        self.refining = []   # ANYTIME ya entregados que siguen mejorando con el presupuesto sobrante
+        self.in_flight = 0
+        # MÉTRICAS (del último frame)
+        self.requests = 0; self.deduped = 0; self.throughput = 0
+        self.latency_ms = 0.0; self.latency_max_ms = 0.0
+        self._frame_requests = 0; self._frame_deduped = 0
+
+    def request(self, pathfinder, start_x, start_y, goal_x, goal_y, callback=None, snap_to_reachable=False):
+        """Pide un camino. El callback recibe el camino (o None) durante un update() posterior."""
+        key = (id(pathfinder), int(start_x), int(start_y), int(goal_x), int(goal_y), snap_to_reachable)
+        return self._submit(key, lambda: pathfinder.start_search(start_x, start_y, goal_x, goal_y, snap_to_reachable), callback)
+
+    def request_any(self, pathfinder, start_x, start_y, targets, callback=None):
+        """Pide el camino al destino más barato de varios (Rect de una salida o lista de puntos walk_to)."""
+        goals = tuple(targets) if isinstance(targets, pygame.Rect) else tuple(tuple(p) for p in targets)
+        key = (id(pathfinder), int(start_x), int(start_y), "any", goals)
+        return self._submit(key, lambda: pathfinder.start_search_any(start_x, start_y, targets), callback)
+
+    def _submit(self, key, start_search, callback):
+        self._frame_requests += 1
+        job = self.frame_jobs.get(key)
+        if job is None or all(t.cancelled for t in job["tickets"]):
+            job = {"search": None, "tickets": [], "submitted": time.perf_counter(), "sliced": False, "cancelled": False, "error": None}
+            self.frame_jobs[key] = job
+            self.in_flight += 1
+            if self.executor: self.executor.submit(self._work, job, start_search)
+            else:
+                job["search"] = search = start_search()
+                if search.done: self.completed.put(job)
+                else: self.sliced.append(job); job["sliced"] = True
+        else: self._frame_deduped += 1
+        ticket = PathTicket(job, callback)
+        job["tickets"].append(ticket)
+        return ticket
+
+    def cancel(self, ticket):
+        ticket.cancelled = True
+        job = ticket.job
+        if not all(t.cancelled for t in job["tickets"]): return
+        job["cancelled"] = True
+        if job["sliced"]:
+            self.sliced.remove(job); job["sliced"] = False
+            job["search"].cancel(); self.in_flight -= 1
+        elif job in self.refining:
+            self.refining.remove(job); job["search"].cancel()
+        elif job["search"] is not None and not job["search"].done:
+            job["search"].cancel() # En un hilo: run() se para en su siguiente comprobación; se entrega descartado
+
+    def _work(self, job, start_search):
+        try:
+            if job["cancelled"]: return # Cancelado antes de empezar
+            search = job["search"] = start_search()
+            if job["cancelled"]: search.cancel()
+            elif not search.done: search.run()
+        except Exception as e:
+            # Un fallo en el hilo no puede dejar el ticket (ni PENDING_PATH) esperando: se entrega sin camino
+            job["error"] = e; print(f"[ERROR] PathService: {e!r}")
+        finally: self.completed.put(job)
+
+    def update(self, max_ms=None, max_expansions=None):
+        """Una vez por frame: avanza los tramos pendientes y entrega los caminos terminados."""
+        now = time.perf_counter()
+        deadline = now + max_ms / 1000.0 if max_ms else None
+        while self.sliced:
+            remaining = (deadline - time.perf_counter()) * 1000.0 if deadline else None
+            if remaining is not None and remaining <= 0: break
+            job = self.sliced[0]
+            if not job["search"].step(remaining, max_expansions): break
+            self.sliced.pop(0); job["sliced"] = False
+            self.completed.put(job)
+        # Mejoras ANYTIME con lo que sobre del presupuesto: el camino ya entregado se sustituye en el ticket
+        for job in list(self.refining):
+            remaining = (deadline - time.perf_counter()) * 1000.0 if deadline else None
+            if remaining is not None and remaining <= 0: break
+            search = job["search"]
+            if search.refine(remaining):
+                for ticket in job["tickets"]:
+                    if ticket.cancelled: continue
+                    ticket.path = list(search.path); ticket.improved += 1
+            if not search.refining(): self.refining.remove(job)
+        
+        delivered = 0; total_latency = 0.0; max_latency = 0.0
+        now = time.perf_counter()
+        while True:
+            try: job = self.completed.get_nowait()
+            except queue.Empty: break
+            self.in_flight -= 1
+            search = job["search"]
+            if search is None or job["error"] is not None: # Cancelado antes de empezar o el hilo falló: sin camino
+                search = job["search"] = PathSearch(None); search.done = True; search.cancelled = job["cancelled"]
+            # Resultado de un hilo: se convierte y se guarda en la caché aquí, en el hilo principal
+            if not search.done and not search.cancelled: search.finish_cells(search.cells)
+            latency = (now - job["submitted"]) * 1000.0
+            delivered += 1; total_latency += latency; max_latency = max(max_latency, latency)
+            first = True
+            for ticket in job["tickets"]:
+                if ticket.cancelled: continue
+                ticket.path = search.path if first or search.path is None else list(search.path)
+                ticket.done = True; first = False
+                if ticket.callback: ticket.callback(ticket.path)
+            if search.refining(): self.refining.append(job)
+        
+        self.requests = self._frame_requests; self.deduped = self._frame_deduped; self.throughput = delivered
+        self.latency_ms = total_latency / delivered if delivered else 0.0; self.latency_max_ms = max_latency
+        self._frame_requests = 0; self._frame_deduped = 0
+        self.frame_jobs.clear()
+
+    def shutdown(self):
+        if self.executor: self.executor.shutdown(wait=False)
+
+class DStarLite:
+    """
+    D* Lite sobre la rejilla: búsqueda hacia atrás desde el destino que se puede reparar.
+    Cuando cambian celdas solo se reabren sus vecinas, y cuando el origen avanza se corrige
+    la prioridad con km en vez de reordenar la cola. Mismos movimientos y costes que el A*
+    (10 recto, 14 diagonal, solo cuenta que la celda destino sea pisable).
+    """
+    def __init__(self, pathfinder, start_cell, goal_cell):
+        self.pathfinder = pathfinder
+        n = pathfinder.grid_cols * pathfinder.grid_rows
+        self.g = [math.inf] * n; self.rhs = [math.inf] * n
+        self.queue = []; self.queued = {} # celda -> clave vigente (las entradas viejas del montículo se ignoran)
+        self.km = 0; self.start = start_cell; self.last_start = start_cell; self.goal = goal_cell
+        self.expanded = 0
+        self.rhs[goal_cell] = 0
+        self._push(goal_cell)
+
+    def _h(self, a, b):
+        cols = self.pathfinder.grid_cols
+        dx = abs(a % cols - b % cols); dy = abs(a // cols - b // cols)
+        return 10 * (dx + dy) - 6 * min(dx, dy) # Octil: exacto sin obstáculos, nunca sobreestima
+
+    def _key(self, s):
+        m = min(self.g[s], self.rhs[s])
+        return (m + self._h(self.start, s) + self.km, m)
+
+    def _push(self, s):
+        key = self._key(s); self.queued[s] = key
+        heapq.heappush(self.queue, (key, s))
+
+    def _neighbors(self, s):
+        cols = self.pathfinder.grid_cols; rows = self.pathfinder.grid_rows
+        cx = s % cols; cy = s // cols
+        for dx, dy, cost in ((0, -1, 10), (0, 1, 10), (-1, 0, 10), (1, 0, 10), (-1, -1, 14), (-1, 1, 14), (1, -1, 14), (1, 1, 14)):
+            nx = cx + dx; ny = cy + dy
+            if 0 <= nx < cols and 0 <= ny < rows: yield ny * cols + nx, cost
+
+    def _update_vertex(self, u):
+        if u != self.goal:
+            grid = self.pathfinder.grid; g = self.g; best = math.inf
+            for s, cost in self._neighbors(u):
+                if grid[s] and cost + g[s] < best: best = cost + g[s]
+            self.rhs[u] = best
+        if self.g[u] != self.rhs[u]: self._push(u)
+        else: self.queued.pop(u, None)
+
+    def move_start(self, start_cell):
+        if start_cell == self.start: return
+        self.km += self._h(self.last_start, start_cell)
+        self.last_start = self.start = start_cell
+
+    def update_cells(self, cells):
+        # Cambia el coste de entrar en cada celda -> se recalculan las vecinas que pueden entrar en ella
+        for c in cells:
+            for p, _ in self._neighbors(c): self._update_vertex(p)
+
+    def compute(self, max_iterations=100000):
+        queue = self.queue; queued = self.queued; g = self.g; rhs = self.rhs
+        iterations = 0
+        while queue and iterations < max_iterations:
+            k_old, u = queue[0]
+            if queued.get(u) != k_old: heapq.heappop(queue); continue # Entrada obsoleta
+            if not (k_old < self._key(self.start) or rhs[self.start] != g[self.start]): break
+            heapq.heappop(queue); del queued[u]
+            iterations += 1
+            k_new = self._key(u)
+            if k_old < k_new: self._push(u)
+            elif g[u] > rhs[u]:
+                g[u] = rhs[u]
+                for p, _ in self._neighbors(u): self._update_vertex(p)
+            else:
+                g[u] = math.inf
+                self._update_vertex(u)
+                for p, _ in self._neighbors(u): self._update_vertex(p)
+        self.expanded = iterations
+
+    def plan(self):
+        """Repara lo necesario y devuelve las celdas del origen al destino (o None)."""
+        self.compute()
+        if self.g[self.start] == math.inf and self.start != self.goal: return None
+        grid = self.pathfinder.grid; g = self.g
+        cells = [self.start]; current = self.start
+        while current != self.goal:
+            best = None; best_cost = math.inf
+            for s, cost in self._neighbors(current):
+                if grid[s] and cost + g[s] < best_cost: best = s; best_cost = cost + g[s]
+            if best is None or len(cells) > len(g): return None
+            cells.append(best); current = best
+        return cells
+
+class HPAGraph:
+    """
+    Grafo abstracto para HPA*: la rejilla se parte en clusters de cluster x cluster celdas.
+    En cada borde entre clusters vecinos, cada tramo pisable por ambos lados aporta una
+    entrada (dos si es largo). Al crearlo se precalculan los costes y caminos entre las
+    entradas de un mismo cluster, así una consulta larga solo busca en el grafo pequeño y
+    en los clusters del origen y el destino.
+    """
+    STEPS = ((0, -1, 10), (0, 1, 10), (-1, 0, 10), (1, 0, 10), (-1, -1, 14), (-1, 1, 14), (1, -1, 14), (1, 1, 14))
+
+    def __init__(self, grid, cols, rows, cluster=10):
+        self.grid = grid; self.cols = cols; self.rows = rows; self.cluster = cluster
+        self.ccols = -(-cols // cluster); self.crows = -(-rows // cluster)
+        self.edges = {} # celda entrada -> {celda vecina: (coste, celdas del tramo sin la de salida)}
+        self.cluster_nodes = [[] for _ in range(self.ccols * self.crows)]
+        self.last_expanded = 0 # Nodos tocados por la última consulta (benchmarks)
+        self._build_entrances()
+        for k in range(len(self.cluster_nodes)): self._build_intra(k)
+
+    def cluster_of(self, cell):
+        return (cell // self.cols) // self.cluster * self.ccols + (cell % self.cols) // self.cluster
+
+    def _bounds(self, k):
+        x0 = (k % self.ccols) * self.cluster; y0 = (k // self.ccols) * self.cluster
+        return x0, y0, min(x0 + self.cluster, self.cols), min(y0 + self.cluster, self.rows)
+
+    def _add_node(self, cell):
+        if cell not in self.edges:
+            self.edges[cell] = {}
+            self.cluster_nodes[self.cluster_of(cell)].append(cell)
+
+    def _link(self, a, b):
+        # Cruce entre clusters: un paso recto
+        self._add_node(a); self._add_node(b)
+        self.edges[a][b] = (10, [b]); self.edges[b][a] = (10, [a])
+
+    def _add_border(self, pairs):
+        """pairs: lista de (celda lado A, celda lado B) consecutivas a lo largo del borde."""
+        run = []
+        for a, b in pairs + [(None, None)]:
+            if a is not None and self.grid[a] and self.grid[b]: run.append((a, b)); continue
+            if run:
+                if len(run) >= 6: self._link(*run[0]); self._link(*run[-1])
+                else: self._link(*run[len(run) // 2])
+                run = []
+
+    def _build_entrances(self):
+        cols = self.cols
+        for cy in range(self.crows):
+            for cx in range(self.ccols):
+                x0, y0, x1, y1 = self._bounds(cy * self.ccols + cx)
+                if x1 < cols: # Borde derecho
+                    self._add_border([(y * cols + x1 - 1, y * cols + x1) for y in range(y0, y1)])
+                if y1 < self.rows: # Borde inferior
+                    self._add_border([((y1 - 1) * cols + x, y1 * cols + x) for x in range(x0, x1)])
+
+    def _local_search(self, source, bounds):
+        """Dijkstra dentro de un cluster. Devuelve (distancias, padres)."""
+        cols = self.cols; grid = self.grid; x0, y0, x1, y1 = bounds
+        dist = {source: 0}; parent = {source: -1}; heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]: continue
+            ux = u % cols; uy = u // cols
+            for dx, dy, cost in self.STEPS:
+                nx = ux + dx; ny = uy + dy
+                if nx < x0 or ny < y0 or nx >= x1 or ny >= y1: continue
+                v = ny * cols + nx
+                if not grid[v]: continue
+                nd = d + cost
+                if nd < dist.get(v, nd + 1): dist[v] = nd; parent[v] = u; heapq.heappush(heap, (nd, v))
+        return dist, parent
+
+    @staticmethod
+    def _trace(parent, cell):
+        cells = []
+        while parent[cell] != -1: cells.append(cell); cell = parent[cell]
+        return cells[::-1]
+
+    def _build_intra(self, k):
+        nodes = self.cluster_nodes[k]; bounds = self._bounds(k)
+        for i, a in enumerate(nodes):
+            dist, parent = self._local_search(a, bounds)
+            for b in nodes[i + 1:]:
+                if b not in dist or b in self.edges[a]: continue
+                cells = self._trace(parent, b)
+                self.edges[a][b] = (dist[b], cells)
+                self.edges[b][a] = (dist[b], cells[-2::-1] + [a])
+
+    def _octile(self, a, b):
+        cols = self.cols
+        dx = abs(a % cols - b % cols); dy = abs(a // cols - b // cols)
+        return 10 * (dx + dy) - 6 * min(dx, dy)
+
+    def find_cells(self, start_cell, goal_cell):
+        """Celdas del origen al destino pasando por el grafo abstracto, o None."""
+        sk = self.cluster_of(start_cell); gk = self.cluster_of(goal_cell)
+        s_dist, s_parent = self._local_search(start_cell, self._bounds(sk))
+        # Mismo cluster: el camino local compite con el que sale y vuelve a entrar (rodeos en U)
+        local = [start_cell] + self._trace(s_parent, goal_cell) if sk == gk and goal_cell in s_dist else None
+        g_dist, g_parent = self._local_search(goal_cell, self._bounds(gk))
+        self.last_expanded = len(s_dist) + len(g_dist) # Celdas de las búsquedas locales + nodos abstractos
+        # Enlaces temporales: origen -> entradas de su cluster, entradas del cluster destino -> destino
+        exits = {n: g_dist[n] for n in self.cluster_nodes[gk] if n in g_dist}
+        if not exits: return local
+        START = -2; GOAL = -1
+        best = {}; came = {}; heap = []
+        for n in self.cluster_nodes[sk]:
+            if n in s_dist:
+                best[n] = s_dist[n]; came[n] = START
+                heapq.heappush(heap, (s_dist[n] + self._octile(n, goal_cell), s_dist[n], n))
+        limit = s_dist[goal_cell] if local else math.inf
+        while heap:
+            f, d, u = heapq.heappop(heap)
+            if u == GOAL or f >= limit: break
+            self.last_expanded += 1
+            if d > best.get(u, d): continue
+            if u in exits:
+                nd = d + exits[u]
+                if nd < best.get(GOAL, nd + 1): best[GOAL] = nd; came[GOAL] = u; heapq.heappush(heap, (nd, nd, GOAL))
+            for v, (cost, _) in self.edges[u].items():
+                nd = d + cost
+                if nd < best.get(v, nd + 1):
+                    best[v] = nd; came[v] = u
+                    heapq.heappush(heap, (nd + self._octile(v, goal_cell), nd, v))
+        if GOAL not in came or best[GOAL] >= limit: return local
+        # Refinado: se encadenan los tramos ya precalculados
+        chain = [GOAL]
+        while chain[-1] != START: chain.append(came[chain[-1]])
+        chain.reverse() # START, entradas..., GOAL
+        cells = [start_cell] + self._trace(s_parent, chain[1])
+        for a, b in zip(chain[1:-2], chain[2:-1]): cells += self.edges[a][b][1]
+        last = chain[-2]
+        tail = self._trace(g_parent, last)[::-1] # destino -> entrada, al revés
+        cells += tail[1:] + [goal_cell] if tail else ([goal_cell] if last != goal_cell else [])
+        return cells
+
+class FlowField:
+    """
+    Campo de direcciones hacia un destino: un Dijkstra inverso desde la celda destino guarda,
+    para cada celda, la vecina por la que se llega antes. Cualquier número de agentes lo
+    consulta en O(1) por frame con direction().
+    """
+    STEPS = ((0, -1, 10), (0, 1, 10), (-1, 0, 10), (1, 0, 10), (-1, -1, 14), (-1, 1, 14), (1, -1, 14), (1, 1, 14))
+
+    def __init__(self, grid, cols, rows, grid_size, goal_cell, deadline=None):
+        """
+        goal_cell puede ser una celda o una lista de celdas (ej: todas las de una salida).
+        Con deadline (perf_counter) el Dijkstra se para ahí si no ha acabado y advance() lo continúa.
+        """
+        self.cols = cols; self.rows = rows; self.grid_size = grid_size; self.goal = goal_cell
+        n = cols * rows
+        self.dist = [math.inf] * n; self.next = [-1] * n
+        self.heap = [(0, c) for c in (goal_cell if isinstance(goal_cell, (list, tuple)) else [goal_cell])]
+        for _, c in self.heap: self.dist[c] = 0
+        self.grid = grid # Foto de la rejilla (se sustituye, nunca se modifica) hasta terminar
+        self.done = False
+        self.advance(deadline)
+
+    def advance(self, deadline=None):
+        """Sigue el Dijkstra hasta terminar o hasta deadline. True cuando el campo está completo."""
+        if self.done: return True
+        grid = self.grid; cols = self.cols; rows = self.rows; dist = self.dist; nxt = self.next; heap = self.heap
+        perf_counter = time.perf_counter; popped = 0
+        while heap:
+            if not (popped & 31) and deadline is not None and perf_counter() >= deadline: return False
+            popped += 1
+            d, v = heapq.heappop(heap)
+            if d > dist[v]: continue
+            # Solo se entra en celdas pisables: desde una bloqueada no se sigue propagando
+            if not grid[v] and d != 0: continue
+            vx = v % cols; vy = v // cols
+            for dx, dy, cost in self.STEPS:
+                ux = vx + dx; uy = vy + dy
+                if ux < 0 or uy < 0 or ux >= cols or uy >= rows: continue
+                u = uy * cols + ux; nd = d + cost
+                if nd < dist[u]: dist[u] = nd; nxt[u] = v; heapq.heappush(heap, (nd, u))
+        self.done = True; self.heap = self.grid = None
+        return True
+
+    def _cell(self, x, y):
+        gs = self.grid_size
+        return min(max(int(y // gs), 0), self.rows - 1) * self.cols + min(max(int(x // gs), 0), self.cols - 1)
+
+    def next_point(self, x, y):
+        """Punto de la siguiente celda hacia el destino (None en el destino o si no hay camino)."""
+        nxt = self.next[self._cell(x, y)]
+        if nxt < 0: return None
+        return ((nxt % self.cols) * self.grid_size, (nxt // self.cols) * self.grid_size)
+
+    def direction(self, x, y):
+        """Vector unitario hacia la siguiente celda; (0, 0) al llegar o si no hay camino."""
+        point = self.next_point(x, y)
+        if point is None: return (0.0, 0.0)
+        dx = point[0] - x; dy = point[1] - y
+        dist = math.hypot(dx, dy)
+        if dist < 1e-6: return (0.0, 0.0)
+        return (dx / dist, dy / dist)
+
+    def distance(self, x, y):
+        return self.dist[self._cell(x, y)]
+
+    def touches(self, cells):
+        """True si alguna celda tiene distancia en el campo (pisable alcanzable o bloqueada junto a una)."""
+        dist = self.dist
+        return any(dist[c] != math.inf for c in cells)
+
+class PoiTable:
+    """
+    Distancias a pie entre los puntos de interés de la escena (hotspots, salidas, entradas...).
+    Al cargar se lanza un Dijkstra inverso (FlowField) por punto sobre la rejilla estática, así
+    que distance/reachable/eta son lecturas O(1) y las rutas se sacan siguiendo el campo.
+    Si cambian los obstáculos estáticos solo se rehacen los campos que tocan las celdas cambiadas, y
+    por tramos: update(max_ms) los avanza cada frame. Una consulta sobre un punto aún pendiente
+    termina solo el campo de ese punto.
+    Un punto puede ser (x, y), una lista de puntos alternativos o un Rect.
+    """
+    def __init__(self, pathfinder, pois):
+        self.pathfinder = pathfinder
+        self.pois = dict(pois)
+        self.grid = None
+        self.build()
+
+    def build(self):
+        pf = self.pathfinder
+        self.grid = pf.static_grid
+        self.cells = {}; self.fields = {}; self.pending = {}; self.dist = {}; self.routes = {}
+        if self.grid is None: return
+        self._collect_cells()
+        for name, goals in self.cells.items():
+            if goals: self.fields[name] = FlowField(self.grid, pf.grid_cols, pf.grid_rows, pf.grid_size, list(goals))
+        for b in self.fields: self._fill(b)
+
+    def _collect_cells(self):
+        pf = self.pathfinder
+        for name, target in self.pois.items():
+            many = isinstance(target, pygame.Rect) or (target and isinstance(target[0], (tuple, list)))
+            self.cells[name] = pf.goal_cells_for(target if many else [target])
+
+    def _fill(self, b):
+        """Columna b de la tabla (de cada punto a b) a partir de su campo ya terminado."""
+        field = self.fields[b]; scale = self.pathfinder.grid_size / 10.0 # Costes 10/14 por celda -> píxeles
+        for a, goals in self.cells.items():
+            d = min((field.dist[c] for c in goals), default=math.inf)
+            self.dist[(a, b)] = d * scale if d != math.inf else None
+
+    def _check(self):
+        pf = self.pathfinder; old = self.grid; new = pf.static_grid
+        if new is old: return
+        if old is None or new is None or len(old) != len(new): self.build(); return
+        cols = pf.grid_cols; changed = []
+        for start in range(0, len(new), cols): # Fila a fila: la comparación de bytes va en C
+            if old[start:start + cols] != new[start:start + cols]:
+                changed.extend(c for c in range(start, start + cols) if old[c] != new[c])
+        self.grid = new
+        previous = self.cells; self.cells = {}
+        self._collect_cells()
+        self.dist = {}; self.routes = {}
+        for name, goals in self.cells.items():
+            field = self.fields.get(name)
+            if name not in self.pending and field is not None and goals == previous.get(name) and not field.touches(changed): continue
+            # Campo afectado: se rehace por tramos (update) o al consultarlo. El viejo se suelta al sustituirlo
+            self.pending.pop(name, None)
+            if goals: self.pending[name] = FlowField(new, cols, pf.grid_rows, pf.grid_size, list(goals), deadline=0)
+            else: self.fields.pop(name, None)
+        for b in self.fields:
+            if b not in self.pending: self._fill(b)
+
+    def _ready(self, b):
+        """Termina ya el campo de b si estaba pendiente (solo ese)."""
+        self._check()
+        field = self.pending.pop(b, None)
+        if field is not None:
+            field.advance(); self.fields[b] = field; self._fill(b)
+
+    def update(self, max_ms=None):
+        """Una vez por frame: avanza los campos pendientes dentro de max_ms. True si no queda ninguno."""
+        self._check()
+        deadline = time.perf_counter() + max_ms / 1000.0 if max_ms else None
+        for b in list(self.pending):
+            if not self.pending[b].advance(deadline): return False
+            self.fields[b] = self.pending.pop(b); self._fill(b)
+        return True
+
+    def distance(self, a, b):
+        """Distancia a pie (px) entre dos puntos de interés, o None si no se llega."""
+        self._ready(b)
+        return self.dist.get((a, b))
+
+    def distance_from(self, x, y, b):
+        """Distancia a pie desde una posición cualquiera (ej: el jugador) hasta un punto de interés."""
+        self._ready(b)
+        field = self.fields.get(b)
+        if field is None: return None
+        d = field.distance(x, y)
+        return d * self.pathfinder.grid_size / 10.0 if d != math.inf else None
+
+    def reachable(self, a, b): return self.distance(a, b) is not None
+
+    def eta(self, a, b, speed=None):
+        """Segundos andando de a a b. speed en px/s (por defecto la del jugador: PLAYER_SPEED px por frame a 60 FPS)."""
+        d = self.distance(a, b)
+        if d is None: return None
+        return d / (speed or CONFIG["PLAYER_SPEED"] * 60)
+
+    def route(self, a, b):
+        """Puntos de a a b siguiendo el campo de b (se guarda para las siguientes consultas)."""
+        self._ready(b)
+        key = (a, b)
+        if key in self.routes: return list(self.routes[key])
+        field = self.fields.get(b); goals = self.cells.get(a)
+        if field is None or not goals or self.dist.get(key) is None: return None
+        cell = min(goals, key=lambda c: field.dist[c])
+        gs = self.pathfinder.grid_size; cols = self.pathfinder.grid_cols
+        path = [((cell % cols) * gs, (cell // cols) * gs)]
+        while field.dist[cell] > 0:
+            cell = field.next[cell]
+            path.append(((cell % cols) * gs, (cell // cols) * gs))
+        if cell in self.cells[b]: path[-1] = self.cells[b][cell] # Acaba en el punto exacto de b
+        self.routes[key] = path
+        return list(path)
+
+class NavMesh:
+    """
+    Malla de navegación generada a partir de la máscara de suelo.
+    Las celdas pisables se agrupan en rectángulos (polígonos convexos) crecidos de forma voraz, a lo ancho
+    y luego hacia abajo, no necesariamente máximos. Los que comparten borde quedan unidos por un "portal" y
+    los que solo se tocan en una esquina por un portal de un punto (la rejilla deja cortar esquinas en
+    diagonal). find_path hace A* sobre ese grafo y tensa la cuerda con el algoritmo del embudo, así que el coste depende del número de
+    polígonos y no del área en píxeles, y el camino sale con pocos puntos.
+    """
+    def __init__(self, cells, cols, rows, cell_size):
+        self.cell_size = cell_size
+        self.cols = cols; self.rows = rows
+        self.polys = []            # (x0, y0, x1, y1) en celdas, x1/y1 exclusivos
+        self.rects = []            # Mismos polígonos en píxeles (para debug / F4)
+        self.owner = [-1] * (cols * rows)
+        self.links = []            # links[a] = {b: ((x, y), (x, y))} extremos del portal en píxeles
+        self.last_expanded = 0     # Polígonos expandidos en la última búsqueda (benchmarks)
+        self._build_polys(cells)
+        self._build_links()
+
+    def _build_polys(self, cells):
+        cols, rows, owner = self.cols, self.rows, self.owner
+        free = bytearray(cells)
+        for cy in range(rows):
+            row = cy * cols
+            cx = free.find(1, row, row + cols)
+            while cx != -1:
+                x0 = cx - row
+                x1 = x0
+                while x1 < cols and free[row + x1]: x1 += 1
+                # Crecemos hacia abajo mientras la fila entera siga libre
+                span = b"\x01" * (x1 - x0)
+                y1 = cy + 1
+                while y1 < rows and free[y1 * cols + x0:y1 * cols + x1] == span: y1 += 1
+                pid = len(self.polys)
+                hole = bytes(x1 - x0)
+                for y in range(cy, y1):
+                    start = y * cols + x0
+                    free[start:start + (x1 - x0)] = hole
+                    owner[start:start + (x1 - x0)] = [pid] * (x1 - x0)
+                self.polys.append((x0, cy, x1, y1))
+                cs = self.cell_size
+                self.rects.append(pygame.Rect(x0 * cs, cy * cs, (x1 - x0) * cs, (y1 - cy) * cs))
+                cx = free.find(1, row + x1, row + cols)
+
+    def _build_links(self):
+        cols, rows, owner, cs = self.cols, self.rows, self.owner, self.cell_size
+        self.links = [{} for _ in self.polys]
+        for a, (x0, y0, x1, y1) in enumerate(self.polys):
+            # Vecinos a la derecha (borde vertical) y abajo (borde horizontal)
+            if x1 < cols:
+                for y in range(y0, y1):
+                    b = owner[y * cols + x1]
+                    if b < 0 or b in self.links[a]: continue
+                    by0, by1 = self.polys[b][1], self.polys[b][3]
+                    top = max(y0, by0) * cs; bottom = min(y1, by1) * cs - 1
+                    portal = ((x1 * cs, top), (x1 * cs, bottom))
+                    self.links[a][b] = portal; self.links[b][a] = portal
+            if y1 < rows:
+                for x in range(x0, x1):
+                    b = owner[y1 * cols + x]
+                    if b < 0 or b in self.links[a]: continue
+                    bx0, bx1 = self.polys[b][0], self.polys[b][2]
+                    left = max(x0, bx0) * cs; right = min(x1, bx1) * cs - 1
+                    portal = ((left, y1 * cs), (right, y1 * cs))
+                    self.links[a][b] = portal; self.links[b][a] = portal
+                # Esquinas de abajo: contacto solo en diagonal (el A* de la rejilla también pasa por ahí)
+                for cx, px in ((x1, x1 * cs), (x0 - 1, x0 * cs - 1)):
+                    if not 0 <= cx < cols: continue
+                    b = owner[y1 * cols + cx]
+                    if b < 0 or b in self.links[a]: continue
+                    portal = ((px, y1 * cs), (px, y1 * cs)) # Primer píxel de b junto a la esquina
+                    self.links[a][b] = portal; self.links[b][a] = portal
+
+    def locate(self, x, y):
+        cx = int(x // self.cell_size); cy = int(y // self.cell_size)
+        if 0 <= cx < self.cols and 0 <= cy < self.rows: return self.owner[cy * self.cols + cx]
+        return -1
+
+    def clamp_to_nearest(self, x, y):
+        """Devuelve (polígono, punto) más cercano a (x, y). Para orígenes fuera de la malla."""
+        best = -1; best_pt = (x, y); best_d = None
+        for pid, r in enumerate(self.rects):
+            px = min(max(x, r.left), r.right - 1); py = min(max(y, r.top), r.bottom - 1)
+            d = (px - x) ** 2 + (py - y) ** 2
+            if best_d is None or d < best_d: best = pid; best_pt = (px, py); best_d = d
+        return best, best_pt
+
+    def find_path(self, start_x, start_y, goal_x, goal_y):
+        start = (start_x, start_y); goal = (goal_x, goal_y)
+        sp = self.locate(start_x, start_y)
+        if sp < 0: sp, start = self.clamp_to_nearest(start_x, start_y)
+        gp = self.locate(goal_x, goal_y)
+        if gp < 0: gp, goal = self.clamp_to_nearest(goal_x, goal_y)
+        if sp < 0 or gp < 0: return None
+        if sp == gp: return [goal]
+        chain = self._search_polys(sp, gp, start, goal)
+        if chain is None: return None
+        return self._string_pull(chain, start, goal)
+
+    def _search_polys(self, sp, gp, start, goal):
+        # A* sobre polígonos. La posición de cada nodo es el punto por el que se entra
+        # (el más cercano del portal), así el coste se parece al recorrido real.
+        hypot = math.hypot
+        g_score = {sp: 0.0}; entry = {sp: start}; parent = {sp: -1}; closed = set()
+        open_heap = [(hypot(goal[0] - start[0], goal[1] - start[1]), sp)]
+        while open_heap:
+            _, current = heapq.heappop(open_heap)
+            if current in closed: continue
+            if current == gp:
+                self.last_expanded = len(closed) + 1
+                chain = []
+                while current != -1: chain.append(current); current = parent[current]
+                return chain[::-1]
+            closed.add(current)
+            cx, cy = entry[current]
+            for nb, ((ax, ay), (bx, by)) in self.links[current].items():
+                if nb in closed: continue
+                px = min(max(cx, min(ax, bx)), max(ax, bx)); py = min(max(cy, min(ay, by)), max(ay, by))
+                new_g = g_score[current] + hypot(px - cx, py - cy)
+                if new_g < g_score.get(nb, new_g + 1):
+                    g_score[nb] = new_g; entry[nb] = (px, py); parent[nb] = current
+                    heapq.heappush(open_heap, (new_g + hypot(goal[0] - px, goal[1] - py), nb))
+        self.last_expanded = len(closed)
+        return None
+
+    def _string_pull(self, chain, start, goal):
+        """Algoritmo del embudo (simple stupid funnel) sobre los portales de la cadena."""
+        def area2(a, b, c): return (c[0] - a[0]) * (b[1] - a[1]) - (b[0] - a[0]) * (c[1] - a[1])
+        
+        portals = [(start, start)]
+        for a, b in zip(chain, chain[1:]):
+            p, q = self.links[a][b] # p es el extremo de arriba (vertical) o de la izquierda (horizontal)
+            # Orientamos el portal según el sentido de avance de a hacia b (convención de area2)
+            if p[0] == q[0]: forward = self.rects[b].x > self.rects[a].x
+            else: forward = self.rects[b].y < self.rects[a].y
+            portals.append((q, p) if forward else (p, q))
+        portals.append((goal, goal))
+
+        points = [start]
+        apex = left = right = start
+        apex_i = left_i = right_i = 0
+        i = 1
+        while i < len(portals):
+            new_left, new_right = portals[i]
+            # Estrechar por la derecha
+            if area2(apex, right, new_right) <= 0:
+                if apex == right or area2(apex, left, new_right) > 0:
+                    right = new_right; right_i = i
+                else:
+                    points.append(left); apex = left; apex_i = left_i
+                    left = right = apex; left_i = right_i = apex_i
+                    i = apex_i + 1; continue
+            # Estrechar por la izquierda
+            if area2(apex, left, new_left) >= 0:
+                if apex == left or area2(apex, right, new_left) < 0:
+                    left = new_left; left_i = i
+                else:
+                    points.append(right); apex = right; apex_i = right_i
+                    left = right = apex; left_i = right_i = apex_i
+                    i = apex_i + 1; continue
+            i += 1
+        if points[-1] != goal: points.append(goal)
+        # El primer punto es el origen: el personaje ya está ahí
+        return [(int(x), int(y)) for x, y in points[1:]]
+
 class Node:
     def __init__(self, x, y, g=0, h=0, parent=None):
         self.x = x; self.y = y; self.g = g; self.h = h; self.f = g + h; self.parent = parent
@@ -751,6 +2710,11 @@ class AnimatedCharacter:
         self.step_sound = SOUNDS.get("step")
         self.idle_timer = 0.0
         self.idle_threshold = CONFIG["IDLE_COOL_THRESHOLD"] 
+        # CACHÉ DE FRAMES TINTADOS (lightmap): (frame, ancho, alto, tinte cuantizado) -> superficie, LRU
+        self.tint_cache = OrderedDict()
+        self.tint_cache_size = CONFIG.get("TINT_CACHE_SIZE", 64)
+        self.tint_step = max(1, CONFIG.get("TINT_CACHE_STEP", 8))
+        self.tint_hits = 0; self.tint_misses = 0; self.tint_cache_bytes = 0
         self.swap_character(char_id) 
 
     def swap_character(self, char_id):
@@ -774,6 +2738,7 @@ class AnimatedCharacter:
         self.rect.bottom = old_bottom; self.rect.centerx = old_centerx
         
         self.animations = {}
+        self.tint_cache.clear(); self.tint_cache_bytes = 0 # Los frames del personaje anterior ya no sirven
         def load_anim(suffix, frame_key, duration=100):
             num_frames = frames_cfg.get(frame_key, 1)
             filename = f"{self.prefix}_{suffix}.gif"
@@ -871,28 +2836,66 @@ class AnimatedCharacter:
                 self.set_animation("idle_down") 
     
     def draw(self, screen, camera_x=0, tint_color=(255, 255, 255)):
-        if self.current_animation:
-            original_frame = self.animations[self.current_animation].get_current_frame()
-            if original_frame:
-                final_surface = original_frame
-                if self.current_scale != 1.0:
-                    if (original_frame != self.last_frame_ref) or (self.current_scale != self.last_scale_ref):
-                        width = int(original_frame.get_width() * self.current_scale)
-                        height = int(original_frame.get_height() * self.current_scale)
-                        self.cached_surface = pygame.transform.scale(original_frame, (width, height))
-                        self.last_frame_ref = original_frame
-                        self.last_scale_ref = self.current_scale
-                    final_surface = self.cached_surface
-                
-                if tint_color != (255, 255, 255):
-                    tinted_surface = final_surface.copy()
-                    tinted_surface.fill(tint_color, special_flags=pygame.BLEND_MULT)
-                    final_surface = tinted_surface
-
-                world_x = self.rect.centerx - final_surface.get_width() // 2
-                world_y = self.rect.bottom - final_surface.get_height()
-                screen_x = world_x - camera_x
-                screen.blit(final_surface, (screen_x, world_y))
+        drawn = self.get_draw_surface(tint_color)
+        if drawn:
+            final_surface, world_x, world_y = drawn
+            screen.blit(final_surface, (world_x - camera_x, world_y))
+
+    def get_draw_surface(self, tint_color=(255, 255, 255)):
+        """(superficie escalada y tintada, x, y) del frame actual en coordenadas de escena, o None."""
+        if not self.current_animation: return None
+        original_frame = self.animations[self.current_animation].get_current_frame()
+        if not original_frame: return None
+        if tint_color != (255, 255, 255): final_surface = self._tinted_frame(original_frame, tint_color)
+        else: final_surface = self._scaled_frame(original_frame)
+        return final_surface, self.rect.centerx - final_surface.get_width() // 2, self.rect.bottom - final_surface.get_height()
+
+    def get_draw_rect(self):
+        """Rect (coordenadas de escena) que ocupa el frame actual al dibujarlo, o None."""
+        if not self.current_animation: return None
+        frame = self.animations[self.current_animation].get_current_frame()
+        if not frame: return None
+        if self.current_scale == 1.0: w, h = frame.get_size()
+        else: w = int(frame.get_width() * self.current_scale); h = int(frame.get_height() * self.current_scale)
+        return pygame.Rect(self.rect.centerx - w // 2, self.rect.bottom - h, w, h)
+
+    def _scaled_frame(self, original_frame):
+        if self.current_scale == 1.0: return original_frame
+        if (original_frame != self.last_frame_ref) or (self.current_scale != self.last_scale_ref):
+            width = int(original_frame.get_width() * self.current_scale)
+            height = int(original_frame.get_height() * self.current_scale)
+            self.cached_surface = pygame.transform.scale(original_frame, (width, height))
+            self.last_frame_ref = original_frame
+            self.last_scale_ref = self.current_scale
+        return self.cached_surface
+
+    def _tinted_frame(self, original_frame, tint_color):
+        """Frame escalado y multiplicado por el tinte. El tinte se cuantiza para que la caché acierte al andar."""
+        step = self.tint_step
+        tint = tuple(min(255, (c + step // 2) // step * step) for c in tint_color[:3])
+        if self.current_scale == 1.0: size = original_frame.get_size()
+        else: size = (int(original_frame.get_width() * self.current_scale), int(original_frame.get_height() * self.current_scale))
+        key = (original_frame, size, tint)
+        cache = self.tint_cache
+        surface = cache.get(key)
+        if surface is not None:
+            cache.move_to_end(key); self.tint_hits += 1
+            return surface
+        self.tint_misses += 1
+        surface = self._scaled_frame(original_frame).copy()
+        surface.fill(tint, special_flags=pygame.BLEND_MULT)
+        if self.tint_cache_size > 0:
+            cache[key] = surface; self.tint_cache_bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+            while len(cache) > self.tint_cache_size:
+                _, old = cache.popitem(last=False)
+                self.tint_cache_bytes -= old.get_width() * old.get_height() * old.get_bytesize()
+        return surface
+
+    def tint_cache_stats(self):
+        """Aciertos, fallos, % de aciertos, entradas y bytes de la caché de frames tintados."""
+        total = self.tint_hits + self.tint_misses
+        return {"hits": self.tint_hits, "misses": self.tint_misses, "hit_rate": self.tint_hits / total if total else 0.0,
+                "entries": len(self.tint_cache), "bytes": self.tint_cache_bytes}
 
 # EN engine/classes.py
 
@@ -911,12 +2914,23 @@ class SceneManager:
         self.target_effect = TRANSITION_FADE
         self.player = None # Variable interna para guardar al jugador
         self.reset_ui_callback = None # Variable para guardar la función de limpieza
+        self.map_spawns = {} # scene_id -> puntos de aparición desde el mapa (para la tabla de POIs)
     
     # Método para recibir la función desde main.py ---
     def set_ui_callback(self, func):
         self.reset_ui_callback = func
 
     def add_scene(self, scene): self.scenes[scene.id] = scene
+
+    def add_map_spawn(self, scene_id, x, y):
+        spawns = self.map_spawns.setdefault(scene_id, [])
+        if (x, y) not in spawns: spawns.append((x, y))
+
+    def entry_points_for(self, scene_id):
+        """Dónde aparece el jugador al entrar en scene_id: spawns de las salidas de otras escenas y del mapa."""
+        points = [(sid, ex.spawn_point) for sid, sc in self.scenes.items() for ex in sc.exits if ex.target_scene == scene_id]
+        points += [(f"map{i}", p) for i, p in enumerate(self.map_spawns.get(scene_id, []))]
+        return points
     
     def get_current_scene(self): return self.current_scene
 
@@ -1024,6 +3038,7 @@ class SceneManager:
                 self.current_scene.unload_assets()
             RES_MANAGER.clear_cache()
             self.current_scene = new_s
+            new_s.entry_points = self.entry_points_for(new_s.id)
             self.current_scene.load_assets()
             if self.current_scene.on_enter: self.current_scene.on_enter()
 
@@ -2656,10 +4671,12 @@ class DebugConsole:
 
         return False
 
+    def is_visible(self):
+        return CONFIG.get("DEBUG_MODE", False) and not CONFIG.get("SHOW_HINTS_ONLY", False)
+
     def draw(self, screen):
         # Visibilidad
-        if not CONFIG.get("DEBUG_MODE", False): return
-        if CONFIG.get("SHOW_HINTS_ONLY", False): return 
+        if not self.is_visible(): return
 
         # 1. Dibujar fondo y Header
         s = pygame.Surface((self.rect.width, self.rect.height), pygame.SRCALPHA)
@@ -2886,6 +4903,34 @@ class Movement:
         if path: self.path = path; self.idx = 0; self.is_moving = True; self.callback = cb
         else: self.stop()
     
+    def replace_path(self, path, previous, cb=None):
+        """
+        Cambia un camino en marcha por otro que sale del mismo origen (ej: el parcial de una
+        búsqueda por tramos por el definitivo) sin volver atrás: conserva el avance sobre el
+        tramo común o regresa al punto donde ambos se separan.
+        """
+        progress = self.idx if self.is_moving and self.path else len(previous)
+        common = 0
+        for a, b in zip(previous, path):
+            if a != b: break
+            common += 1
+        self.set_path(path, cb)
+        if path and common: self.idx = min(progress, common - 1, len(path) - 1)
+
+    def improve_path(self, path):
+        """
+        Camino mejor desde el mismo origen (búsqueda ANYTIME que sigue afinando). Solo se cambia si aún
+        no se ha pasado del punto donde se separan: como mucho se vuelve a ese punto, como replace_path.
+        """
+        if not self.is_moving or not self.path or not path: return False
+        common = 0
+        for a, b in zip(self.path, path):
+            if a != b: break
+            common += 1
+        if not common or self.idx > common: return False
+        self.replace_path(path, self.path, cb=self.callback)
+        return True
+
     def stop(self): self.is_moving = False; self.path = []; self.dir_x = 0; self.dir_y = 0; self.callback = None
 
     def update(self, char):
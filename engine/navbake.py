@@ -0,0 +1,147 @@
+import os
+import sys
+import mmap
+import struct
+import hashlib
+import pygame
+from array import array
+
+# ==========================================
+#  HORNEADO DE NAVEGACIÓN (OFFLINE)
+# ==========================================
+# Por cada máscara de suelo y tamaño de rejilla se guarda, junto a backgrounds/*_bm.*,
+# un fichero binario con todo lo que Pathfinding calcula al cargar la escena:
+#   máscara de 1 bit (ancho x alto) | rejilla base | islas de suelo | mapa de suelo más cercano
+# En tiempo de juego se abre con mmap y, si el hash coincide, no se decodifica la imagen.
+# Hornear:  python -m engine.navbake [--grid 5 10 20] [mascara_bm.jpg ...]
+
+NAV_MAGIC = b"PCNAV\x01"
+NAV_VERSION = 1            # Subir si cambia el muestreo de la máscara o el formato
+WALKABLE_THRESHOLD = 50    # Canal rojo > 50 = pisable (igual que WalkableArea.is_walkable)
+_HEADER = struct.Struct("<6s2x20s8I") # magic, sha1, ancho, alto, rejilla, cols, filas, islas, versión, reservado
+
+def _align(n): return (n + 3) & ~3
+
+def nav_file_path(mask_file, width, height, grid_size):
+    stem = os.path.splitext(os.path.basename(mask_file))[0]
+    return os.path.join("backgrounds", f"{stem}_{width}x{height}_g{grid_size}.nav")
+
+def content_hash(mask_file, width, height, grid_size):
+    """SHA-1 de la imagen de la máscara + parámetros del horneado. None si no existe la máscara."""
+    try:
+        with open(os.path.join("backgrounds", mask_file), "rb") as f: data = f.read()
+    except OSError: return None
+    h = hashlib.sha1(data)
+    h.update(struct.pack("<5I", width, height, grid_size, WALKABLE_THRESHOLD, NAV_VERSION))
+    h.update(sys.byteorder.encode()) # Las tablas de enteros se leen con el orden nativo
+    return h.digest()
+
+class NavBake:
+    """Vista de solo lectura (mmap) de un fichero .nav. Las tablas son memoryview, sin copiar."""
+    def __init__(self, path, buffer, width, height, grid_size, cols, rows, n_components):
+        self.path = path
+        self._buffer = buffer
+        self.width = width; self.height = height; self.grid_size = grid_size
+        self.cols = cols; self.rows = rows
+        view = memoryview(buffer)
+        offset = _HEADER.size
+        bits_len = (width * height + 7) // 8; cells = cols * rows
+        self.bits = view[offset:offset + bits_len]; offset += _align(bits_len)
+        self.grid = view[offset:offset + cells]; offset += _align(cells)
+        self.labels = view[offset:offset + cells * 4].cast("i"); offset += cells * 4
+        self.nearest = view[offset:offset + cells * 4].cast("i"); offset += cells * 4
+        self.component_sizes = view[offset:offset + (n_components + 1) * 4].cast("i")
+
+    @classmethod
+    def open(cls, mask_file, width, height, grid_size):
+        """Abre el horneado de la escena si existe y su hash coincide con la máscara actual; si no, None."""
+        if not mask_file: return None
+        path = nav_file_path(mask_file, width, height, grid_size)
+        if not os.path.exists(path): return None
+        digest = content_hash(mask_file, width, height, grid_size)
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError): return None
+        try:
+            magic, file_digest, w, h, gs, cols, rows, n_comp, version, _ = _HEADER.unpack_from(buffer, 0)
+            if magic != NAV_MAGIC or version != NAV_VERSION or file_digest != digest: raise ValueError("hash")
+            if (w, h, gs) != (width, height, grid_size): raise ValueError("params")
+            size = _HEADER.size + _align((w * h + 7) // 8) + _align(cols * rows) + cols * rows * 8 + (n_comp + 1) * 4
+            if len(buffer) < size: raise ValueError("truncado")
+        except (struct.error, ValueError):
+            print(f"[NAVBAKE] Outdated bake ignored: {path}")
+            buffer.close(); return None
+        return cls(path, buffer, w, h, gs, cols, rows, n_comp)
+
+    def is_walkable(self, x, y):
+        if x < 0 or x >= self.width or y < 0 or y >= self.height: return False
+        i = int(y) * self.width + int(x)
+        return (self.bits[i >> 3] >> (i & 7)) & 1 == 1
+
+def pack_mask_bits(surface):
+    """Máscara de 1 bit (bit i = píxel i en orden de filas, LSB primero) a partir de la superficie escalada."""
+    w, h = surface.get_size()
+    rgb = pygame.image.tostring(surface, "RGB")
+    walkable = rgb[0::3].translate(bytes(1 if v > WALKABLE_THRESHOLD else 0 for v in range(256)))
+    walkable += bytes(-len(walkable) % 8)
+    bits = bytearray(len(walkable) // 8)
+    for i in range(len(bits)):
+        b = walkable[i * 8:i * 8 + 8]
+        bits[i] = b[0] | b[1] << 1 | b[2] << 2 | b[3] << 3 | b[4] << 4 | b[5] << 5 | b[6] << 6 | b[7] << 7
+    return bits[:(w * h + 7) // 8]
+
+def write_nav_bake(path, digest, width, height, grid_size, cols, rows, bits, grid, labels, nearest, component_sizes):
+    pad = lambda n: bytes(_align(n) - n)
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(NAV_MAGIC, digest, width, height, grid_size, cols, rows, len(component_sizes) - 1, NAV_VERSION, 0))
+        f.write(bytes(bits)); f.write(pad(len(bits)))
+        f.write(bytes(grid)); f.write(pad(len(grid)))
+        for table in (labels, nearest, component_sizes): f.write(array("i", table).tobytes())
+
+def scene_width_for(mask_file):
+    """Ancho de escena que usará Scene.load_assets: el del fondo emparejado (x_bm.jpg -> x.*) escalado al alto de juego."""
+    from config import CONFIG, GAME_AREA_HEIGHT
+    stem = os.path.splitext(mask_file)[0]
+    if stem.endswith("_bm"): stem = stem[:-3]
+    for name in sorted(os.listdir("backgrounds")):
+        if os.path.splitext(name)[0] == stem:
+            img = pygame.image.load(os.path.join("backgrounds", name))
+            return max(CONFIG["GAME_WIDTH"], int(GAME_AREA_HEIGHT * (img.get_width() / img.get_height())))
+    return CONFIG["GAME_WIDTH"]
+
+def bake_mask(mask_file, width, height, grid_sizes):
+    """Hornea una máscara para cada tamaño de rejilla. Devuelve las rutas escritas."""
+    from engine.classes import WalkableArea, Pathfinding
+    area = WalkableArea(mask_file, width, height); area.load()
+    bits = pack_mask_bits(area.get_surface())
+    written = []
+    for gs in grid_sizes:
+        pf = Pathfinding(area, grid_size=gs, limit_rect=pygame.Rect(0, 0, width, height))
+        path = nav_file_path(mask_file, width, height, gs)
+        write_nav_bake(path, content_hash(mask_file, width, height, gs), width, height, gs, pf.grid_cols, pf.grid_rows,
+                       bits, pf.base_grid, pf.labels, pf.nearest_map, pf.component_sizes)
+        written.append(path)
+    area.unload()
+    return written
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    from config import CONFIG, GAME_AREA_HEIGHT
+    grid_sizes = [CONFIG["PATHFINDING_GRID_SIZE"]]
+    if "--grid" in argv:
+        i = argv.index("--grid"); grid_sizes = []
+        while i + 1 < len(argv) and argv[i + 1].isdigit(): grid_sizes.append(int(argv.pop(i + 1)))
+        argv.pop(i)
+    masks = argv or sorted(n for n in os.listdir("backgrounds") if os.path.splitext(n)[0].endswith("_bm"))
+    pygame.init(); pygame.display.set_mode((1, 1))
+    # El horneado representa la escena sin obstáculos: el modo no influye en rejilla, islas ni mapa
+    CONFIG["PATHFINDING_TYPE"] = "EUCLIDEAN"
+    for mask_file in masks:
+        width = scene_width_for(mask_file)
+        for path in bake_mask(mask_file, width, GAME_AREA_HEIGHT, grid_sizes): print(f"[NAVBAKE] {path}")
+    pygame.quit()
+
+if __name__ == "__main__":
+    main()
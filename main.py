@@ -28,7 +28,7 @@ from engine.classes import (
     TRANSITION_SLIDE_UP, TRANSITION_SLIDE_DOWN, TRANSITION_ZOOM, TRANSITION_NONE,
     AnimatedHotspot, AnimatedCharacter, SceneManager, DialogueSystem, 
     TitleMenu, SaveLoadUI, LanguageUI, SystemMenu, TextBox, VerbMenu, 
-    Inventory, DebugConsole, CreditsWindow, MapSystem, Movement, CutsceneManager, update_graphics_metrics, get_sharp_font, draw_text_sharp
+    Inventory, DebugConsole, CreditsWindow, MapSystem, Movement, CutsceneManager, PathService, LightCompositor, DirtyRectTracker, update_graphics_metrics, get_sharp_font, draw_text_sharp
 )
 
 globals().update(CONFIG) # Esto inyecta automáticamente todo el diccionario en el ámbito global del archivo. Perdon a los puristas.
@@ -127,9 +127,12 @@ TEXT_DISPLAY_TIMER = 0
 INFO_TEXT_TIMER = 0
 SCREEN_OVERLAY_TEXT = ""
 CURRENT_CURSOR_STATE = "WALK"
+EXPLORE_UI = (None, None, None, None) # Bajo el ratón este frame: (hotspot, salida, objeto, verbo), ver resolve_explore_ui
 CURRENT_ACTION_ANIM = None
 MUSIC_STOP_TIME = 0.0 
 LAST_EXIT_CLICK_TIME = 0 # --- NUEVO: Variable para el doble clic ---
+PENDING_PATH = None # Búsqueda de camino por tramos en curso (ver smart_move_to)
+REFINING_PATH = None # Camino ANYTIME ya entregado que el PathService sigue mejorando (ticket, mejoras aplicadas)
 DOUBLE_CLICK_THRESHOLD = 400 # Milisegundos para considerar doble clic
 
 # ==========================================
@@ -369,6 +372,18 @@ def draw_debug_overlay(screen, scene, character, movement):
                      txt = font.render(f"SOLID AMBIENT", True, (255, 0, 255))
                      overlay.blit(txt, (col_rect.x, col_rect.y - 15))
 
+        # CONTORNO DEL SUELO PISABLE (VERDE) - sale de la máscara de 1 bit, calculado una vez
+        if scene.walkable_area:
+            for outline in scene.walkable_area.get_outlines():
+                if len(outline) > 1:
+                    pygame.draw.lines(overlay, (0, 200, 0), True, [(x - cam_x, y) for x, y in outline], 1)
+
+        # MALLA DE NAVEGACIÓN (AZUL) - solo en modo "NAVMESH"
+        navmesh = scene.pathfinder.navmesh if scene.pathfinder else None
+        if navmesh:
+            for r in navmesh.rects:
+                pygame.draw.rect(overlay, (80, 140, 255), r.move(-cam_x, 0), 1)
+
         # C) CAMINO (AMARILLO)
         if movement.path and len(movement.path) > 0:
             char_screen_center = (character.rect.centerx - cam_x, character.rect.bottom)
@@ -400,6 +415,12 @@ def draw_debug_overlay(screen, scene, character, movement):
 
         # F) HUD SUPERIOR
         info_str = f"FPS:{int(clock.get_fps())} | CAM_X:{int(cam_x)}"
+        if scene.pathfinder:
+            info_str += f" | PATH CACHE:{scene.pathfinder.cache_hits}/{scene.pathfinder.cache_misses}"
+        if scene.lightmap:
+            tint = character.tint_cache_stats()
+            info_str += f" | TINT:{tint['hit_rate'] * 100:.0f}% {tint['bytes'] // 1024}KB"
+        info_str += f" | PATHS/F:{path_service.throughput} LAT:{path_service.latency_ms:.1f}ms Q:{path_service.in_flight}"
         debug_txt = font.render(info_str, True, (255, 255, 0))    
         pygame.draw.rect(screen, (0,0,0), (0, 0, CONFIG["GAME_WIDTH"], 20))     
         screen.blit(debug_txt, (10, 3))
@@ -635,6 +656,7 @@ def load_and_open_map(lista_nodos_data, imagen_fondo="mapa1.jpg"):
         # Ahora los datos deben ser: (SCENE_ID, x, y, spawnx, spawny, icon)
         scene_id, mx, my, sx, sy, icon = datos # <--- ESTO ES CORRECTO (Pide 6)
         map_system.add_node(scene_id, mx, my, sx, sy, icon)
+        scene_manager.add_map_spawn(scene_id, sx, sy)
     
     # Abrimos mapa pasando el ID de la escena actual
     map_system.open_map(scene_manager.current_scene.id)
@@ -704,6 +726,7 @@ def reset_game_ui_state():
         inventory.active_item = None
         
     if 'movement' in globals():
+        cancel_pending_path()
         movement.stop()
         
     print("[SYSTEM] UI Reset complete (Verbs, Inventory, Movement cleared).")
@@ -726,6 +749,9 @@ player = AnimatedCharacter(
 # ¡¡¡LÍNEA NUEVA OBLIGATORIA!!! 
 # Registramos al jugador en el manager para siempre
 movement = Movement()
+path_service = PathService(workers=CONFIG["PATH_WORKERS"]) # Caminos del jugador, cutscenes y NPCs
+light_compositor = LightCompositor(CONFIG["GAME_WIDTH"], CONFIG["GAME_HEIGHT"]) # Oscuridad y luces de escenas is_dark
+dirty_tracker = DirtyRectTracker((0, 0, CONFIG["GAME_WIDTH"], CONFIG["GAME_HEIGHT"])) # Modo CONFIG["DIRTY_RECTS"]
 textbox = TextBox()
 verb_menu = VerbMenu()
 inventory = Inventory()
@@ -821,22 +847,92 @@ def game_play_event(texto=None, play_sound=None, flag=None, delete_item=None, an
     if play_sound:
         debug_log(f"[EVENT] play_sound:{play_sound}")
 
-def smart_move_to(target_x, target_y, callback=None):
-    global SCREEN_OVERLAY_TEXT, TEXT_DISPLAY_TIMER, INFO_TEXT_TIMER, CURRENT_ACTION_ANIM
-    
+def smart_move_to(target_x, target_y, callback=None, targets=None):
+    """targets: Rect o lista de puntos alternativos; se va al más barato en una sola búsqueda."""
+    global PENDING_PATH
+    cancel_pending_path()
+    movement.stop()
     current_scene = scene_manager.get_current_scene()
     if not current_scene or not current_scene.pathfinder:
-        movement.stop()
         return
-    path = current_scene.pathfinder.find_path(player.rect.centerx, player.rect.bottom, target_x, target_y)
-    
-    if not path:
-        nearest = current_scene.pathfinder.find_nearest_walkable(target_x, target_y, max_radius=120)
+    # Si el destino queda en una isla inalcanzable se camina al punto más cercano posible.
+    # El PathService entrega el camino en su update(); si tarda, el jugador sigue el tramo parcial
+    if targets: ticket = path_service.request_any(current_scene.pathfinder, player.rect.centerx, player.rect.bottom, targets)
+    else: ticket = path_service.request(current_scene.pathfinder, player.rect.centerx, player.rect.bottom, target_x, target_y, snap_to_reachable=True)
+    PENDING_PATH = {"ticket": ticket, "target": (target_x, target_y), "callback": callback, "followed": []}
+
+def walk_to_candidates(hs):
+    """walk_to puede ser un punto (x, y) o una lista de puntos (se acerca por el lado más cercano)."""
+    walk_to = hs.walk_to
+    if walk_to and isinstance(walk_to[0], (tuple, list)): return list(walk_to)
+    return None
+
+def cancel_pending_path():
+    global PENDING_PATH, REFINING_PATH
+    if PENDING_PATH: path_service.cancel(PENDING_PATH["ticket"])
+    if REFINING_PATH: path_service.cancel(REFINING_PATH[0])
+    PENDING_PATH = None; REFINING_PATH = None
+
+def update_pending_path():
+    """Recoge el camino del jugador (llamar una vez por frame, después de path_service.update())."""
+    global PENDING_PATH, REFINING_PATH
+    if REFINING_PATH:
+        # ANYTIME: cada camino mejor que llega sustituye al que se está andando (si aún no se ha pasado del desvío)
+        ticket, seen = REFINING_PATH
+        if ticket.improved != seen:
+            movement.improve_path(ticket.path); REFINING_PATH = (ticket, ticket.improved)
+        if not movement.is_moving or not ticket.job["search"].refining():
+            path_service.cancel(ticket); REFINING_PATH = None
+    if not PENDING_PATH: return
+    ticket = PENDING_PATH["ticket"]
+    if not ticket.done:
+        # Mientras tanto el jugador avanza por el mejor tramo conocido (sin callback: aún no ha llegado)
+        partial = ticket.partial_path()
+        if partial != PENDING_PATH["followed"]:
+            movement.replace_path(partial, PENDING_PATH["followed"])
+            PENDING_PATH["followed"] = partial
+        return
+    pending = PENDING_PATH; PENDING_PATH = None
+    apply_path_result(ticket.path, pending["target"], pending["callback"], pending["followed"], ticket.job["search"].raw_path,
+                      retry=pending.get("retry", True))
+    if ticket.path and movement.is_moving and ticket.job["search"].refining(): REFINING_PATH = (ticket, ticket.improved)
+
+def repair_player_path(scene):
+    """Si un sólido en movimiento bloquea el camino del jugador, lo repara con D* Lite."""
+    pf = scene.pathfinder
+    if not pf or not pf.dirty_cells: return
+    if not movement.is_moving or PENDING_PATH or not movement.path:
+        pf.reset_replanner()
+        return
+    remaining = [(player.rect.centerx, player.rect.bottom)] + movement.path[movement.idx:]
+    if not pf.path_blocked(remaining):
+        # Sin replanificador no hay nada que mantener al día
+        if pf.replanner is None: pf.dirty_cells.clear()
+        return
+    goal = movement.path[-1]
+    path = pf.repair_path(player.rect.centerx, player.rect.bottom, goal[0], goal[1])
+    if path: movement.set_path(path, cb=movement.callback)
+    else: movement.stop()
+
+def apply_path_result(path, target, callback, followed, raw_path=None, retry=True):
+    global SCREEN_OVERLAY_TEXT, TEXT_DISPLAY_TIMER, INFO_TEXT_TIMER, CURRENT_ACTION_ANIM, PENDING_PATH
+    current_scene = scene_manager.get_current_scene()
+    if not path and retry and current_scene and current_scene.pathfinder:
+        nearest = current_scene.pathfinder.find_nearest_walkable(target[0], target[1], max_radius=120)
         if nearest:
-            path = current_scene.pathfinder.find_path(player.rect.centerx, player.rect.bottom, nearest[0], nearest[1])
+            # Segundo intento al suelo más cercano: también por el PathService (presupuesto por frame), una sola vez
+            ticket = path_service.request(current_scene.pathfinder, player.rect.centerx, player.rect.bottom, nearest[0], nearest[1], snap_to_reachable=True)
+            PENDING_PATH = {"ticket": ticket, "target": target, "callback": callback, "followed": [], "retry": False}
+            return
 
     if path:
-        movement.set_path(path, cb=callback) # <--- CAMBIAR 'on_arrival' POR 'cb'
+        if followed and raw_path and current_scene and current_scene.pathfinder:
+            # Venía andando por un tramo parcial: se empalma sobre el camino sin suavizar (mismo prefijo)
+            # y se tensa solo lo que queda desde el waypoint al que ya se dirige
+            movement.replace_path(raw_path, followed, cb=callback)
+            if current_scene.pathfinder.smooth_paths:
+                movement.path = movement.path[:movement.idx] + current_scene.pathfinder.smooth_path(movement.path[movement.idx:])
+        else: movement.replace_path(path, followed, cb=callback)
         verb_menu.clear_selection()
         SCREEN_OVERLAY_TEXT = ""
         TEXT_DISPLAY_TIMER = 0
@@ -884,6 +980,7 @@ def handle_scene_switch(exit_zone):
         exit_zone.target_scene, 
         exit_zone.spawn_point
     )
+    cancel_pending_path()
     movement.stop()
 
 def execute_hotspot_action(hotspot, verb):
@@ -949,14 +1046,7 @@ def execute_hotspot_action(hotspot, verb):
 
         # Actualizar Pathfinding si era sólido
         if getattr(hotspot, 'solid', False):
-            current_s = scene_manager.get_current_scene()
-            # Regenerar obstaculos
-            obs_list = []
-            for hs in current_s.hotspots.hotspots:
-                if getattr(hs, "solid", False): obs_list.append(hs.rect.inflate(10, 10))
-            for anim in current_s.ambient_anims:
-                if getattr(anim, "solid", False): obs_list.append(anim.rect.inflate(0, -4))
-            current_s.pathfinder.obstacles = obs_list
+            scene_manager.get_current_scene().refresh_obstacles()
                
         # Feedback de texto (Traducido si es necesario)
         custom_text = hotspot.actions.get("PICK UP")
@@ -1172,6 +1262,7 @@ dependencies = {
     "play_scene_music": play_scene_music,
     "stop_scene_music": stop_scene_music,
     "cutscene_manager": cutscene_manager,
+    "path_service": path_service, # Para NPCs con AmbientAnimation.navigate_to
     "dialogue_system": dialogue_system,
     "map_system": map_system,
     "ending_manager": ending_manager,
@@ -1489,7 +1580,8 @@ def handle_input_explore(event):
 
             # Caminar normal hacia la salida (Si no fue doble clic, el código sigue y ejecuta esto)
             if button == 1 or button == 3:
-                smart_move_to(world_mx, screen_my, callback=lambda target=hovered_exit: handle_scene_switch(target))
+                # Se camina al borde más cercano de la zona de salida (una búsqueda para todo el rect)
+                smart_move_to(world_mx, screen_my, callback=lambda target=hovered_exit: handle_scene_switch(target), targets=hovered_exit.rect)
                 inventory.active_item = None
             return
         
@@ -1550,17 +1642,21 @@ def handle_input_explore(event):
                     inventory.active_item = None
                     verb_menu.clear_selection()
 
-                dest_x, dest_y = (hovered_hs.walk_to if hovered_hs.walk_to else (hovered_hs.rect.centerx, hovered_hs.rect.bottom + 10))
-                smart_move_to(dest_x, dest_y, callback=do_combination)
+                candidates = walk_to_candidates(hovered_hs)
+                if candidates: dest_x, dest_y = candidates[0]
+                else: dest_x, dest_y = (hovered_hs.walk_to if hovered_hs.walk_to else (hovered_hs.rect.centerx, hovered_hs.rect.bottom + 10))
+                smart_move_to(dest_x, dest_y, callback=do_combination, targets=candidates)
             
             else:
                 # Clic normal sobre hotspot
                 verb = hovered_hs.primary_verb if is_right_click else (sel_verb if sel_verb else hovered_hs.primary_verb)
                 dest_x, dest_y = hovered_hs.rect.centerx, hovered_hs.rect.bottom
-                if hovered_hs.walk_to: dest_x, dest_y = hovered_hs.walk_to
+                candidates = walk_to_candidates(hovered_hs)
+                if candidates: dest_x, dest_y = candidates[0]
+                elif hovered_hs.walk_to: dest_x, dest_y = hovered_hs.walk_to
                 elif verb not in ["LOOK AT", "TALK TO"]: dest_y += 10 
                 else: dest_y += 40 
-                smart_move_to(dest_x, dest_y, callback=lambda hs=hovered_hs, v=verb: execute_hotspot_action(hs, v))
+                smart_move_to(dest_x, dest_y, callback=lambda hs=hovered_hs, v=verb: execute_hotspot_action(hs, v), targets=candidates)
             return
 
         # ================================================================
@@ -1593,25 +1689,12 @@ def force_stop_speech():
     if CURRENT_ACTION_ANIM and "talk" in str(CURRENT_ACTION_ANIM):
         CURRENT_ACTION_ANIM = None
 
-def apply_darkness_effect(screen, radio_luz):
+def apply_darkness_effect(screen, scene):
     """
-    Crea una capa negra sobre la pantalla y recorta un círculo
-    transparente alrededor del ratón usando colorkey.
+    Oscurece la pantalla dejando ver solo las luces de la escena (linterna en el ratón, hogueras, el jugador...).
+    El compositor reutiliza su buffer y sus texturas de luz: no crea superficies en cada frame.
     """
-    # 1. Crear una superficie del tamaño de la pantalla
-    oscuridad = pygame.Surface((CONFIG["GAME_WIDTH"], CONFIG["GAME_HEIGHT"]))
-    oscuridad.fill((0, 0, 0)) # Rellenar de negro total
-    
-    # 2. Si hay radio de luz, recortamos el agujero
-    if radio_luz > 0:
-        mx, my = get_virtual_mouse_pos()
-        # Usamos el color blanco como clave de transparencia (chroma key)
-        oscuridad.set_colorkey((255, 255, 255))
-        # Dibujamos el círculo blanco (que se volverá transparente)
-        pygame.draw.circle(oscuridad, (255, 255, 255), (mx, my), radio_luz)
-    
-    # 3. Dibujar la capa de oscuridad sobre el juego
-    screen.blit(oscuridad, (0, 0))
+    light_compositor.draw(screen, scene, player, get_virtual_mouse_pos())
 
 def draw_map_mode(screen):
     map_system.draw(screen)    
@@ -1642,46 +1725,15 @@ def draw_dialogue_mode(screen):
     pygame.draw.rect(screen, (85, 85, 68), (0, CONFIG["GAME_HEIGHT"] - CONFIG["BOTTOM_MARGIN"], CONFIG["GAME_WIDTH"], CONFIG["BOTTOM_MARGIN"]))   
     
 
-def draw_explore_mode(screen):
+def resolve_explore_ui():
+    """
+    Estado de la UI de este frame: cursor (CURRENT_CURSOR_STATE), frase de la barra inferior y lo que
+    hay bajo el ratón (EXPLORE_UI). Va antes del dibujado para que la firma de rectángulos sucios ya lo vea.
+    """
+    global CURRENT_CURSOR_STATE, EXPLORE_UI
     current_scene = scene_manager.get_current_scene()
-    
-    # --- PROTECCIÓN ANTI-PANTALLA NEGRA ---
     if current_scene is None:
-        # Si intentamos dibujar el juego pero no hay escena, 
-        # forzamos volver al título inmediatamente.
-        global CURRENT_STATE
-        CURRENT_STATE = GameState.TITLE
-        return
-
-    # 1. CAPAS TRASERAS (FONDO, MONTAÑAS, SUELO)
-    current_scene.draw_background_layers(screen)
-
-    # 2. CAPA INTERMEDIA (PERSONAJE, OBJETOS, HOTSPOTS)
-    # Dibuja a player y los objetos ordenados por "Y" para dar profundidad
-    current_scene.draw_sorted_elements(screen, player)
-
-    # 3. CAPAS DELANTERAS (FOREGROUND / NEAR / MÁSCARA)
-    # Dibuja todo lo que tiene factor > 1.0 (Ej: Arbustos, Niebla)
-    # ESTO ES LO QUE TAPA AL PERSONAJE
-    current_scene.draw_foreground_layers(screen)
-
-    # 4 animaciones  ambientales que deben ir SIEMPRE encima (tipo lluvia)
-    current_scene.draw_ambient(screen, layer_filter="front")
-
-    # 5. DEBUG / UI (SIEMPRE LO ÚLTIMO)
-    if CONFIG["DEBUG_MODE"] and not CONFIG["SHOW_HINTS_ONLY"]:
-        draw_debug_overlay(screen, current_scene, player, movement)
-    elif CONFIG["SHOW_HINTS_ONLY"]:
-        draw_hints_overlay(screen, current_scene, current_scene.camera_x)
-
-    # Lógica de Oscuridad (Si la escena es oscura)
-    if current_scene.is_dark:
-        radio_luz = 0 
-        if current_scene.light_flag and GAME_STATE.get(current_scene.light_flag, False):
-            radio_luz = current_scene.light_radius
-        apply_darkness_effect(screen, radio_luz)
-
-    # Interfaz de Usuario (UI)
+        EXPLORE_UI = (None, None, None, None); return
     screen_mx, screen_my = get_virtual_mouse_pos()
     world_mx = screen_mx + current_scene.camera_x
     hovered_hs = current_scene.get_hotspot_at_mouse(screen_mx, screen_my)
@@ -1694,7 +1746,6 @@ def draw_explore_mode(screen):
     sel_verb = verb_menu.get_selected_verb()
 
     # Cursor
-    global CURRENT_CURSOR_STATE
     if sel_verb: CURRENT_CURSOR_STATE = sel_verb
     elif hovered_hs: CURRENT_CURSOR_STATE = hovered_hs.primary_verb
     elif h_item: CURRENT_CURSOR_STATE = "LOOK AT"
@@ -1787,6 +1838,48 @@ def draw_explore_mode(screen):
                 
         textbox.set_text(sentence)
 
+    EXPLORE_UI = (hovered_hs, hovered_exit, h_item, sel_verb)
+
+def draw_explore_mode(screen):
+    current_scene = scene_manager.get_current_scene()
+    
+    # --- PROTECCIÓN ANTI-PANTALLA NEGRA ---
+    if current_scene is None:
+        # Si intentamos dibujar el juego pero no hay escena, 
+        # forzamos volver al título inmediatamente.
+        global CURRENT_STATE
+        CURRENT_STATE = GameState.TITLE
+        return
+
+    # 1. CAPAS TRASERAS (FONDO, MONTAÑAS, SUELO)
+    current_scene.draw_background_layers(screen)
+
+    # 2. CAPA INTERMEDIA (PERSONAJE, OBJETOS, HOTSPOTS)
+    # Dibuja a player y los objetos ordenados por "Y" para dar profundidad
+    current_scene.draw_sorted_elements(screen, player)
+
+    # 3. CAPAS DELANTERAS (FOREGROUND / NEAR / MÁSCARA)
+    # Dibuja todo lo que tiene factor > 1.0 (Ej: Arbustos, Niebla)
+    # ESTO ES LO QUE TAPA AL PERSONAJE
+    current_scene.draw_foreground_layers(screen)
+
+    # 4 animaciones  ambientales que deben ir SIEMPRE encima (tipo lluvia)
+    current_scene.draw_ambient(screen, layer_filter="front")
+
+    # 5. DEBUG / UI (SIEMPRE LO ÚLTIMO)
+    if CONFIG["DEBUG_MODE"] and not CONFIG["SHOW_HINTS_ONLY"]:
+        draw_debug_overlay(screen, current_scene, player, movement)
+    elif CONFIG["SHOW_HINTS_ONLY"]:
+        draw_hints_overlay(screen, current_scene, current_scene.camera_x)
+
+    # Lógica de Oscuridad (Si la escena es oscura)
+    if current_scene.is_dark:
+        apply_darkness_effect(screen, current_scene)
+
+    # Interfaz de Usuario (UI): cursor y frase ya resueltos este frame (resolve_explore_ui)
+    screen_mx, screen_my = get_virtual_mouse_pos()
+    hovered_hs, hovered_exit, h_item, sel_verb = EXPLORE_UI
+
     # Dibujar UI
     # ---------------------------------------------------------
     # GESTIÓN DE UI (VERBOS E INVENTARIO)
@@ -2021,6 +2114,230 @@ def logic_close_menu():
 # --- ¡IMPORTANTE! INYECTAMOS LAS FUNCIONES ---
 save_load_ui.set_callbacks(logic_save_game, logic_load_game, logic_close_menu)
 
+def draw_game_screen():
+    """Pinta el lienzo virtual (screen) según el estado. Con screen.set_clip solo cambia esa zona."""
+    # 2. Limpiamos el lienzo pequeño (screen)
+    screen.fill((0,0,0))
+
+    # --- DIBUJADO DE LA ESCENA SEGÚN ESTADO ---
+    if CURRENT_STATE == GameState.TITLE:
+        title_menu.draw(screen)
+        if credits_window.visible:
+            credits_window.draw(screen)
+
+    elif CURRENT_STATE == GameState.INTRO:
+        intro_manager.draw(screen)
+
+    elif CURRENT_STATE == GameState.MAP: 
+        draw_map_mode(screen)      
+        
+    elif CURRENT_STATE == GameState.DIALOGUE: 
+        draw_dialogue_mode(screen)
+        
+    # EN CUTSCENE Y EXPLORE DIBUJAMOS LO MISMO (EL JUEGO)
+    elif CURRENT_STATE == GameState.CUTSCENE: 
+        draw_explore_mode(screen) 
+            
+    elif CURRENT_STATE == GameState.EXPLORE: 
+        draw_explore_mode(screen)
+    
+    elif CURRENT_STATE == GameState.SAVELOAD:
+        if save_load_ui.previous_state == GameState.TITLE:
+             title_menu.draw(screen)
+        elif scene_manager.current_scene:
+             draw_explore_mode(screen)
+        save_load_ui.draw(screen)
+        
+    elif CURRENT_STATE == GameState.LANGUAGE:
+        title_menu.draw(screen)
+        language_ui.draw(screen)        
+    
+    elif CURRENT_STATE == GameState.ENDING:
+        ending_manager.draw(screen)
+          
+    debug_console.draw(screen)
+
+def present_frame(region=None):
+    """Escala screen a la ventana real y pinta encima la UI HD y el cursor. region: solo ese rect de screen."""
+    # ------------------------------------------
+    # FASE 2: ESCALADO A LA VENTANA REAL
+    # ------------------------------------------
+    # 1. Limpiamos la ventana REAL (Bandas negras)
+    if region is None: real_window.fill((0, 0, 0))
+
+    # 2. Escalamos la imagen del juego (screen) a la ventana (real_window)
+    if region is not None:
+        # Dibujado parcial a escala 1:1: se copia solo el trozo sucio de screen
+        real_window.blit(screen, (offset_x + region.x, offset_y + region.y), region)
+    elif scale_factor != 1.0:
+        # Calculamos el tamaño objetivo
+        target_w = int(CONFIG["GAME_WIDTH"] * scale_factor)
+        target_h = int(CONFIG["GAME_HEIGHT"] * scale_factor)
+        
+        # USAMOS SMOOTHSCALE: Esto aplica el filtro bilineal/bicúbico para que
+        # los gráficos se vean suaves y no pixelados al estirar la imagen.
+        # Si usáramos .scale() se vería pixelado (más rápido pero peor calidad).
+        try:
+            scaled_surface = pygame.transform.smoothscale(screen, (target_w, target_h))
+        except Exception:
+            # Fallback de seguridad por si smoothscale falla en alguna GPU rara
+            scaled_surface = pygame.transform.scale(screen, (target_w, target_h))
+            
+        real_window.blit(scaled_surface, (offset_x, offset_y))
+    else:
+        # Si la ventana coincide exactamente con el juego, copiamos directo (más nitidez pura)
+        real_window.blit(screen, (offset_x, offset_y))
+
+    # ------------------------------------------
+    # FASE 3: UI VECTORIAL / HD (TEXTOS NÍTIDOS)
+    # ------------------------------------------
+    
+    hay_transicion = scene_manager.is_transitioning()
+
+    # 1. ¿DEBEMOS DIBUJAR LA INTERFAZ DEL JUEGO (VERBOS, INVENTARIO)?
+    # Dibujamos si estamos jugando, en dialogo, O si estamos guardando pero venimos del juego.
+    dibujar_ui_juego = False
+    
+    if CURRENT_STATE in [GameState.EXPLORE, GameState.DIALOGUE]:
+        dibujar_ui_juego = True
+    elif CURRENT_STATE == GameState.SAVELOAD and save_load_ui.previous_state != GameState.TITLE:
+        dibujar_ui_juego = False
+    # --- AQUÍ AÑADIMOS EL MAPA ---
+    elif CURRENT_STATE == GameState.MAP:
+        # Dibujamos textos del mapa en HD
+        map_system.draw_text_hd()        
+
+    if dibujar_ui_juego and not hay_transicion:
+        # A) VERBOS E INVENTARIO
+        # --- MODIFICACIÓN: SOLO DIBUJAR VERBOS SI ESTAMOS EN MODO EXPLORAR ---
+        if CURRENT_STATE == GameState.EXPLORE:
+            # Calculamos highlight solo si estamos interactuando
+            suggested_verb = None
+            if verb_menu.selected_verb is None:
+                mx, my = get_virtual_mouse_pos()
+                current_s = scene_manager.get_current_scene()
+                if current_s:
+                    world_mx = mx + current_s.camera_x
+                    hs = current_s.get_hotspot_at_mouse(mx, my)
+                    if hs: suggested_verb = getattr(hs, 'primary_verb', None)
+                    if not suggested_verb:
+                         itm = inventory.get_hovered_item(mx, my)
+                         if itm: suggested_verb = "LOOK AT"
+
+            # DIBUJAMOS LOS TEXTOS DE LOS VERBOS
+            verb_menu.draw_text_hd(highlight_verb=suggested_verb)
+        # ---------------------------------------------------------------------
+        
+        # B) TEXTOS DE DIÁLOGO
+        if CURRENT_STATE == GameState.DIALOGUE:
+            dialogue_system.draw_text_hd()
+        
+        # C) MENÚ DE SISTEMA (F2)
+        if system_menu.visible: 
+            system_menu.draw_text_hd()
+            
+        # D) CAJA DE TEXTO INFERIOR (Frase construida)
+        textbox.draw_text_only()
+
+    # 2. MENÚS SUPERPUESOS (TÍTULO, GUARDAR, IDIOMA)
+    if CURRENT_STATE == GameState.TITLE and not credits_window.visible:
+        title_menu.draw_text_hd()
+        
+    elif CURRENT_STATE == GameState.SAVELOAD:
+        save_load_ui.draw_text_hd() # <-- Esto dibuja el texto de guardar encima de los verbos
+        
+    elif CURRENT_STATE == GameState.LANGUAGE:
+        pass # language_ui.draw_text_hd() si lo implementas
+
+    # 3. TEXTO FLOTANTE (Overlay - "Mirar farol", subtítulos)
+    if SCREEN_OVERLAY_TEXT and not hay_transicion and CURRENT_STATE not in [GameState.SAVELOAD, GameState.ENDING]:
+        cam_x = 0
+        if scene_manager.get_current_scene():
+            cam_x = scene_manager.get_current_scene().camera_x
+        draw_overlay_text(real_window, SCREEN_OVERLAY_TEXT, speaker=CURRENT_SPEAKER_REF, camera_x=cam_x)
+    # ------------------------------------------
+    # FASE 4: CURSOR
+    # ------------------------------------------
+    is_cursor_active = False
+    
+    # Ocultar cursor en Cutscenes y Transiciones
+    if CURRENT_STATE != GameState.CUTSCENE and not hay_transicion:
+        mx, my = get_virtual_mouse_pos()
+        if CURRENT_STATE == GameState.EXPLORE:
+            current_s = scene_manager.get_current_scene()
+            if current_s:
+                world_mx = mx + current_s.camera_x
+                hs = current_s.get_hotspot_at_mouse(mx, my)
+                item = inventory.get_hovered_item(mx, my)
+                exit_z = None
+                for ex in current_s.exits:
+                    if ex.rect.collidepoint(world_mx, my): exit_z = ex
+                if hs or item or exit_z: is_cursor_active = True
+        
+        elif CURRENT_STATE in [GameState.TITLE, GameState.SAVELOAD, GameState.LANGUAGE, GameState.MAP, GameState.DIALOGUE]:
+             is_cursor_active = True
+
+    if CURRENT_STATE not in [GameState.INTRO, GameState.ENDING]:
+        draw_cursor(real_window, is_active=is_cursor_active)
+
+def window_rect_for(rect):
+    """Rect de la ventana real que ocupa un rect del lienzo virtual (con escala y bandas negras)."""
+    gw, gh = CONFIG["GAME_WIDTH"], CONFIG["GAME_HEIGHT"]
+    tw, th = int(gw * scale_factor), int(gh * scale_factor) # Mismo tamaño que el escalado completo
+    x0 = rect.left * tw // gw; y0 = rect.top * th // gh
+    x1 = -(-rect.right * tw // gw); y1 = -(-rect.bottom * th // gh)
+    win_rect = pygame.Rect(offset_x + x0, offset_y + y0, max(1, x1 - x0), max(1, y1 - y0))
+    return win_rect if scale_factor == 1.0 else win_rect.inflate(2, 2) # El filtro de smoothscale toca el píxel vecino
+
+def dirty_frame_state():
+    """
+    (clave del frame, elementos que pueden cambiar) para DirtyRectTracker.
+    Clave None = redibujar todo: fuera de EXPLORE/CUTSCENE, transiciones, debug y su consola, textos flotantes,
+    escenas oscuras o con auto-scroll y ratón fuera del área de juego. La cámara y la ventana van en la clave.
+    Se llama tras resolve_explore_ui: cursor, frase y resaltado ya son los de este frame.
+    """
+    scene = scene_manager.get_current_scene()
+    if (not CONFIG.get("DIRTY_RECTS", False) or CURRENT_STATE not in (GameState.EXPLORE, GameState.CUTSCENE) or scene is None
+            or scene_manager.is_transitioning() or scene.is_dark or scene.auto_scroll_config or SCREEN_OVERLAY_TEXT
+            or CONFIG["DEBUG_MODE"] or CONFIG["SHOW_HINTS_ONLY"] or CONFIG["SHOW_WALKABLE_MASK"] or debug_console.is_visible()
+            or any(menu["is_open"] for menu in system_menu.menus)):
+        return None, {}
+    mx, my = get_virtual_mouse_pos()
+    if not screen.get_rect().collidepoint(mx, my): return None, {}
+    cam = int(scene.camera_x)
+    items = {}
+    draw_rect = player.get_draw_rect()
+    if draw_rect:
+        tint = scene.get_lighting_at(player.rect.centerx, player.rect.bottom)
+        frame = player.animations[player.current_animation].get_current_frame()
+        items["player"] = (draw_rect.move(-cam, 0).inflate(2, 2), (id(frame), tint))
+    for hs in scene.hotspots.hotspots:
+        items[("hs", id(hs))] = (hs.rect.move(-cam, 0), id(hs.image))
+    for anim in scene.ambient_anims:
+        items[("amb", id(anim))] = (anim.rect.move(-cam, 0), id(anim.image))
+    # Cursor (se pinta en la ventana real: su tamaño en píxeles del lienzo depende de la escala)
+    half_w, half_h = cursor_half_size()
+    half_w = int(half_w / scale_factor) + 2; half_h = int(half_h / scale_factor) + 2
+    hovered_hs, hovered_exit, h_item, sel_verb = EXPLORE_UI
+    active = hovered_hs is not None or hovered_exit is not None or h_item is not None # Cursor resaltado (present_frame)
+    items["cursor"] = (pygame.Rect(mx - half_w, my - half_h, half_w * 2, half_h * 2), (CURRENT_CURSOR_STATE, active))
+    # Panel inferior: frase, verbos (resaltado según lo que hay bajo el ratón) e inventario
+    ui_signature = (textbox.current_text, sel_verb, id(hovered_hs), id(hovered_exit), id(h_item), (mx, my) if my >= GAME_AREA_HEIGHT else None,
+                    tuple(id(item) for item in inventory.items), inventory.scroll_offset, id(inventory.active_item))
+    items["ui"] = (pygame.Rect(0, GAME_AREA_HEIGHT, CONFIG["GAME_WIDTH"], CONFIG["GAME_HEIGHT"] - GAME_AREA_HEIGHT), ui_signature)
+    # Barra del menú de sistema (F2): cambia al pasar el ratón por sus títulos
+    if system_menu.visible:
+        items["menubar"] = (pygame.Rect(0, 0, CONFIG["GAME_WIDTH"], system_menu.bar_height),
+                            tuple(menu["rect"].collidepoint(mx, my) for menu in system_menu.menus if menu["rect"]))
+    frame_key = (CURRENT_STATE, scene.id, scene.camera_x, real_window.get_size(), scale_factor, offset_x, offset_y) # camera_x exacta: el parallax usa decimales
+    return frame_key, items
+
+def cursor_half_size():
+    if CONFIG.get("CURSOR_STYLE") == "CLASSIC": return 11, 11
+    sizes = [img.get_size() for pair in CURSOR_IMGS.values() for img in pair]
+    if not sizes: return 6, 6
+    return max(w for w, _ in sizes) // 2 + 1, max(h for _, h in sizes) // 2 + 1
+
 # ==========================================
 #  BUCLE PRINCIPAL (CORREGIDO PARA TURNOS Y RENDERIZADO)
 # ==========================================
@@ -2035,12 +2352,8 @@ while running:
     # ------------------------------------------
     # 1. LIMPIEZA DE PANTALLA (CRÍTICO PARA EVITAR GHOSTING)
     # ------------------------------------------
-    # ARREGLO PROBLEMA 1: Limpiamos la ventana REAL antes de nada.
-    # Si no haces esto, los textos HD del frame anterior se quedan pegados.
-    real_window.fill((0, 0, 0)) 
-    
-    # También limpiamos el lienzo virtual (pixel art)
-    screen.fill((0, 0, 0))
+    # La limpian draw_game_screen (screen) y present_frame (real_window) en cada zona que se repinta:
+    # en un frame completo todo; en modo rectángulos sucios, solo esos rects (el resto sigue válido).
 
     # Recalcular escala (si se redimensiona la ventana)
     calculate_scale_metrics()
@@ -2051,6 +2364,7 @@ while running:
     # 2. GESTIÓN DE EVENTOS (INPUTS)
     # ------------------------------------------
     for event in pygame.event.get():
+        if event.type != pygame.MOUSEMOTION: dirty_tracker.invalidate() # Clics, teclas, ventana: frame completo
         # --- A. EVENTOS DE SISTEMA ---
         if event.type == pygame.QUIT: 
             running = False
@@ -2178,7 +2492,7 @@ while running:
 
     elif CURRENT_STATE == GameState.CUTSCENE:
         # En Cutscenes, actualizamos al manager y también al player si se mueve por script
-        cutscene_manager.update(dt, is_player_moving=movement.is_moving)
+        cutscene_manager.update(dt, is_player_moving=movement.is_moving or PENDING_PATH is not None)
         
         # --- [CORRECCIÓN] GESTIÓN DEL TIEMPO DE TEXTO ---
         if TEXT_DISPLAY_TIMER > 0: 
@@ -2196,6 +2510,9 @@ while running:
         if current_scene:
             current_scene.update_camera(player.rect.centerx, dt)
             current_scene.hotspots.hotspots.update(dt) # Aquí se actualizan los NPCs
+            path_service.update(max_ms=CONFIG["PATHFINDING_BUDGET_MS"], max_expansions=CONFIG["PATHFINDING_BUDGET_NODES"])
+            if current_scene.poi_table: current_scene.poi_table.update(max_ms=CONFIG["POI_TABLE_BUDGET_MS"])
+            update_pending_path()
             movement.update(player)
             
             # Actualizamos escala y animación del jugador
@@ -2242,6 +2559,10 @@ while running:
             current_scene.update_camera(player.rect.centerx, dt) 
             current_scene.hotspots.hotspots.update(dt)            
             current_scene.update_ambient(dt)
+            repair_player_path(current_scene)
+            path_service.update(max_ms=CONFIG["PATHFINDING_BUDGET_MS"], max_expansions=CONFIG["PATHFINDING_BUDGET_NODES"])
+            if current_scene.poi_table: current_scene.poi_table.update(max_ms=CONFIG["POI_TABLE_BUDGET_MS"])
+            update_pending_path()
             movement.update(player)                              
             
             new_scale = current_scene.get_dynamic_scale(player.rect.bottom) 
@@ -2258,166 +2579,32 @@ while running:
     # 1. Actualizamos el fundido/transición
     scene_manager.update_transition(dt)
     
-    # 2. Limpiamos el lienzo pequeño (screen)
-    screen.fill((0,0,0))
-
-    # --- DIBUJADO DE LA ESCENA SEGÚN ESTADO ---
-    if CURRENT_STATE == GameState.TITLE:
-        title_menu.draw(screen)
-        if credits_window.visible:
-            credits_window.draw(screen)
-
-    elif CURRENT_STATE == GameState.INTRO:
-        intro_manager.draw(screen)
-
-    elif CURRENT_STATE == GameState.MAP: 
-        draw_map_mode(screen)      
-        
-    elif CURRENT_STATE == GameState.DIALOGUE: 
-        draw_dialogue_mode(screen)
-        
-    # EN CUTSCENE Y EXPLORE DIBUJAMOS LO MISMO (EL JUEGO)
-    elif CURRENT_STATE == GameState.CUTSCENE: 
-        draw_explore_mode(screen) 
-            
-    elif CURRENT_STATE == GameState.EXPLORE: 
-        draw_explore_mode(screen)
-    
-    elif CURRENT_STATE == GameState.SAVELOAD:
-        if save_load_ui.previous_state == GameState.TITLE:
-             title_menu.draw(screen)
-        elif scene_manager.current_scene:
-             draw_explore_mode(screen)
-        save_load_ui.draw(screen)
-        
-    elif CURRENT_STATE == GameState.LANGUAGE:
-        title_menu.draw(screen)
-        language_ui.draw(screen)        
-    
-    elif CURRENT_STATE == GameState.ENDING:
-        ending_manager.draw(screen)
-          
-    debug_console.draw(screen)
-    
-    # ------------------------------------------
-    # FASE 2: ESCALADO A LA VENTANA REAL
-    # ------------------------------------------
-    # 1. Limpiamos la ventana REAL (Bandas negras)
-    real_window.fill((0, 0, 0))
-
-    # 2. Escalamos la imagen del juego (screen) a la ventana (real_window)
-    if scale_factor != 1.0:
-        # Calculamos el tamaño objetivo
-        target_w = int(CONFIG["GAME_WIDTH"] * scale_factor)
-        target_h = int(CONFIG["GAME_HEIGHT"] * scale_factor)
-        
-        # USAMOS SMOOTHSCALE: Esto aplica el filtro bilineal/bicúbico para que
-        # los gráficos se vean suaves y no pixelados al estirar la imagen.
-        # Si usáramos .scale() se vería pixelado (más rápido pero peor calidad).
-        try:
-            scaled_surface = pygame.transform.smoothscale(screen, (target_w, target_h))
-        except Exception:
-            # Fallback de seguridad por si smoothscale falla en alguna GPU rara
-            scaled_surface = pygame.transform.scale(screen, (target_w, target_h))
-            
-        real_window.blit(scaled_surface, (offset_x, offset_y))
-    else:
-        # Si la ventana coincide exactamente con el juego, copiamos directo (más nitidez pura)
-        real_window.blit(screen, (offset_x, offset_y))
-
-    # ------------------------------------------
-    # FASE 3: UI VECTORIAL / HD (TEXTOS NÍTIDOS)
-    # ------------------------------------------
-    
-    hay_transicion = scene_manager.is_transitioning()
-
-    # 1. ¿DEBEMOS DIBUJAR LA INTERFAZ DEL JUEGO (VERBOS, INVENTARIO)?
-    # Dibujamos si estamos jugando, en dialogo, O si estamos guardando pero venimos del juego.
-    dibujar_ui_juego = False
-    
-    if CURRENT_STATE in [GameState.EXPLORE, GameState.DIALOGUE]:
-        dibujar_ui_juego = True
-    elif CURRENT_STATE == GameState.SAVELOAD and save_load_ui.previous_state != GameState.TITLE:
-        dibujar_ui_juego = False
-    # --- AQUÍ AÑADIMOS EL MAPA ---
-    elif CURRENT_STATE == GameState.MAP:
-        # Dibujamos textos del mapa en HD
-        map_system.draw_text_hd()        
-
-    if dibujar_ui_juego and not hay_transicion:
-        # A) VERBOS E INVENTARIO
-        # --- MODIFICACIÓN: SOLO DIBUJAR VERBOS SI ESTAMOS EN MODO EXPLORAR ---
-        if CURRENT_STATE == GameState.EXPLORE:
-            # Calculamos highlight solo si estamos interactuando
-            suggested_verb = None
-            if verb_menu.selected_verb is None:
-                mx, my = get_virtual_mouse_pos()
-                current_s = scene_manager.get_current_scene()
-                if current_s:
-                    world_mx = mx + current_s.camera_x
-                    hs = current_s.get_hotspot_at_mouse(mx, my)
-                    if hs: suggested_verb = getattr(hs, 'primary_verb', None)
-                    if not suggested_verb:
-                         itm = inventory.get_hovered_item(mx, my)
-                         if itm: suggested_verb = "LOOK AT"
-
-            # DIBUJAMOS LOS TEXTOS DE LOS VERBOS
-            verb_menu.draw_text_hd(highlight_verb=suggested_verb)
-        # ---------------------------------------------------------------------
-        
-        # B) TEXTOS DE DIÁLOGO
-        if CURRENT_STATE == GameState.DIALOGUE:
-            dialogue_system.draw_text_hd()
-        
-        # C) MENÚ DE SISTEMA (F2)
-        if system_menu.visible: 
-            system_menu.draw_text_hd()
-            
-        # D) CAJA DE TEXTO INFERIOR (Frase construida)
-        textbox.draw_text_only()
-
-    # 2. MENÚS SUPERPUESOS (TÍTULO, GUARDAR, IDIOMA)
-    if CURRENT_STATE == GameState.TITLE and not credits_window.visible:
-        title_menu.draw_text_hd()
-        
-    elif CURRENT_STATE == GameState.SAVELOAD:
-        save_load_ui.draw_text_hd() # <-- Esto dibuja el texto de guardar encima de los verbos
-        
-    elif CURRENT_STATE == GameState.LANGUAGE:
-        pass # language_ui.draw_text_hd() si lo implementas
-
-    # 3. TEXTO FLOTANTE (Overlay - "Mirar farol", subtítulos)
-    if SCREEN_OVERLAY_TEXT and not hay_transicion and CURRENT_STATE not in [GameState.SAVELOAD, GameState.ENDING]:
-        cam_x = 0
-        if scene_manager.get_current_scene():
-            cam_x = scene_manager.get_current_scene().camera_x
-        draw_overlay_text(real_window, SCREEN_OVERLAY_TEXT, speaker=CURRENT_SPEAKER_REF, camera_x=cam_x)
-    # ------------------------------------------
-    # FASE 4: CURSOR
-    # ------------------------------------------
-    is_cursor_active = False
-    
-    # Ocultar cursor en Cutscenes y Transiciones
-    if CURRENT_STATE != GameState.CUTSCENE and not hay_transicion:
-        mx, my = get_virtual_mouse_pos()
-        if CURRENT_STATE == GameState.EXPLORE:
-            current_s = scene_manager.get_current_scene()
-            if current_s:
-                world_mx = mx + current_s.camera_x
-                hs = current_s.get_hotspot_at_mouse(mx, my)
-                item = inventory.get_hovered_item(mx, my)
-                exit_z = None
-                for ex in current_s.exits:
-                    if ex.rect.collidepoint(world_mx, my): exit_z = ex
-                if hs or item or exit_z: is_cursor_active = True
-        
-        elif CURRENT_STATE in [GameState.TITLE, GameState.SAVELOAD, GameState.LANGUAGE, GameState.MAP, GameState.DIALOGUE]:
-             is_cursor_active = True
-
-    if CURRENT_STATE not in [GameState.INTRO, GameState.ENDING]:
-        draw_cursor(real_window, is_active=is_cursor_active)    
-    
-    pygame.display.flip()
+    # --- DIBUJADO: COMPLETO O SOLO RECTÁNGULOS SUCIOS ---
+    # Primero la UI del frame (cursor, frase, resaltado): la firma de rectángulos sucios tiene que verla ya
+    if CURRENT_STATE in (GameState.EXPLORE, GameState.CUTSCENE, GameState.SAVELOAD): resolve_explore_ui()
+    dirty_rects = dirty_tracker.update(*dirty_frame_state())
+    if dirty_rects is None:
+        draw_game_screen()
+        present_frame()
+        pygame.display.flip()
+    elif dirty_rects:
+        # Cámara quieta: se repinta solo lo que cambió (recortando con set_clip) y se presenta con display.update.
+        # Con muchos rects sale más barata una sola pasada recortada a la caja que los envuelve
+        for clip in dirty_tracker.draw_passes(dirty_rects):
+            screen.set_clip(clip); draw_game_screen()
+        screen.set_clip(None)
+        window_rects = [window_rect_for(rect) for rect in dirty_rects]
+        if scale_factor == 1.0:
+            for rect, win_rect in zip(dirty_rects, window_rects):
+                real_window.set_clip(win_rect); present_frame(rect)
+            real_window.set_clip(None)
+        else:
+            # smoothscale de un trozo no da los mismos píxeles que el de la pantalla entera: se escala todo
+            # (sigue ahorrando el dibujado de la escena) y solo se envían a la ventana los rects sucios
+            present_frame()
+        pygame.display.update(window_rects)
+    # dirty_rects == []: no cambió nada, la ventana ya muestra este frame
 
+path_service.shutdown()
 pygame.quit()
 sys.exit()
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Benchmark de pathfinding sobre todos los walkmasks de backgrounds/ (sin ventana).
+
+    python -m tests.bench_pathfinding                  # compara con tests/baselines/pathfinding.json
+    python -m tests.bench_pathfinding --update         # guarda los resultados como nueva línea base
+    python -m tests.bench_pathfinding --threshold 25   # % de empeoramiento permitido (por defecto 25)
+    python -m tests.bench_pathfinding --skip-latency   # solo métricas deterministas (otra máquina / CI)
+
+Para cada máscara, tamaño de rejilla y modo se lanza el mismo juego de pares origen/destino
+(con semilla fija) y se mide: latencia p50/p99 (ms), nodos expandidos (media), % de consultas
+sin camino y longitud del camino sin suavizar / óptimo en la rejilla de 8 vecinos (NAVMESH puede
+bajar de 1: traza en cualquier ángulo). Si alguna métrica empeora más del umbral respecto a la
+línea base el proceso termina con código 1. La latencia de cada configuración es ruidosa, así que
+se vigila su media geométrica global (clave "ALL"); las métricas deterministas, una a una.
+"""
+import os
+import sys
+import json
+import math
+import time
+import heapq
+import random
+import gc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+from config import CONFIG, GAME_AREA_HEIGHT
+
+GRID_SIZES = (5, 10, 20)
+MODES = ("EUCLIDEAN", "MANHATTAN", "DIAGONAL", "WEIGHTED", "ANYTIME", "JPS", "NAVMESH", "HPA")
+SEED = 1234
+PAIRS = 100
+REPEATS = 3 # Cada consulta se cronometra varias veces y se queda la mejor (menos ruido en p99)
+THRESHOLD = 25.0
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "pathfinding.json")
+# Holgura absoluta por métrica: por debajo de esto no se considera regresión (ruido del reloj)
+SLACK = {"p50_ms": 0.05, "p99_ms": 0.25, "nodes": 0.5, "unreachable": 1e-9, "length_ratio": 1e-3}
+LATENCY_METRICS = ("p50_ms", "p99_ms")
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+def optimal_cost(grid, cols, rows, start, goal):
+    """Coste óptimo (10 recto / 14 diagonal) entre dos celdas con A* octil, o None."""
+    if not grid[start] or not grid[goal]: return None
+    gx = goal % cols; gy = goal // cols
+    def octile(c):
+        dx = abs(c % cols - gx); dy = abs(c // cols - gy)
+        return 10 * (dx + dy) - 6 * min(dx, dy)
+    best = {start: 0}; heap = [(octile(start), 0, start)]
+    while heap:
+        _, d, u = heapq.heappop(heap)
+        if u == goal: return d
+        if d > best[u]: continue
+        ux = u % cols; uy = u // cols
+        for dx, dy, cost in ((0, -1, 10), (0, 1, 10), (-1, 0, 10), (1, 0, 10), (-1, -1, 14), (-1, 1, 14), (1, -1, 14), (1, 1, 14)):
+            nx = ux + dx; ny = uy + dy
+            if nx < 0 or ny < 0 or nx >= cols or ny >= rows: continue
+            v = ny * cols + nx
+            if grid[v] and d + cost < best.get(v, d + cost + 1):
+                best[v] = d + cost; heapq.heappush(heap, (d + cost + octile(v), d + cost, v))
+    return None
+
+def make_pairs(area, width, height, count, seed):
+    """Pares de puntos pisables (como clics sobre el suelo), siempre los mismos para una semilla."""
+    rnd = random.Random(f"{seed}:{area.mask_file}")
+    points = []
+    while len(points) < count * 2:
+        x = rnd.randrange(width); y = rnd.randrange(height)
+        if area.is_walkable(x, y): points.append((x, y))
+    return list(zip(points[0::2], points[1::2]))
+
+def bench_config(area, width, height, grid_size, mode, pairs):
+    """Métricas de un modo y tamaño de rejilla sobre una máscara ya cargada."""
+    from engine.classes import Pathfinding
+    old_mode = CONFIG["PATHFINDING_TYPE"]; CONFIG["PATHFINDING_TYPE"] = mode
+    try: pf = Pathfinding(area, grid_size=grid_size, limit_rect=pygame.Rect(0, 0, width, height))
+    finally: CONFIG["PATHFINDING_TYPE"] = old_mode
+    pf.smooth_paths = False # Se mide la búsqueda: el suavizado solo acorta el camino
+    cols = pf.grid_cols; gs = grid_size
+    latencies = []; nodes = []; ratios = []; unreachable = 0
+    gc_was_enabled = gc.isenabled(); gc.disable()
+    for (sx, sy), (gx, gy) in pairs:
+        best_ms = math.inf
+        for _ in range(REPEATS):
+            pf.path_cache.clear(); pf.last_expanded = 0
+            t0 = time.perf_counter()
+            path = pf.find_path(sx, sy, gx, gy)
+            best_ms = min(best_ms, (time.perf_counter() - t0) * 1000.0)
+        latencies.append(best_ms)
+        nodes.append(pf.last_expanded)
+        if not path: unreachable += 1; continue
+        # Se mide de esquina de celda a esquina de celda, igual que el óptimo (los extremos exactos no cuentan)
+        ex = min(int(path[-1][0] // gs), cols - 1); ey = min(int(path[-1][1] // gs), pf.grid_rows - 1)
+        length = 0.0; px, py = int(sx // gs) * gs, int(sy // gs) * gs
+        for x, y in path[:-1] + [(ex * gs, ey * gs)]: length += math.hypot(x - px, y - py); px, py = x, y
+        start = int(sy // gs) * cols + int(sx // gs); end = ey * cols + ex
+        best = optimal_cost(pf.static_grid, cols, pf.grid_rows, start, end)
+        if best: ratios.append(length / (best * gs / 10.0))
+    if gc_was_enabled: gc.enable()
+    return {
+        "p50_ms": round(percentile(latencies, 50), 4),
+        "p99_ms": round(percentile(latencies, 99), 4),
+        "nodes": round(sum(nodes) / len(nodes), 2) if nodes else 0.0,
+        "unreachable": round(unreachable / len(pairs), 4) if pairs else 0.0,
+        "length_ratio": round(sum(ratios) / len(ratios), 4) if ratios else 0.0,
+    }
+
+def walkmasks():
+    return sorted(n for n in os.listdir("backgrounds") if os.path.splitext(n)[0].endswith("_bm"))
+
+def run(pair_count=PAIRS, seed=SEED, masks=None, grid_sizes=GRID_SIZES, modes=MODES, log=print):
+    from engine.classes import WalkableArea
+    from engine.navbake import scene_width_for
+    results = {}
+    for mask_file in masks or walkmasks():
+        width = scene_width_for(mask_file)
+        area = WalkableArea(mask_file, width, GAME_AREA_HEIGHT); area.load() # Sin horneado: misma máscara para todas las rejillas
+        pairs = make_pairs(area, width, GAME_AREA_HEIGHT, pair_count, seed)
+        for gs in grid_sizes:
+            for mode in modes:
+                key = f"{mask_file}/g{gs}/{mode}"
+                results[key] = bench_config(area, width, GAME_AREA_HEIGHT, gs, mode, pairs)
+                m = results[key]
+                log(f"{key:42s} p50 {m['p50_ms']:8.3f}ms  p99 {m['p99_ms']:8.3f}ms  nodes {m['nodes']:9.1f}  "
+                    f"unreach {m['unreachable'] * 100:5.1f}%  ratio {m['length_ratio']:.3f}")
+        area.unload()
+    results["ALL"] = {name: round(geomean(m[name] for m in results.values()), 4) for name in LATENCY_METRICS}
+    log(f"{'ALL (geomean)':42s} p50 {results['ALL']['p50_ms']:8.3f}ms  p99 {results['ALL']['p99_ms']:8.3f}ms")
+    return results
+
+def geomean(values):
+    values = [max(v, 1e-6) for v in values]
+    return math.exp(sum(math.log(v) for v in values) / len(values)) if values else 0.0
+
+def compare(baseline, results, threshold=THRESHOLD, skip_latency=False):
+    """Lista de regresiones (clave, métrica, base, actual) de más de threshold %."""
+    regressions = []
+    for key, metrics in results.items():
+        base = baseline.get(key)
+        if not base: continue
+        for name, value in metrics.items():
+            if name not in base: continue
+            if name in LATENCY_METRICS and (skip_latency or key != "ALL"): continue
+            if value > base[name] * (1 + threshold / 100.0) + SLACK.get(name, 0.0):
+                regressions.append((key, name, base[name], value))
+    return regressions
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    threshold = float(argv[argv.index("--threshold") + 1]) if "--threshold" in argv else THRESHOLD
+    pair_count = int(argv[argv.index("--pairs") + 1]) if "--pairs" in argv else PAIRS
+    pygame.init(); pygame.display.set_mode((1, 1))
+    results = run(pair_count)
+    pygame.quit()
+    if "--update" in argv or not os.path.exists(BASELINE_FILE):
+        os.makedirs(os.path.dirname(BASELINE_FILE), exist_ok=True)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({"seed": SEED, "pairs": pair_count, "results": results}, f, indent=1, sort_keys=True)
+        print(f"[BENCH] Baseline saved: {BASELINE_FILE}")
+        return 0
+    with open(BASELINE_FILE) as f: baseline = json.load(f)
+    if baseline.get("pairs") != pair_count or baseline.get("seed") != SEED:
+        print("[BENCH] Baseline was recorded with other pairs/seed; run with --update"); return 1
+    regressions = compare(baseline["results"], results, threshold, "--skip-latency" in argv)
+    for key, name, old, new in regressions: print(f"[BENCH] REGRESSION {key} {name}: {old} -> {new}")
+    print(f"[BENCH] {len(results) - 1} configs, {len(regressions)} regressions (threshold {threshold:.0f}%)")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
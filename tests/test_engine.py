@@ -1,5 +1,7 @@
 import pytest
 import os
+import time
+import math
 import pygame
 from unittest.mock import MagicMock, patch
 
@@ -48,4 +50,712 @@ def test_resource_manager(mock_load, mock_exists):
     assert img is img2
 
 def test_calculo_fuentes():
-    assert TEXT_CONFIG["SIZE_LARGE"] > TEXT_CONFIG["SIZE_SMALL"]
\ No newline at end of file
+    assert TEXT_CONFIG["SIZE_LARGE"] > TEXT_CONFIG["SIZE_SMALL"]
+
+def _crear_pathfinder_prueba(grid_size=10):
+    """Escenario sintético: suelo blanco con un muro negro vertical y un hueco abajo."""
+    from engine.classes import WalkableArea, Pathfinding
+    area = WalkableArea(None, 200, 100)
+    mask = pygame.Surface((200, 100))
+    mask.fill((255, 255, 255))
+    pygame.draw.rect(mask, (0, 0, 0), (95, 0, 10, 70))
+    area.set_mask_surface(mask)
+    return Pathfinding(area, grid_size=grid_size, limit_rect=pygame.Rect(0, 0, 200, 100))
+
+def test_rejilla_ocupacion_pathfinding():
+    pf = _crear_pathfinder_prueba()
+    pf.obstacles = [pygame.Rect(20, 20, 30, 30)]
+    # La rejilla debe coincidir con la comprobación lenta pixel a pixel
+    for cy in range(pf.grid_rows):
+        for cx in range(pf.grid_cols):
+            x, y = cx * pf.grid_size, cy * pf.grid_size
+            slow = pf.limit_rect.collidepoint(x, y) and not any(r.collidepoint(x, y) for r in pf.obstacles) and pf.walkable_area.is_walkable(x, y)
+            assert pf.is_cell_walkable(cx, cy) == slow
+    assert not pf.is_position_valid(30, 30)
+    pf.obstacles = []
+    assert pf.is_position_valid(30, 30)
+    path = pf.find_path(10, 10, 190, 10)
+    assert path and path[-1] == (190, 10)
+
+def test_astar_arrays_igual_que_nodos():
+    pf = _crear_pathfinder_prueba(grid_size=5)
+    pf.obstacles = [pygame.Rect(40, 40, 20, 40)]
+    for start, goal in [((5, 5), (190, 90)), ((10, 90), (150, 20)), ((60, 10), (60, 95))]:
+        gs = pf.grid_size
+        s = (start[0] // gs * gs, start[1] // gs * gs)
+        g = (goal[0] // gs * gs, goal[1] // gs * gs)
+        cells = pf._search_grid((s[1] // gs) * pf.grid_cols + s[0] // gs, (g[1] // gs) * pf.grid_cols + g[0] // gs)
+        por_celdas = [((c % pf.grid_cols) * gs, (c // pf.grid_cols) * gs) for c in cells]
+        assert por_celdas == pf._find_path_nodes(s, g)
+
+def test_jps_camino_valido_y_no_peor():
+    pf = _crear_pathfinder_prueba(grid_size=5)
+    cols = pf.grid_cols
+    start = (1 * cols + 1); goal = (18 * cols + 38)
+    astar = pf._search_grid(start, goal)
+    jps = pf._search_jps(start, goal)
+    def coste(cells):
+        total = 0
+        for a, b in zip(cells, cells[1:]):
+            dx = abs(a % cols - b % cols); dy = abs(a // cols - b // cols)
+            assert max(dx, dy) == 1 and pf.grid[b]
+            total += 14 if dx and dy else 10
+        return total
+    assert jps[0] == start and jps[-1] == goal
+    assert coste(jps) <= coste(astar)
+    pf.mode = "JPS"
+    assert pf.find_path(5, 5, 190, 90)[-1] == (190, 90)
+
+def test_navmesh_pocos_puntos():
+    from engine.classes import CONFIG
+    modo = CONFIG["PATHFINDING_TYPE"]
+    CONFIG["PATHFINDING_TYPE"] = "NAVMESH"
+    try: pf = _crear_pathfinder_prueba()
+    finally: CONFIG["PATHFINDING_TYPE"] = modo
+    nm = pf.navmesh
+    assert nm is not None and nm.locate(100, 50) == -1 and nm.locate(100, 90) >= 0
+    path = pf.find_path(5, 5, 190, 5)
+    assert path[-1] == (190, 5) and len(path) <= 4
+    # Cada tramo recto debe quedar dentro de la malla (rodea el muro por el hueco inferior)
+    for a, b in zip([(5, 5)] + path, path):
+        for i in range(21):
+            x = a[0] + (b[0] - a[0]) * i / 20; y = a[1] + (b[1] - a[1]) * i / 20
+            assert nm.locate(int(x), int(y)) >= 0
+
+def test_navmesh_paso_en_diagonal_como_la_rejilla():
+    from engine.classes import CONFIG, WalkableArea, Pathfinding
+    area = WalkableArea(None, 60, 60)
+    mask = pygame.Surface((60, 60)); mask.fill((0, 0, 0))
+    # Dos zonas que solo se tocan por una esquina: la rejilla cruza en diagonal
+    pygame.draw.rect(mask, (255, 255, 255), (0, 0, 30, 20)); pygame.draw.rect(mask, (255, 255, 255), (30, 20, 30, 20))
+    pygame.draw.rect(mask, (255, 255, 255), (0, 40, 30, 20)) # Y una tercera debajo, por la esquina del otro lado
+    area.set_mask_surface(mask)
+    modo = CONFIG["PATHFINDING_TYPE"]; celda = CONFIG["NAVMESH_CELL_SIZE"]
+    CONFIG["NAVMESH_CELL_SIZE"] = 10 # Malla a la resolución de la rejilla: celda a celda comparables
+    try:
+        CONFIG["PATHFINDING_TYPE"] = "ASTAR"; rejilla = Pathfinding(area, grid_size=10, limit_rect=pygame.Rect(0, 0, 60, 60))
+        CONFIG["PATHFINDING_TYPE"] = "NAVMESH"; malla = Pathfinding(area, grid_size=10, limit_rect=pygame.Rect(0, 0, 60, 60))
+    finally: CONFIG["PATHFINDING_TYPE"] = modo; CONFIG["NAVMESH_CELL_SIZE"] = celda
+    nm = malla.navmesh; cols = rejilla.grid_cols
+    libres = [c for c in range(cols * rejilla.grid_rows) if rejilla.grid[c]]
+    # Misma conectividad: dos celdas están unidas en la malla si y solo si están en la misma isla de la rejilla
+    def isla(p):
+        vistos = {p}; pila = [p]
+        while pila:
+            for b in nm.links[pila.pop()]:
+                if b not in vistos: vistos.add(b); pila.append(b)
+        return vistos
+    for a in libres:
+        alcanzables = isla(nm.owner[a])
+        assert all((nm.owner[b] in alcanzables) == (rejilla.labels[a] == rejilla.labels[b]) for b in libres)
+    assert rejilla.find_path(5, 5, 55, 35)[-1] == (55, 35) and malla.find_path(5, 5, 55, 35)[-1] == (55, 35)
+    assert len(rejilla.component_sizes) == 2 # Una sola isla: se cruza de la tercera a la primera
+    assert rejilla.find_path(5, 55, 5, 5)[-1] == (5, 5) and malla.find_path(5, 55, 5, 5)[-1] == (5, 5)
+
+def test_cache_caminos_lru_e_invalidacion():
+    pf = _crear_pathfinder_prueba()
+    pf.path_cache_size = 2
+    p1 = pf.find_path(5, 5, 190, 5)
+    p2 = pf.find_path(7, 8, 193, 6) # Mismas celdas -> acierto con el destino exacto nuevo
+    assert (pf.cache_hits, pf.cache_misses) == (1, 1)
+    assert p2[:-1] == p1[:-1] and p2[-1] == (193, 6)
+    p2.pop() # El camino devuelto es una copia
+    assert pf.find_path(5, 5, 190, 5) == p1
+    pf.find_path(5, 5, 50, 90); pf.find_path(5, 5, 150, 90)
+    assert len(pf.path_cache) == 2
+    # Al cambiar los obstáculos se vacía la caché: tapar el hueco deja el destino aislado
+    pf.obstacles = [pygame.Rect(95, 70, 10, 30)]
+    assert len(pf.path_cache) == 0
+    assert pf.find_path(5, 5, 190, 5) is None
+
+def test_componentes_destino_inalcanzable():
+    pf = _crear_pathfinder_prueba()
+    # Un muro completo separa el suelo en dos islas
+    pf.obstacles = [pygame.Rect(95, 70, 10, 30)]
+    assert len(pf.component_sizes) == 3
+    left = pf.labels[pf.grid_cols + 1]; right = pf.labels[pf.grid_cols + 18]
+    assert left and right and left != right
+    assert pf.find_path(5, 5, 190, 50) is None and pf.last_expanded == 0
+    path = pf.find_path(5, 5, 190, 50, snap_to_reachable=True)
+    assert path and path[-1] == (90, 50)
+    # Desde la caché sigue acabando en la celda ajustada, no en el destino pedido de la otra isla
+    assert pf.find_path(5, 5, 190, 50, snap_to_reachable=True) == path and pf.cache_hits == 1
+    # Tras recoger el obstáculo vuelve a ser alcanzable
+    pf.obstacles = []
+    assert len(pf.component_sizes) == 2 and pf.find_path(5, 5, 190, 50)[-1] == (190, 50)
+
+def test_suelo_mas_cercano_mapa_distancias():
+    from engine.classes import WalkableArea, Pathfinding
+    area = WalkableArea(None, 200, 100)
+    mask = pygame.Surface((200, 100))
+    mask.fill((0, 0, 0))
+    pygame.draw.rect(mask, (255, 255, 255), (140, 20, 10, 10)) # Isla pequeña que los rayos no tocaban
+    area.set_mask_surface(mask)
+    pf = Pathfinding(area, grid_size=10, limit_rect=pygame.Rect(0, 0, 200, 100))
+    assert pf.find_nearest_walkable(100, 50) == (140, 20)
+    assert pf.find_nearest_walkable(100, 50, max_radius=30) is None
+    assert pf.find_nearest_walkable(145, 25) == (145, 25)
+
+def test_busqueda_por_tramos_reanudable():
+    pf = _crear_pathfinder_prueba(grid_size=5)
+    completo = pf.find_path(5, 5, 190, 5)
+    pf.path_cache.clear()
+    search = pf.start_search(5, 5, 190, 5)
+    assert not search.done and search.partial_path() == []
+    pasos = 0
+    while not search.step(max_expansions=20):
+        pasos += 1
+        parcial = search.partial_path()
+        assert parcial and parcial[0] == completo[0]
+    assert pasos > 1 and search.path == completo
+    # Cancelar deja la búsqueda sin resultado y no la guarda en caché
+    pf.path_cache.clear()
+    search = pf.start_search(5, 5, 190, 5)
+    search.step(max_expansions=5); search.cancel()
+    assert search.step() is False and search.path is None and len(pf.path_cache) == 0
+
+def test_movement_replace_path_sin_volver_atras():
+    from engine.classes import Movement
+    m = Movement()
+    parcial = [(0, 0), (10, 0), (20, 0)]
+    m.set_path(parcial); m.idx = 2
+    m.replace_path([(0, 0), (10, 0), (20, 0), (30, 0)], parcial, cb="fin")
+    assert m.idx == 2 and m.callback == "fin"
+    m.set_path(parcial); m.idx = 2
+    m.replace_path([(0, 0), (10, 0), (10, 10)], parcial)
+    assert m.idx == 1 # Vuelve al punto donde los caminos se separan
+
+def test_path_service_deduplica_y_entrega():
+    from engine.classes import PathService
+    pf = _crear_pathfinder_prueba(grid_size=5)
+    esperado = pf.find_path(5, 5, 190, 5); pf.path_cache.clear()
+    for workers in (0, 2):
+        pf.path_cache.clear()
+        service = PathService(workers=workers)
+        recibidos = []
+        a = service.request(pf, 5, 5, 190, 5, callback=recibidos.append)
+        b = service.request(pf, 5, 5, 190, 5, callback=recibidos.append)
+        c = service.request(pf, 5, 5, 50, 90)
+        service.cancel(c)
+        # Por tramos la cancelación aborta la búsqueda; en un hilo se descarta al terminar
+        assert a.job is b.job and service.in_flight == (1 if workers == 0 else 2)
+        service.update(max_expansions=50)
+        assert service.requests == 3 and service.deduped == 1
+        for _ in range(200):
+            if a.done: break
+            time.sleep(0.001); service.update(max_expansions=50)
+        assert a.done and b.done and not c.done
+        assert recibidos == [esperado, esperado] and recibidos[0] is not recibidos[1]
+        service.shutdown()
+
+def test_path_service_con_hilos_busca_y_cancela_fuera_del_hilo_principal():
+    import threading
+    from engine.classes import PathService
+    pf = _crear_pathfinder_prueba(grid_size=5); pf.mode = "JPS"
+    hilos = []; original = pf.start_search
+    def start_search(*args):
+        hilos.append(threading.current_thread().name); return original(*args)
+    pf.start_search = start_search
+    service = PathService(workers=1)
+    ticket = service.request(pf, 5, 5, 190, 5)
+    for _ in range(500):
+        if ticket.done: break
+        time.sleep(0.001); service.update()
+    # JPS (que se resuelve dentro de start_search) también va al pool: el hilo principal no busca
+    assert ticket.done and ticket.path[-1] == (190, 5) and hilos and all(h.startswith("path") for h in hilos)
+    # Cancelar aborta de verdad la búsqueda del hilo: run() se para y el resultado se descarta
+    grande = _crear_pathfinder_prueba(grid_size=1); grande.path_cache_size = 0
+    tickets = [service.request(grande, 2, 2 + i, 198, 2) for i in range(3)]
+    for t in tickets: service.cancel(t)
+    for _ in range(2000):
+        if not service.in_flight: break
+        time.sleep(0.001); service.update()
+    assert service.in_flight == 0 and not any(t.done for t in tickets)
+    for t in tickets:
+        search = t.job["search"]
+        assert search.cancelled and search.path is None
+    # Una excepción en el hilo no deja el ticket colgado: se entrega sin camino
+    def falla(*args): raise ValueError("rejilla rota")
+    pf.start_search = falla; recibidos = []
+    ticket = service.request(pf, 5, 5, 150, 5, callback=recibidos.append)
+    for _ in range(500):
+        if ticket.done: break
+        time.sleep(0.001); service.update()
+    assert ticket.done and ticket.path is None and recibidos == [None] and service.in_flight == 0
+    assert isinstance(ticket.job["error"], ValueError)
+    service.shutdown()
+
+def test_suavizado_linea_de_vision():
+    pf = _crear_pathfinder_prueba()
+    suave = pf.find_path(5, 5, 190, 5)
+    assert len(suave) <= 5 and suave[-1] == (190, 5)
+    gs = pf.grid_size
+    for a, b in zip(suave, suave[1:]):
+        # Los pasos de una sola celda son movimientos del propio A*; los atajos deben tener visión
+        if max(abs(a[0] - b[0]), abs(a[1] - b[1])) > gs:
+            assert pf.line_of_sight(a[0] // gs, a[1] // gs, b[0] // gs, b[1] // gs)
+    assert not pf.line_of_sight(0, 0, 19, 0) # Atraviesa el muro
+    # Desactivado (por escena) devuelve un waypoint por celda
+    pf.smooth_paths = False; pf.path_cache.clear()
+    crudo = pf.find_path(5, 5, 190, 5)
+    assert len(crudo) > 15 and crudo[0] == suave[0] and crudo[-1] == suave[-1]
+
+def test_obstaculo_dinamico_y_replanificacion():
+    pf = _crear_pathfinder_prueba()
+    camino = pf.repair_path(5, 5, 190, 5)
+    assert camino and camino[-1] == (190, 5)
+    # Un actor sólido tapa el hueco bajo el muro: solo cambian sus celdas y el D* Lite lo detecta
+    pf.set_dynamic_obstacle("carro", pygame.Rect(85, 68, 30, 40))
+    assert pf.dirty_cells and not pf.is_cell_walkable(10, 8) and pf.static_grid[8 * pf.grid_cols + 10]
+    assert pf.path_blocked([(5, 5)] + camino)
+    assert pf.repair_path(5, 5, 190, 5) is None
+    # Se aparta: la reparación reutiliza el planificador y vuelve a encontrar camino
+    planificador = pf.replanner
+    pf.set_dynamic_obstacle("carro", pygame.Rect(150, 20, 10, 10))
+    camino = pf.repair_path(5, 5, 190, 5)
+    assert pf.replanner is planificador and camino and camino[-1] == (190, 5)
+    assert not pf.path_blocked([(5, 5)] + camino)
+    pf.remove_dynamic_obstacle("carro")
+    assert pf.grid == pf.static_grid
+    # Clic sobre un obstáculo dinámico: las islas no lo ven, pero se va a la celda libre más cercana sin agotar la isla
+    pf.set_dynamic_obstacle("carro", pygame.Rect(135, 35, 30, 30))
+    camino = pf.find_path(5, 5, 150, 50)
+    fin = camino[-1]
+    assert pf.grid[(fin[1] // 10) * pf.grid_cols + fin[0] // 10] and math.hypot(fin[0] - 150, fin[1] - 50) <= 30
+    assert pf.last_expanded < 100
+    aciertos = pf.cache_hits
+    assert pf.find_path(5, 5, 150, 50) == camino and pf.cache_hits == aciertos + 1 # La caché no lo lleva a (150, 50)
+
+def test_actor_solido_que_echa_a_andar_pasa_a_dinamico():
+    from engine.classes import WalkableArea, Pathfinding, PathService, Scene, AmbientAnimation
+    area = WalkableArea(None, 400, 200)
+    mask = pygame.Surface((400, 200)); mask.fill((255, 255, 255)); area.set_mask_surface(mask)
+    scene = Scene("CALLE", "Calle", "fondo.jpg")
+    scene.pathfinder = pf = Pathfinding(area, grid_size=10, limit_rect=pygame.Rect(0, 0, 400, 200))
+    carro = AmbientAnimation(50, 100, "no_existe.png", solid=True, move_speed=200)
+    scene.ambient_anims = [carro]; scene.refresh_obstacles()
+    salida = 8 * pf.grid_cols + 5
+    assert not pf.grid[salida] and carro not in pf.dynamic_obstacles # Quieto: estampado como fijo
+    service = PathService()
+    carro.navigate_to(349, 100, pf, service)
+    assert carro in pf.dynamic_obstacles and not pf.obstacles and pf.static_grid[salida] and not pf.grid[salida]
+    for _ in range(100):
+        service.update(); scene.update_ambient(0.05)
+        if not carro.is_moving(): break
+    assert carro.rect.midbottom == (349, 100)
+    assert pf.grid[salida] and not pf.grid[8 * pf.grid_cols + 34] # Bloquea donde está, no donde salió
+    # Un script que le da target_pos directamente también lo pasa a dinámico
+    otro = AmbientAnimation(200, 50, "no_existe.png", solid=True)
+    scene.ambient_anims.append(otro); scene.refresh_obstacles()
+    otro.target_pos = (otro.rect.x, otro.rect.y + 60); otro.loop_move = False
+    for _ in range(40): scene.update_ambient(0.05)
+    assert otro in pf.dynamic_obstacles and pf.grid[3 * pf.grid_cols + 20] and not pf.grid[10 * pf.grid_cols + 20]
+    service.shutdown()
+
+def test_hpa_grafo_de_clusters():
+    from engine.classes import CONFIG
+    modo = CONFIG["PATHFINDING_TYPE"]
+    CONFIG["PATHFINDING_TYPE"] = "HPA"
+    try: pf = _crear_pathfinder_prueba()
+    finally: CONFIG["PATHFINDING_TYPE"] = modo
+    hpa = pf.hpa
+    # 20x10 celdas en clusters de 10: dos clusters unidos solo por el hueco bajo el muro
+    assert len(hpa.cluster_nodes) == 2 and len(hpa.edges) == 2
+    cols = pf.grid_cols
+    cells = hpa.find_cells(1 * cols + 1, 1 * cols + 18)
+    assert cells[0] == 1 * cols + 1 and cells[-1] == 1 * cols + 18
+    for a, b in zip(cells, cells[1:]):
+        assert max(abs(a % cols - b % cols), abs(a // cols - b // cols)) == 1 and pf.grid[b]
+    assert pf.find_path(5, 5, 190, 5)[-1] == (190, 5)
+
+def test_campo_de_flujo_compartido():
+    pf = _crear_pathfinder_prueba()
+    campo = pf.flow_field(190, 5)
+    assert pf.flow_field(195, 8) is campo # Misma celda destino -> mismo campo
+    # Un agente que sigue el campo rodea el muro y llega sin pisar celdas bloqueadas
+    x, y = 5, 5
+    for _ in range(100):
+        punto = campo.next_point(x, y)
+        if punto is None: break
+        assert pf.grid[(punto[1] // 10) * pf.grid_cols + punto[0] // 10]
+        x, y = punto
+    assert (x // 10, y // 10) == (19, 0) and campo.direction(x, y) == (0.0, 0.0)
+    dx, dy = campo.direction(5, 5)
+    assert abs(math.hypot(dx, dy) - 1) < 1e-9
+    pf.obstacles = [pygame.Rect(95, 70, 10, 30)]
+    assert pf.flow_field(190, 5) is not campo and pf.flow_field(190, 5).next_point(5, 5) is None
+
+def test_campos_de_flujo_y_obstaculos_dinamicos():
+    from engine.classes import WalkableArea, Pathfinding, Scene, AmbientAnimation
+    area = WalkableArea(None, 200, 100)
+    mask = pygame.Surface((200, 100)); mask.fill((255, 255, 255))
+    pygame.draw.rect(mask, (0, 0, 0), (95, 0, 10, 100)) # Muro entero: dos islas
+    area.set_mask_surface(mask)
+    pf = Pathfinding(area, grid_size=10, limit_rect=pygame.Rect(0, 0, 200, 100))
+    izquierda = pf.flow_field(5, 5); derecha = pf.flow_field(190, 5)
+    generacion = pf.flow_generation
+    # Un obstáculo que se mueve en la isla izquierda solo descarta el campo de esa isla
+    pf.set_dynamic_obstacle("carro", pygame.Rect(35, 25, 30, 30))
+    assert pf.flow_generation == generacion + 1
+    assert pf.flow_field(190, 5) is derecha and pf.flow_field(5, 5) is not izquierda
+    # Quien sigue un campo viejo lo vuelve a pedir al cambiar la generación y rodea el obstáculo
+    scene = Scene("PLAZA", "Plaza", "fondo.jpg"); scene.pathfinder = pf
+    perro = AmbientAnimation(80, 95, "no_existe.png", move_speed=100)
+    scene.ambient_anims = [perro]; scene.send_crowd_to(5, 5)
+    carro = pygame.Rect(5, 55, 80, 30); pf.set_dynamic_obstacle("carro", carro)
+    viejo = perro.flow; scene.update_ambient(0.01)
+    assert perro.flow is pf.flow_field(5, 5) and perro.flow is not viejo
+    for _ in range(300):
+        scene.update_ambient(0.02)
+        assert not carro.inflate(-10, -10).collidepoint(perro.rect.midbottom) # Margen: se anda por las esquinas de celda
+        if not perro.flow: break
+    assert perro.flow is None and perro.rect.centerx < 30
+    # Un sólido mandado con el campo pasa a obstáculo dinámico (no se queda estampado donde salió)
+    mula = AmbientAnimation(170, 90, "no_existe.png", solid=True)
+    scene.ambient_anims = [mula]; scene.refresh_obstacles()
+    scene.send_crowd_to(190, 5)
+    assert mula in pf.dynamic_obstacles and not pf.obstacles
+
+def test_horneado_navegacion_mmap(tmp_path, monkeypatch):
+    from engine.classes import WalkableArea, Pathfinding
+    from engine.navbake import NavBake, bake_mask
+    monkeypatch.chdir(tmp_path); (tmp_path / "backgrounds").mkdir()
+    mask = pygame.Surface((200, 100)); mask.fill((255, 255, 255))
+    pygame.draw.rect(mask, (0, 0, 0), (95, 0, 10, 70))
+    pygame.image.save(mask, "backgrounds/prueba_bm.png")
+    bake_mask("prueba_bm.png", 200, 100, [10])
+
+    nav = NavBake.open("prueba_bm.png", 200, 100, 10)
+    area = WalkableArea("prueba_bm.png", 200, 100); area.load(nav)
+    assert nav is not None and area.mask is None # No se decodifica la imagen
+    pf = Pathfinding(area, grid_size=10, limit_rect=pygame.Rect(0, 0, 200, 100))
+    ref = _crear_pathfinder_prueba(10)
+    assert bytes(pf.base_grid) == bytes(ref.base_grid)
+    assert list(pf.labels) == list(ref.labels) and list(pf.nearest_map) == list(ref.nearest_map)
+    assert pf.find_path(5, 5, 190, 5) == ref.find_path(5, 5, 190, 5)
+    assert not area.is_walkable(100, 10) and area.is_walkable(100, 80) and not area.is_walkable(-0.5, 80)
+
+    # Si cambia la máscara el hash ya no coincide y se ignora el horneado
+    pygame.draw.rect(mask, (0, 0, 0), (0, 80, 200, 5)); pygame.image.save(mask, "backgrounds/prueba_bm.png")
+    assert NavBake.open("prueba_bm.png", 200, 100, 10) is None
+
+def test_benchmark_pathfinding_metricas_y_regresiones():
+    from tests.bench_pathfinding import bench_config, make_pairs, compare
+    pf = _crear_pathfinder_prueba(10)
+    pf.walkable_area.mask_file = "prueba"
+    pairs = make_pairs(pf.walkable_area, 200, 100, 10, seed=1)
+    assert pairs == make_pairs(pf.walkable_area, 200, 100, 10, seed=1) # Siempre los mismos pares
+    m = bench_config(pf.walkable_area, 200, 100, 10, "EUCLIDEAN", pairs)
+    assert m["unreachable"] == 0 and m["nodes"] > 0 and m["length_ratio"] >= 0.95
+
+    base = {"ALL": {"p50_ms": 1.0, "p99_ms": 2.0}, "x/g10/JPS": {"nodes": 10, "unreachable": 0.0, "p99_ms": 1.0}}
+    new = {"ALL": {"p50_ms": 1.1, "p99_ms": 3.0}, "x/g10/JPS": {"nodes": 15, "unreachable": 0.0, "p99_ms": 9.0}}
+    found = {(k, n) for k, n, _, _ in compare(base, new, threshold=25)}
+    assert found == {("ALL", "p99_ms"), ("x/g10/JPS", "nodes")} # Latencia por configuración: solo informativa
+    assert ("ALL", "p99_ms") not in {(k, n) for k, n, _, _ in compare(base, new, 25, skip_latency=True)}
+
+def test_astar_ponderado_y_anytime_con_cota():
+    from engine.classes import AnytimeSearch
+    from tests.bench_pathfinding import optimal_cost
+    pf = _crear_pathfinder_prueba(10)
+    cols = pf.grid_cols; start = 1 * cols + 1; goal = 1 * cols + 18
+    best = optimal_cost(pf.grid, cols, pf.grid_rows, start, goal)
+    def cost(cells):
+        return sum(14 if a % cols != b % cols and a // cols != b // cols else 10 for a, b in zip(cells, cells[1:]))
+
+    pf.mode = "WEIGHTED"; pf.smooth_paths = False
+    for eps in (1.0, 2.0):
+        pf.epsilon = eps; pf.path_cache.clear()
+        cells = [(y // 10) * cols + x // 10 for x, y in pf.find_path(15, 15, 185, 15)]
+        assert cells[0] == start and cost(cells[:-1] + [goal]) <= eps * best
+
+    # Sin tiempo: primer camino con su cota; con tiempo de sobra llega al óptimo (cota 1.0)
+    quick = AnytimeSearch(pf.grid, cols, pf.grid_rows, start, goal, 3.0, 0.5)
+    assert cost(quick.improve(time.perf_counter())) <= quick.bound * best and quick.bound <= 3.0
+    full = AnytimeSearch(pf.grid, cols, pf.grid_rows, start, goal, 3.0, 0.5)
+    assert cost(full.improve(None)) == best and full.bound == 1.0
+
+def test_anytime_por_tramos_entrega_primero_y_mejora_despues():
+    from engine.classes import PathService, AnytimeSearch, Movement
+    from tests.bench_pathfinding import optimal_cost
+    pf = _crear_pathfinder_prueba(5); pf.mode = "ANYTIME"; pf.smooth_paths = False
+    pf.anytime_start = 3.0; pf.anytime_step = 0.5; pf.anytime_budget_ms = 1000.0
+    cols = pf.grid_cols
+    # Reanudable: sin tiempo no avanza nada, pero conserva lo hecho y termina en llamadas posteriores
+    ara = AnytimeSearch(pf.grid, cols, pf.grid_rows, 1 * cols + 1, 1 * cols + 38, 3.0, 0.5)
+    assert ara.advance(time.perf_counter() - 1) is False and ara.solutions == 0 and ara.expanded > 0
+    while not ara.advance(time.perf_counter() + 0.0001): pass
+    assert ara.solutions == 1 and ara.cells and ara.bound > 1.0
+
+    service = PathService(); recibidos = []
+    ticket = service.request(pf, 5, 5, 190, 5, callback=recibidos.append)
+    assert not ticket.done and service.sliced # Nada síncrono dentro de request()
+    for _ in range(500):
+        if ticket.done: break
+        service.update(max_ms=0.2)
+    # Primer camino (epsilon alto) en cuanto termina la primera pasada; el callback solo se llama una vez
+    assert ticket.done and recibidos == [ticket.path] and ticket.improved == 0
+    primero = list(ticket.path); search = ticket.job["search"]
+    assert search.refining() and service.refining == [ticket.job]
+    for _ in range(500):
+        if not service.refining: break
+        service.update(max_ms=0.2)
+    assert ticket.improved >= 1 and len(recibidos) == 1 and pf.last_bound == 1.0
+    def cost(path):
+        cells = [(y // 5) * cols + x // 5 for x, y in path[:-1]] + [1 * cols + 38]
+        return sum(14 if a % cols != b % cols and a // cols != b // cols else 10 for a, b in zip(cells, cells[1:]))
+    assert cost(ticket.path) == optimal_cost(pf.grid, cols, pf.grid_rows, 1 * cols + 1, 1 * cols + 38) <= cost(primero)
+    # El jugador cambia al camino mejor si aún no ha pasado del punto donde se separan
+    mov = Movement(); mov.set_path(list(primero)); mov.idx = 1
+    assert mov.improve_path(ticket.path) and mov.path == ticket.path and mov.idx <= 1
+    comun = next(i for i, (a, b) in enumerate(zip(primero, ticket.path)) if a != b)
+    mov.set_path(list(primero)); mov.idx = comun + 1
+    assert not mov.improve_path(ticket.path) and mov.path == primero
+    service.shutdown()
+
+def test_consulta_multidestino_elige_el_mas_barato():
+    from engine.classes import PathService
+    from tests.bench_pathfinding import optimal_cost
+    pf = _crear_pathfinder_prueba(10)
+    cols = pf.grid_cols
+    # Dos walk_to alternativos: el de detrás del muro obliga a rodear por el hueco de abajo
+    candidates = [(185, 15), (60, 95)]
+    path = pf.find_path_any(15, 15, candidates)
+    costs = {p: optimal_cost(pf.grid, cols, pf.grid_rows, 1 * cols + 1, (p[1] // 10) * cols + p[0] // 10) for p in candidates}
+    assert path[-1] == min(costs, key=costs.get) == (60, 95)
+
+    # Salida como rect: se llega a su borde más cercano (columna x = 150), no a su centro
+    exit_rect = pygame.Rect(150, 0, 50, 100)
+    path = pf.find_path_any(15, 85, exit_rect)
+    assert path[-1][0] == 150 and exit_rect.collidepoint(path[-1])
+    assert pf.find_path_any(15, 85, [(-50, -50)]) is not None # Fuera del mapa: su suelo más cercano
+
+    service = PathService(workers=0); got = []
+    service.request_any(pf, 15, 15, candidates, callback=got.append)
+    service.update()
+    assert got and got[0][-1] == (60, 95)
+
+def test_tabla_distancias_puntos_interes():
+    from engine.classes import PoiTable
+    from tests.bench_pathfinding import optimal_cost
+    pf = _crear_pathfinder_prueba(10)
+    cols = pf.grid_cols
+    tabla = PoiTable(pf, {"cofre": (15, 15), "puerta": pygame.Rect(150, 0, 50, 100), "banco": [(185, 15), (60, 95)]})
+    # Distancia en px = coste óptimo de la rejilla (10/14 por celda) escalado al tamaño de celda
+    assert tabla.distance("cofre", "cofre") == 0
+    assert tabla.distance("cofre", "banco") == optimal_cost(pf.grid, cols, pf.grid_rows, 1 * cols + 1, 9 * cols + 6)
+    assert tabla.distance("cofre", "puerta") == tabla.distance("puerta", "cofre") > 0
+    assert tabla.eta("cofre", "puerta", speed=100) == tabla.distance("cofre", "puerta") / 100
+    ruta = tabla.route("cofre", "banco")
+    assert ruta[-1] == (60, 95) and tabla.route("cofre", "banco") == ruta
+    assert tabla.distance_from(15, 15, "banco") == tabla.distance("cofre", "banco")
+    # Al poner una caja los campos no se rehacen de golpe: quedan pendientes y update() los avanza por tramos
+    pf.obstacles = [pygame.Rect(120, 10, 20, 20)]
+    assert tabla.update(max_ms=1e-6) is False and set(tabla.pending) == {"cofre", "puerta", "banco"}
+    # Consultar un punto pendiente termina solo su campo; update sin límite termina el resto
+    assert tabla.reachable("cofre", "puerta") and set(tabla.pending) == {"cofre", "banco"}
+    assert tabla.update() and not tabla.pending
+    nueva = PoiTable(pf, tabla.pois)
+    assert tabla.dist == nueva.dist and tabla.route("cofre", "puerta") == nueva.route("cofre", "puerta")
+    # Un muro completo separa las islas: la siguiente consulta ya lo ve
+    pf.obstacles = [pygame.Rect(95, 70, 10, 30)]
+    assert not tabla.reachable("cofre", "puerta") and tabla.route("cofre", "puerta") is None
+    assert tabla.reachable("cofre", "banco")
+    # Un cambio en la otra isla no toca el campo del cofre: se conserva
+    assert tabla.update(); campo_cofre = tabla.fields["cofre"]
+    pf.obstacles = [pygame.Rect(95, 70, 10, 30), pygame.Rect(150, 40, 20, 20)]
+    assert not tabla.update(max_ms=1e-6) and tabla.fields["cofre"] is campo_cofre and "cofre" not in tabla.pending
+
+def test_mascara_suelo_un_bit(tmp_path, monkeypatch):
+    from engine.classes import WalkableArea
+    from engine.navbake import NavBake, bake_mask
+    monkeypatch.chdir(tmp_path); (tmp_path / "backgrounds").mkdir()
+    mask = pygame.Surface((200, 100)); mask.fill((255, 255, 255))
+    pygame.draw.rect(mask, (40, 255, 255), (95, 0, 10, 70)) # Solo cuenta el canal rojo
+    pygame.image.save(mask, "backgrounds/prueba_bm.png")
+    area = WalkableArea("prueba_bm.png", 400, 200); area.load() # Se escala al tamaño de la escena
+    assert isinstance(area.mask, pygame.mask.Mask) and area.mask.get_size() == (400, 200)
+    assert area.is_walkable(0, 0) and area.is_walkable(399.9, 199.9) and not area.is_walkable(200, 20)
+    # Fuera de límites: False sin excepciones (negativos, borde exacto, enormes)
+    for x, y in ((-0.5, 10), (400, 10), (10, 200), (10, -1), (10 ** 9, 10)): assert not area.is_walkable(x, y)
+    # F4 y overlay se generan desde la máscara de 1 bit
+    surface = area.get_surface()
+    assert surface.get_at((0, 0))[:3] == (255, 255, 255) and surface.get_at((200, 20))[:3] == (0, 0, 0)
+    assert area.get_outlines() and area.get_surface() is surface
+
+    # Con horneado la máscara se reconstruye de sus bits solo al pedirla, idéntica a la decodificada
+    bake_mask("prueba_bm.png", 400, 200, [10])
+    baked = WalkableArea("prueba_bm.png", 400, 200); baked.load(NavBake.open("prueba_bm.png", 400, 200, 10))
+    assert baked.mask is None and not baked.is_walkable(-3, 5)
+    assert baked.get_mask().overlap_area(area.mask, (0, 0)) == area.mask.count() == baked.mask.count()
+    area.unload()
+    assert area.mask is None and area.is_walkable(5, 5) and not area.is_walkable(500, 5)
+
+def test_lightmap_reducido_bilineal():
+    from engine.classes import Lightmap, Scene
+    img = pygame.Surface((100, 50)); img.fill((200, 200, 200))
+    pygame.draw.rect(img, (0, 100, 255), (50, 0, 50, 50)) # Mitad derecha azulada
+    lm = Lightmap(img, 400, 200, cell=20)
+    assert (lm.cols, lm.rows) == (20, 10) and len(lm.data) == 20 * 10 * 3
+    cerca = lambda c, ref: all(abs(a - b) <= 3 for a, b in zip(c, ref)) # smoothscale redondea algo
+    assert cerca(lm.sample(10, 100), (200, 200, 200)) and cerca(lm.sample(390, 100), (0, 100, 255))
+    assert lm.sample(-50, -50) == lm.sample(0, 0) and lm.sample(9999, 9999) == lm.sample(399, 199)
+    # En la frontera se interpola: a mitad de camino entre los centros de dos muestras
+    izq = lm.sample(190, 100); der = lm.sample(210, 100)
+    assert lm.sample(200, 100) == tuple(int((a + b) / 2 + 0.5) for a, b in zip(izq, der)) and cerca(lm.sample(200, 100), (100, 150, 228))
+    prev = lm.sample(150, 100) # El salto de 200 de la imagen se reparte en una celda (20 px)
+    for x in range(151, 251):
+        color = lm.sample(x, 100)
+        assert all(abs(a - b) <= 11 for a, b in zip(color, prev)); prev = color
+    puntos = [(10, 100), (200, 100), (390, 100)]
+    assert lm.sample_many(puntos) == [lm.sample(x, y) for x, y in puntos]
+
+    scene = Scene("PRUEBA", "Prueba", "fondo.jpg")
+    assert scene.get_lighting_many(puntos) == [(255, 255, 255)] * 3
+    scene.lightmap = lm
+    assert scene.get_lighting_at(390, 100) == lm.sample(390, 100) and scene.get_lighting_many(puntos) == lm.sample_many(puntos)
+
+def test_cache_frames_tintados():
+    from engine.classes import AnimatedCharacter
+    with patch.object(AnimatedCharacter, "swap_character"): pj = AnimatedCharacter(100, 200)
+    frames = [pygame.Surface((20, 40)) for _ in range(2)]
+    for f in frames: f.fill((200, 200, 200))
+    anim = MagicMock(); anim.get_current_frame.return_value = frames[0]
+    pj.animations = {"walk_right": anim}; pj.current_animation = "walk_right"; pj.current_scale = 1.5
+    pj.tint_cache_size = 3; pantalla = pygame.Surface((200, 300))
+
+    pj.draw(pantalla, tint_color=(250, 130, 66))
+    # Tintes casi iguales caen en el mismo color de la paleta: misma superficie, sin copiar ni escalar
+    tintado = next(iter(pj.tint_cache.values()))
+    assert tintado.get_size() == (30, 60) and tintado.get_at((0, 0))[:3] == (200 * 248 // 255, 200 * 128 // 255, 200 * 64 // 255)
+    pj.draw(pantalla, tint_color=(249, 131, 67))
+    assert pj.tint_cache_stats()["hits"] == 1 and len(pj.tint_cache) == 1
+    # Otro frame, otra escala u otro tinte son entradas distintas; la LRU no pasa del límite
+    anim.get_current_frame.return_value = frames[1]; pj.draw(pantalla, tint_color=(250, 130, 66))
+    pj.current_scale = 1.0; pj.draw(pantalla, tint_color=(250, 130, 66))
+    pj.draw(pantalla, tint_color=(100, 100, 100))
+    stats = pj.tint_cache_stats()
+    assert stats["misses"] == 4 and stats["entries"] == 3 and stats["hit_rate"] == 0.2
+    assert stats["bytes"] == sum(s.get_width() * s.get_height() * s.get_bytesize() for s in pj.tint_cache.values())
+    # Sin tinte no se usa la caché
+    pj.draw(pantalla); assert pj.tint_cache_stats()["misses"] == 4
+
+def test_compositor_luces_sin_superficies_por_frame():
+    from engine.classes import LightCompositor, Scene
+    scene = Scene("OSCURA", "Oscura", "fondo.jpg", is_dark=True, light_flag="farol_prueba", light_radius=20)
+    hoguera = MagicMock(); hoguera.name = "hoguera"; hoguera.rect = pygame.Rect(140, 40, 20, 20)
+    scene.ambient_anims = [hoguera]; scene.camera_x = 50
+    scene.add_light(follow="hoguera", radius=15, color=(255, 120, 0), softness=1.0)
+    scene.add_light(x=30, y=80, radius=10, softness=0)
+    compositor = LightCompositor(200, 100)
+    pantalla = pygame.Surface((200, 100))
+
+    GAME_STATE["farol_prueba"] = False
+    pantalla.fill((200, 200, 200)); compositor.draw(pantalla, scene, mouse_pos=(20, 20))
+    assert pantalla.get_at((20, 20))[:3] == (0, 0, 0) # Sin farol: la linterna del ratón no luce
+    r, g, b = pantalla.get_at((100, 50))[:3] # Hoguera (x 150 - cámara 50), luz naranja
+    assert r >= 190 and 85 <= g <= 95 and b == 0
+    assert pantalla.get_at((108, 50))[0] < 200 # Luz suave: cae hacia el borde
+    assert pantalla.get_at((82, 50))[:3] == (0, 0, 0) and pantalla.get_at((0, 80))[:3] == (0, 0, 0) # Fuera de cualquier luz
+
+    GAME_STATE["farol_prueba"] = True
+    pantalla.fill((200, 200, 200)); compositor.draw(pantalla, scene, mouse_pos=(20, 20))
+    assert pantalla.get_at((20, 20))[:3] == (200, 200, 200)
+    # En régimen estable no se crea ninguna superficie (buffer y texturas se reutilizan)
+    with patch("engine.classes.pygame.Surface") as surface_cls:
+        for _ in range(5): compositor.draw(pantalla, scene, mouse_pos=(60, 30))
+    assert not surface_cls.called and len(compositor.textures) == 3
+    GAME_STATE.pop("farol_prueba")
+
+def test_rectangulos_sucios_solo_lo_que_cambia():
+    from engine.classes import DirtyRectTracker
+    tracker = DirtyRectTracker((0, 0, 800, 600), max_rects=4, max_area=0.25)
+    fondo = pygame.Rect(0, 500, 800, 100)
+    items = {"pj": (pygame.Rect(100, 100, 40, 80), 1), "fuego": (pygame.Rect(500, 300, 30, 30), "f0"), "ui": (fondo, "Ir a")}
+    assert tracker.update(("ESCENA", 0), dict(items)) is None # Primer frame: todo
+    assert tracker.update(("ESCENA", 0), dict(items)) == [] # Nada cambió: ni se dibuja ni se presenta
+    # El personaje se mueve un poco (rect viejo y nuevo se fusionan) y la hoguera cambia de frame
+    items["pj"] = (pygame.Rect(104, 100, 40, 80), 2); items["fuego"] = (pygame.Rect(500, 300, 30, 30), "f1")
+    rects = tracker.update(("ESCENA", 0), dict(items))
+    assert sorted(map(tuple, rects)) == [(100, 100, 44, 80), (500, 300, 30, 30)]
+    # Lo que desaparece (objeto recogido) deja su rect sucio; fuera de pantalla se recorta
+    del items["fuego"]; items["pj"] = (pygame.Rect(780, 100, 40, 80), 2)
+    rects = tracker.update(("ESCENA", 0), dict(items))
+    assert sorted(map(tuple, rects)) == [(104, 100, 40, 80), (500, 300, 30, 30), (780, 100, 20, 80)]
+    # Cámara movida, invalidate() o demasiada área sucia: frame completo
+    assert tracker.update(("ESCENA", 5), dict(items)) is None
+    tracker.invalidate(); assert tracker.update(("ESCENA", 5), dict(items)) is None
+    items["ui"] = (fondo, "Mirar farol"); items["pj"] = (pygame.Rect(0, 0, 400, 300), 3)
+    assert tracker.update(("ESCENA", 5), dict(items)) is None
+    assert tracker.update(None, dict(items)) is None # Clave None: estado sin modo parcial
+    assert (tracker.full_frames, tracker.partial_frames, tracker.idle_frames) == (5, 2, 1)
+    # Pocos rects lejanos: una pasada por rect; muchos (cada pasada recorre la escena): una sola a la caja
+    lejos = [pygame.Rect(10, 10, 20, 20), pygame.Rect(700, 500, 20, 20)]
+    assert tracker.draw_passes(lejos) == lejos and tracker.draw_passes(lejos[:1]) == lejos[:1]
+    muchos = [pygame.Rect(100 + i * 40, 200, 20, 20) for i in range(8)]
+    assert tracker.draw_passes(muchos) == [pygame.Rect(100, 200, 300, 20)]
+
+def test_fondo_compuesto_en_cache_por_camara():
+    from engine.classes import Scene
+    from config import UI_HEIGHT
+    scene = Scene("CAPAS", "Capas", "fondo.jpg")
+    ancho = CONFIG["GAME_WIDTH"]; alto = 60
+    lejos = pygame.Surface((ancho + 40, alto), pygame.SRCALPHA); lejos.fill((0, 0, 200, 255)); lejos.fill((255, 0, 0, 255), (0, 0, 10, alto))
+    suelo = pygame.Surface((ancho * 2, alto // 2), pygame.SRCALPHA); suelo.fill((0, 255, 0, 128))
+    scene.parallax_layers = [{"image": lejos, "factor": 0.5}, {"image": suelo, "factor": 1.0}]
+    scene.parallax_layers_back = list(scene.parallax_layers)
+    pantalla = pygame.Surface((ancho, alto + UI_HEIGHT)); directa = pantalla.copy()
+    for cam in (0, 30.5, 30.5, 30.5, 1000):
+        scene.camera_x = cam
+        pantalla.fill((0, 0, 0)); scene.draw_background_layers(pantalla)
+        directa.fill((0, 0, 0)); scene._draw_layer_group(directa, scene.parallax_layers_back)
+        assert pygame.image.tostring(pantalla, "RGB") == pygame.image.tostring(directa, "RGB")
+    # La capa lejana da la vuelta: cámara 200 * 0.5 -> su franja roja empieza en ancho + 40 - 100
+    scene.camera_x = 200; pantalla.fill((0, 0, 0)); scene.draw_background_layers(pantalla)
+    assert [pantalla.get_at((x, 5))[:3] for x in (ancho - 61, ancho - 60, ancho - 51, ancho - 50)] == [(0, 0, 200), (255, 0, 0), (255, 0, 0), (0, 0, 200)]
+    # Con la cámara quieta no se recompone; cada capa cuesta como mucho dos blits
+    with patch.object(Scene, "_draw_layer_group", wraps=scene._draw_layer_group) as componer:
+        for _ in range(3): scene.draw_background_layers(pantalla)
+        scene.camera_x = 201; scene.draw_background_layers(pantalla)
+    assert componer.call_count == 1
+    lienzo = MagicMock(); Scene._blit_wrapped(lienzo, lejos, 123.7, 0, ancho)
+    assert lienzo.blit.call_count == 2
+    # Con autoscroll o tras descargar la escena no hay caché
+    scene.auto_scroll_config = (0, -15.0)
+    with patch.object(Scene, "_draw_layer_group") as componer:
+        scene.draw_background_layers(pantalla); scene.draw_background_layers(pantalla)
+    assert componer.call_count == 2
+    scene.unload_assets(); assert scene.background_cache is None
+
+def test_cola_de_dibujado_persistente_por_profundidad():
+    from engine.classes import Scene
+    scene = Scene("COLA", "Cola", "fondo.jpg")
+    def objeto(x, y, color):
+        spr = pygame.sprite.Sprite(); spr.image = pygame.Surface((20, 20)); spr.image.fill(color)
+        spr.rect = spr.image.get_rect(topleft=(x, y)); return spr
+    mesa = objeto(100, 100, (255, 0, 0)); silla = objeto(110, 110, (0, 255, 0)); lejos = objeto(5000, 100, (0, 0, 255))
+    scene.hotspots.hotspots.add(silla, mesa, lejos)
+    fuego = MagicMock(layer="back", rect=pygame.Rect(90, 90, 20, 20), image=objeto(0, 0, (255, 255, 0)).image)
+    delante = MagicMock(layer="front", rect=pygame.Rect(0, 0, 20, 20))
+    scene.ambient_anims = [fuego, delante]
+    pj = MagicMock(rect=pygame.Rect(95, 80, 30, 45)); frame_pj = objeto(0, 0, (255, 255, 255)).image
+    pj.get_draw_surface.return_value = (frame_pj, 100, 105)
+    pantalla = MagicMock()
+    scene.draw_sorted_elements(pantalla, pj)
+    # Un solo blits, ordenado por la base de cada elemento; lo que cae fuera de pantalla o va delante no entra
+    pantalla.blits.assert_called_once()
+    lote = pantalla.blits.call_args[0][0]
+    assert [img for img, _ in lote] == [fuego.image, mesa.image, pj.get_draw_surface.return_value[0], silla.image]
+    assert lote[2][1] == (100, 105) and lote[1][1] == (100, 100)
+    # Entre frames la cola se conserva: solo se reordena, y se rehace si cambian los elementos
+    silla.rect.y = 50; scene.camera_x = 10
+    scene.draw_sorted_elements(pantalla, pj)
+    lote = pantalla.blits.call_args[0][0]
+    assert lote[0] == (silla.image, (100, 50)) and scene.render_queue.rebuilds == 1
+    scene.hotspots.hotspots.remove(mesa)
+    scene.draw_sorted_elements(pantalla, pj)
+    assert mesa not in scene.render_queue.items and scene.render_queue.rebuilds == 2
+    # En la pantalla real el personaje (más abajo) tapa a la mesa
+    scene.hotspots.hotspots.add(mesa); scene.camera_x = 0; pj.get_draw_surface.return_value = (frame_pj, 105, 105)
+    real = pygame.Surface((300, 200)); scene.draw_sorted_elements(real, pj)
+    assert real.get_at((110, 110))[:3] == (255, 255, 255) and real.get_at((102, 102))[:3] == (255, 0, 0)